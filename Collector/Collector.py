@@ -25,10 +25,12 @@ import os
 import json
 import base64
 import argparse
-import hashlib
 import platform
 import requests
-from tempfile import mkstemp
+import shutil
+import socket
+import time
+from tempfile import mkdtemp, mkstemp
 from zipfile import ZipFile
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -39,7 +41,10 @@ from FTB.ProgramConfiguration import ProgramConfiguration
 from FTB.Running.AutoRunner import AutoRunner
 from FTB.Signatures.CrashSignature import CrashSignature
 from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.SignatureIndex import SignatureIndex, INDEX_FILE_NAME
 from FTB.ConfigurationFiles import ConfigurationFiles
+from CollectorDaemon import CollectorDaemon, sendRequest, serializeCrashInfo
+from SubmissionSpool import SubmissionSpool, SpoolUploader, SUBMIT_REQUEST_TIMEOUT
 
 
 __all__ = []
@@ -47,6 +52,37 @@ __version__ = 0.1
 __date__ = '2014-10-01'
 __updated__ = '2014-10-01'
 
+# Stores the hashes of our signatures and the ETag of the manifest they are from
+MANIFEST_FILE_NAME = ".signatures.manifest"
+
+# Maximum number of signatures requested at once during refresh
+EXPORT_BATCH_SIZE = 100
+
+# Maximum number of crashes sent to the server at once by submitMany
+BULK_SUBMIT_SIZE = 100
+
+# Seconds the command line --submit action spends uploading the spool before it
+# exits. Whatever isn't uploaded by then is left to the next uploader.
+SUBMIT_UPLOAD_TIMEOUT = 10
+
+# Refresh builds every new version of the signature cache directory in a sibling
+# directory with this suffix and a unique name appended to the cache directory name.
+# The cache directory itself is a symlink to the current generation.
+GENERATION_SUFFIX = ".gen-"
+
+# Generations other than the current and previous one are removed by refresh once
+# they were replaced this many seconds ago. Readers that resolved the cache
+# directory before the generation was replaced can finish within this time.
+GENERATION_GRACE_PERIOD = 600
+
+# When a generation is replaced, an empty file with this suffix is created next
+# to it. Its modification time is the time the generation was replaced.
+REPLACED_SUFFIX = ".replaced"
+
+# Number of times (every 10 ms) search checks for a missing signature cache
+# directory, which is missing for a moment when refresh first turns it into a link.
+MIGRATION_RETRIES = 50
+
 def remote_checks(f):
     'Decorator to perform error checks before using remote features'
     def decorator(self, *args, **kwargs):
@@ -70,7 +106,7 @@ def signature_checks(f):
 class Collector():
     def __init__(self, sigCacheDir=None, serverHost=None, serverPort=None,
                  serverProtocol=None, serverAuthToken=None,
-                 clientId=None, tool=None):
+                 clientId=None, tool=None, daemonSocket=None, spoolDir=None):
         '''
         Initialize the Collector. This constructor will also attempt to read
         a configuration file to populate any missing properties that have not
@@ -88,6 +124,11 @@ class Collector():
         @param clientId: Client ID stored in the server when submitting issues
         @type tool: string
         @param tool: Name of the tool that found this issue
+        @type daemonSocket: string
+        @param daemonSocket: Socket of a local L{CollectorDaemon} to forward searches
+                             and submissions to
+        @type spoolDir: string
+        @param spoolDir: Directory to spool submissions in, see L{SubmissionSpool}
         '''
         self.sigCacheDir = sigCacheDir
         self.serverHost = serverHost
@@ -96,6 +137,11 @@ class Collector():
         self.serverAuthToken = serverAuthToken
         self.clientId = clientId
         self.tool = tool
+        self.daemonSocket = daemonSocket
+        self.spoolDir = spoolDir
+        
+        # Uploads spooled submissions in the background, see startUploader
+        self.uploader = None
         
         # Now search for the global configuration file. If it exists, read its contents
         # and set all Collector settings that haven't been explicitely set by the user.
@@ -128,6 +174,12 @@ class Collector():
                 
             if self.tool == None and "tool" in globalConfig:
                 self.tool = globalConfig["tool"]
+                
+            if self.daemonSocket == None and "daemonsocket" in globalConfig:
+                self.daemonSocket = globalConfig["daemonsocket"]
+                
+            if self.spoolDir == None and "spooldir" in globalConfig:
+                self.spoolDir = globalConfig["spooldir"]
         
         # Set some defaults that we can't set through default arguments, otherwise
         # they would overwrite configuration file settings
@@ -148,9 +200,133 @@ class Collector():
     @signature_checks
     def refresh(self):
         '''
-        Refresh signatures by contacting the server, downloading new signatures
-        and invalidating old ones.
-        '''     
+        Refresh signatures by contacting the server, downloading new and changed
+        signatures and removing the ones that were deleted on the server.
+        
+        The server provides a manifest with a hash of every signature and its
+        metadata. Only the signatures whose hash differs from the one stored with
+        the last refresh are downloaded. The manifest is requested conditionally,
+        so if nothing changed, the server only confirms that. Servers that don't
+        provide a manifest are handled by L{refreshFull}.
+        '''
+        manifestFile = os.path.join(self.sigCacheDir, MANIFEST_FILE_NAME)
+        
+        localManifest = None
+        if os.path.exists(manifestFile):
+            try:
+                with open(manifestFile) as f:
+                    localManifest = json.load(f)
+            except ValueError:
+                print("Warning: Ignoring corrupted signature manifest %s" % manifestFile, file=sys.stderr)
+        
+        if not isinstance(localManifest, dict) or not isinstance(localManifest.get("signatures"), dict):
+            localManifest = { "etag" : None, "signatures" : {} }
+        
+        url = "%s://%s:%s/crashmanager/rest/signatures/manifest/" % (self.serverProtocol, self.serverHost, self.serverPort)
+        headers = dict(Authorization="Token %s" % self.serverAuthToken)
+        if localManifest["etag"]:
+            headers["If-None-Match"] = localManifest["etag"]
+        
+        response = requests.get(url, headers=headers)
+        
+        if response.status_code == requests.codes["not_found"]:
+            return self.refreshFull()
+        
+        if response.status_code == requests.codes["not_modified"]:
+            return
+        
+        if response.status_code != requests.codes["ok"]:
+            raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+        
+        manifest = response.json()
+        manifestEtag = response.headers.get("ETag")
+        
+        if not isinstance(manifest, dict):
+            raise RuntimeError("Server sent malformed JSON response: %s" % manifest)
+        
+        # Apply the changes to a copy of the current generation, so concurrent
+        # searches keep seeing all the signatures we had until we are done.
+        genDir = self.__createGeneration(lambda sigFile: sigFile != INDEX_FILE_NAME)
+        try:
+            self.__updateGeneration(genDir, manifest, manifestEtag, localManifest)
+        except:
+            shutil.rmtree(genDir, ignore_errors=True)
+            raise
+        
+        self.__publishGeneration(genDir)
+    
+    def __updateGeneration(self, genDir, manifest, manifestEtag, localManifest):
+        '''
+        Bring the signatures in a new generation of the signature cache directory
+        up to date with the given manifest, see L{refresh}.
+        '''
+        localSignatures = localManifest["signatures"]
+        
+        # Forget about hashes of signatures that were removed locally, so they are downloaded again
+        for sigId in localSignatures.keys():
+            if not os.path.exists(os.path.join(genDir, sigId + ".signature")):
+                del localSignatures[sigId]
+        
+        # Remove all signatures that are no longer on the server
+        for sigFile in os.listdir(genDir):
+            (sigId, ext) = os.path.splitext(sigFile)
+            if ext in (".signature", ".metadata") and not sigId in manifest:
+                os.remove(os.path.join(genDir, sigFile))
+                localSignatures.pop(sigId, None)
+        
+        changedIds = sorted([sigId for sigId in manifest if localSignatures.get(sigId) != manifest[sigId]], key=int)
+        
+        url = "%s://%s:%s/crashmanager/rest/signatures/export/" % (self.serverProtocol, self.serverHost, self.serverPort)
+        
+        for idx in range(0, len(changedIds), EXPORT_BATCH_SIZE):
+            batch = changedIds[idx:idx + EXPORT_BATCH_SIZE]
+            response = requests.get(url, params=dict(ids=",".join(batch)),
+                                    headers=dict(Authorization="Token %s" % self.serverAuthToken))
+            
+            if response.status_code != requests.codes["ok"]:
+                raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+            
+            exported = response.json()
+            
+            if not isinstance(exported, dict):
+                raise RuntimeError("Server sent malformed JSON response: %s" % exported)
+            
+            # Signatures removed in the meantime are missing here, they are removed with the next refresh
+            for (sigId, export) in exported.items():
+                for (ext, data) in ((".signature", export["signature"]), (".metadata", export["metadata"])):
+                    # The file might be a link to the previous generation, don't write through it
+                    sigFile = os.path.join(genDir, sigId + ext)
+                    if os.path.exists(sigFile):
+                        os.remove(sigFile)
+                    
+                    with open(sigFile, 'w') as f:
+                        f.write(data.encode("utf-8"))
+                
+                localSignatures[sigId] = export["hash"]
+        
+        # Only skip the next manifest if we are fully up to date with this one
+        localManifest["etag"] = None
+        if localSignatures == manifest:
+            localManifest["etag"] = manifestEtag
+        
+        manifestFile = os.path.join(genDir, MANIFEST_FILE_NAME)
+        if os.path.exists(manifestFile):
+            os.remove(manifestFile)
+        
+        with open(manifestFile, 'w') as f:
+            json.dump(localManifest, f)
+        
+        # Compile the new signatures into the index used by search
+        SignatureIndex.rebuild(genDir)
+    
+    @remote_checks
+    @signature_checks
+    def refreshFull(self):
+        '''
+        Refresh signatures by contacting the server, downloading all signatures
+        and replacing the ones we have. Like L{refresh}, this builds a new
+        generation of the signature cache directory.
+        '''
         url = "%s://%s:%s/crashmanager/files/signatures.zip" % (self.serverProtocol, self.serverHost, self.serverPort)
         
         # We need to use basic authentication here because these files are directly served by the HTTP server
@@ -169,26 +345,171 @@ class Collector():
                 zipFile.flush()
         zipFile.close()
         
-        with ZipFile(zipFileName, "r") as zipFile:
-            if zipFile.testzip() != None:
-                raise RuntimeError("Bad CRC for downloaded zipfile %s" % zipFileName)
+        try:
+            with ZipFile(zipFileName, "r") as zipFile:
+                if zipFile.testzip() != None:
+                    raise RuntimeError("Bad CRC for downloaded zipfile %s" % zipFileName)
+                
+                # Start a new generation without our signatures and metadata
+                def keepFile(sigFile):
+                    if sigFile.endswith(".signature") or sigFile.endswith(".metadata") or sigFile in (INDEX_FILE_NAME, MANIFEST_FILE_NAME):
+                        return False
+                    print("Warning: Skipping deletion of non-signature file: %s" % sigFile, file=sys.stderr)
+                    return True
+                
+                genDir = self.__createGeneration(keepFile)
+                try:
+                    zipFile.extractall(genDir)
+                    
+                    # Compile the new signatures into the index used by search
+                    SignatureIndex.rebuild(genDir)
+                except:
+                    shutil.rmtree(genDir, ignore_errors=True)
+                    raise
+        finally:
+            os.remove(zipFileName)
+        
+        self.__publishGeneration(genDir)
+    
+    def __createGeneration(self, keepFile):
+        '''
+        Create a new generation of the signature cache directory, next to it.
+        
+        @type keepFile: function
+        @param keepFile: Called with the name of every file in the current
+                         generation, decides if it is taken over into the new one
+        
+        @rtype: string
+        @return: Path of the new generation
+        '''
+        sigCacheDir = os.path.abspath(self.sigCacheDir)
+        genDir = mkdtemp(prefix=os.path.basename(sigCacheDir) + GENERATION_SUFFIX, dir=os.path.dirname(sigCacheDir))
+        
+        if os.path.isdir(sigCacheDir):
+            # Temporary directories are only accessible by us, keep the permissions we had
+            shutil.copymode(sigCacheDir, genDir)
+            
+            for sigFile in os.listdir(sigCacheDir):
+                oldFile = os.path.join(sigCacheDir, sigFile)
+                if not os.path.isfile(oldFile) or not keepFile(sigFile):
+                    continue
+                
+                # Files are never modified in place, so the generations can share them
+                newFile = os.path.join(genDir, sigFile)
+                try:
+                    os.link(oldFile, newFile)
+                except (AttributeError, OSError):
+                    shutil.copy2(oldFile, newFile)
+        
+        return genDir
+    
+    def __publishGeneration(self, genDir):
+        '''
+        Make the given generation the signature cache directory and remove
+        old generations.
+        
+        The signature cache directory is a symlink that is atomically replaced,
+        so readers always see a complete generation. Readers that resolved the
+        link before can continue to use the previous generation for a while,
+        see L{GENERATION_GRACE_PERIOD}.
+        
+        @type genDir: string
+        @param genDir: The new generation, see L{__createGeneration}
+        '''
+        sigCacheDir = os.path.abspath(self.sigCacheDir)
+        
+        if not hasattr(os, "symlink"):
+            # Without symlinks, replace the contents of the directory instead
+            if os.path.isdir(sigCacheDir):
+                shutil.rmtree(sigCacheDir)
+            os.rename(genDir, sigCacheDir)
+            return
+        
+        # Create the link under a temporary name, renaming it replaces the old link atomically
+        tmpLink = "%s.link-%s" % (sigCacheDir, os.getpid())
+        if os.path.lexists(tmpLink):
+            os.remove(tmpLink)
+        os.symlink(genDir, tmpLink)
+        
+        previousGenDir = None
+        if os.path.islink(sigCacheDir):
+            previousGenDir = os.path.realpath(sigCacheDir)
+        elif os.path.isdir(sigCacheDir):
+            # The cache directory is a regular directory, turn it into the previous
+            # generation. A directory can't be replaced by a link atomically, so it
+            # doesn't exist until the next rename, see L{__getCurrentGeneration}.
+            previousGenDir = mkdtemp(prefix=os.path.basename(sigCacheDir) + GENERATION_SUFFIX, dir=os.path.dirname(sigCacheDir))
+            os.rmdir(previousGenDir)
+            os.rename(sigCacheDir, previousGenDir)
+        
+        os.rename(tmpLink, sigCacheDir)
+        
+        # Remember when the previous generation was replaced, readers might have resolved the link just before
+        if previousGenDir != None:
+            open(previousGenDir + REPLACED_SUFFIX, 'w').close()
+        
+        # Remove old generations, including leftovers of failed refreshes
+        prefix = os.path.basename(sigCacheDir) + GENERATION_SUFFIX
+        parentDir = os.path.dirname(sigCacheDir)
+        for name in os.listdir(parentDir):
+            oldGenDir = os.path.join(parentDir, name)
+            if not name.startswith(prefix) or oldGenDir in (genDir, previousGenDir):
+                continue
             
-            # Now clean the signature directory, only deleting signatures and metadata
-            for sigFile in os.listdir(self.sigCacheDir):
-                if sigFile.endswith(".signature") or sigFile.endswith(".metadata"):
-                    os.remove(os.path.join(self.sigCacheDir, sigFile))
+            if name.endswith(REPLACED_SUFFIX):
+                # Removed along with its generation, unless the generation is already gone
+                if not os.path.exists(oldGenDir[:-len(REPLACED_SUFFIX)]):
+                    try:
+                        os.remove(oldGenDir)
+                    except OSError:
+                        pass
+                continue
+            
+            # Generations that were never published (e.g. after a failed refresh) have no marker
+            replacedFile = oldGenDir + REPLACED_SUFFIX
+            try:
+                if os.path.exists(replacedFile):
+                    replaced = os.stat(replacedFile).st_mtime
                 else:
-                    print("Warning: Skipping deletion of non-signature file: %s" % sigFile, file=sys.stderr)
+                    replaced = os.stat(oldGenDir).st_mtime
+            except OSError:
+                # Removed by a concurrent refresh
+                continue
             
-            zipFile.extractall(self.sigCacheDir)
+            if time.time() - replaced < GENERATION_GRACE_PERIOD:
+                continue
             
-        os.remove(zipFileName)
+            shutil.rmtree(oldGenDir, ignore_errors=True)
+            try:
+                os.remove(replacedFile)
+            except OSError:
+                pass
+    
+    def __getCurrentGeneration(self):
+        '''
+        Resolve the signature cache directory to its current generation.
+        
+        @rtype: string
+        @return: Path of the current generation
+        '''
+        sigCacheDir = os.path.realpath(self.sigCacheDir)
+        
+        # While a refresh turns a regular cache directory into a link to a
+        # generation, the directory briefly doesn't exist, wait for the link.
+        for _ in range(MIGRATION_RETRIES):
+            if os.path.isdir(sigCacheDir):
+                break
+            time.sleep(0.01)
+            sigCacheDir = os.path.realpath(self.sigCacheDir)
+        
+        return sigCacheDir
 
     @remote_checks
     def submit(self, crashInfo, testCase=None, testCaseQuality=0, metaData=None):
         '''
         Submit the given crash information and an optional testcase/metadata
-        to the server for processing and storage.
+        to the server for processing and storage. With a spool directory, the
+        submission is only stored in the spool and uploaded in the background.
         
         @type crashInfo: CrashInfo
         @param crashInfo: CrashInfo instance obtained from L{CrashInfo.fromRawCrashData}
@@ -204,9 +525,71 @@ class Collector():
                          will be stored on the server in JSON format. This metadata is combined
                          with possible metadata stored in the L{ProgramConfiguration} inside crashInfo.
         '''
-        url = "%s://%s:%s/crashmanager/rest/crashes/" % (self.serverProtocol, self.serverHost, self.serverPort)
+        if self.daemonSocket:
+            request = { "action" : "submit", "crashInfo" : serializeCrashInfo(crashInfo), "testCase" : None,
+                        "testCaseExt" : None, "testCaseQuality" : testCaseQuality, "metaData" : metaData }
+            
+            if testCase:
+                with open(testCase, 'rb') as f:
+                    request["testCase"] = f.read().decode("latin-1")
+                request["testCaseExt"] = os.path.splitext(testCase)[1]
+            
+            try:
+                sendRequest(self.daemonSocket, request)
+                return
+            except socket.error, e:
+                print("Warning: Collector daemon unavailable, submitting directly: %s" % e, file=sys.stderr)
+        
+        data = self.__getSubmissionData(crashInfo, testCase, testCaseQuality, metaData)
+        
+        if self.spoolDir:
+            SubmissionSpool(self.spoolDir).add(data)
+            self.startUploader()
+            return
         
-        # Serialize our crash information, testcase and metadata into a dictionary to POST
+        response = self.postSubmission(data)
+        
+        if response.status_code != requests.codes["created"]:
+            raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+    
+    @remote_checks
+    def submitMany(self, submissions):
+        '''
+        Submit many crashes at once. Unless they are handled by a daemon or
+        spooled (see L{submit}), they are sent to the server in bulk requests,
+        which is a lot cheaper for the server than submitting them one by one.
+        
+        @type submissions: list
+        @param submissions: List of tuples (crashInfo, testCase, testCaseQuality, metaData),
+                            each with the meaning of the arguments of L{submit}
+        '''
+        if self.daemonSocket or self.spoolDir:
+            for (crashInfo, testCase, testCaseQuality, metaData) in submissions:
+                self.submit(crashInfo, testCase, testCaseQuality, metaData)
+            return
+        
+        for idx in range(0, len(submissions), BULK_SUBMIT_SIZE):
+            batch = [self.__getSubmissionData(*submission) for submission in submissions[idx:idx + BULK_SUBMIT_SIZE]]
+            
+            response = self.postSubmissions(batch)
+            
+            if response.status_code == requests.codes["not_found"]:
+                # The server doesn't support bulk submissions
+                for data in batch:
+                    response = self.postSubmission(data)
+                    if response.status_code != requests.codes["created"]:
+                        raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+            elif response.status_code != requests.codes["created"]:
+                raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+    
+    def __getSubmissionData(self, crashInfo, testCase=None, testCaseQuality=0, metaData=None):
+        '''
+        Serialize our crash information, testcase and metadata into a dictionary
+        to POST, see L{submit}.
+        
+        @rtype: dict
+        @return: The submission
+        '''
         data = {}
         
         data["rawStdout"] = os.linesep.join(crashInfo.rawStdout)
@@ -251,10 +634,55 @@ class Collector():
         if crashInfo.configuration.args:
             data["args"] = json.dumps(crashInfo.configuration.args)
         
-        response = requests.post(url, data, headers=dict(Authorization="Token %s" % self.serverAuthToken))
+        return data
+    
+    def postSubmission(self, data, timeout=SUBMIT_REQUEST_TIMEOUT):
+        '''
+        POST a submission created by L{submit} to the server.
         
-        if response.status_code != requests.codes["created"]:
-            raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+        @type data: dict
+        @param data: The submission
+        
+        @type timeout: float
+        @param timeout: Seconds to wait for the server to respond
+        
+        @rtype: Response
+        @return: The response of the server
+        '''
+        url = "%s://%s:%s/crashmanager/rest/crashes/" % (self.serverProtocol, self.serverHost, self.serverPort)
+        return requests.post(url, data, headers=dict(Authorization="Token %s" % self.serverAuthToken), timeout=timeout)
+    
+    def postSubmissions(self, dataList, timeout=SUBMIT_REQUEST_TIMEOUT):
+        '''
+        POST many submissions created by L{submit} to the server in one bulk request.
+        
+        @type dataList: list
+        @param dataList: The submissions
+        
+        @type timeout: float
+        @param timeout: Seconds to wait for the server to respond
+        
+        @rtype: Response
+        @return: The response of the server
+        '''
+        url = "%s://%s:%s/crashmanager/rest/crashes/bulk/" % (self.serverProtocol, self.serverHost, self.serverPort)
+        
+        # Like form data, strings that aren't valid UTF-8 get replacement characters
+        body = json.dumps([dict([(key, value.decode("utf-8", "replace") if isinstance(value, str) else value)
+                                 for (key, value) in data.items()]) for data in dataList])
+        
+        return requests.post(url, body, headers={ "Authorization" : "Token %s" % self.serverAuthToken,
+                                                  "Content-Type" : "application/json" }, timeout=timeout)
+    
+    def startUploader(self):
+        '''
+        Start uploading the submissions in our spool directory in a background
+        thread, unless it is running already. Only one process uploads a
+        spool at a time, in others the thread waits until that process exits.
+        '''
+        if self.uploader == None:
+            self.uploader = SpoolUploader(self, SubmissionSpool(self.spoolDir))
+            self.uploader.start()
 
     @signature_checks
     def search(self, crashInfo):
@@ -268,28 +696,26 @@ class Collector():
         @rtype: tuple
         @return: Tuple containing filename of the signature and metadata matching, or None if no match.
         '''
-                
-        cachedSigFiles = os.listdir(self.sigCacheDir)
+        if self.daemonSocket:
+            try:
+                (sigFile, metadata) = sendRequest(self.daemonSocket, { "action" : "search", "crashInfo" : serializeCrashInfo(crashInfo, allowFiles=True) })
+                return (sigFile, metadata)
+            except socket.error, e:
+                print("Warning: Collector daemon unavailable, searching directly: %s" % e, file=sys.stderr)
         
-        for sigFile in cachedSigFiles:
-            if not sigFile.endswith('.signature'):
-                continue
-            
-            sigFile = os.path.join(self.sigCacheDir, sigFile)
-            if not os.path.isdir(sigFile):
-                with open(sigFile) as f:
-                    sigData = f.read()
-                    crashSig = CrashSignature(sigData)
-                    if crashSig.matches(crashInfo):
-                        metadataFile = sigFile.replace('.signature', '.metadata')
-                        metadata = None
-                        if os.path.exists(metadataFile):
-                            with open(metadataFile) as m:
-                                metadata = json.loads(m.read())
-                        
-                        return (sigFile, metadata)
-        
-        return (None, None)
+        # Resolve the current generation of the cache directory once, so a
+        # concurrent refresh can't change the directory under our feet.
+        sigCacheDir = self.__getCurrentGeneration()
+        
+        # The index is loaded only once per process and rebuilt automatically
+        # if the contents of the signature cache directory changed.
+        index = SignatureIndex.forDirectory(sigCacheDir)
+        
+        (sigName, metadata) = index.search(crashInfo)
+        if sigName == None:
+            return (None, None)
+        
+        return (os.path.join(sigCacheDir, sigName), metadata)
     
     @signature_checks
     def generate(self, crashInfo, forceCrashAddress=None, forceCrashInstruction=None, numFrames=None):
@@ -362,7 +788,8 @@ class Collector():
             
     def __store_signature_hashed(self, signature):
         '''
-        Store a signature, using the sha1 hash hex representation as filename.
+        Store a signature, using the hash of its canonical representation as
+        filename, so equivalent signatures are only stored once.
         
         @type signature: CrashSignature
         @param signature: CrashSignature to store
@@ -371,9 +798,7 @@ class Collector():
         @return: Name of the file that the signature was written to
         
         '''
-        h = hashlib.new('sha1')
-        h.update(str(signature))
-        sigfile = os.path.join(self.sigCacheDir, h.hexdigest() + ".signature")
+        sigfile = os.path.join(self.sigCacheDir, CrashSignature.getSignatureHash(str(signature)) + ".signature")
         with open(sigfile, 'w') as f:
             f.write(str(signature))
             
@@ -428,6 +853,8 @@ def main(argv=None):
     parser.add_argument("--generate", dest="generate", action='store_true', help="Create a (temporary) local signature in the cache directory")
     parser.add_argument("--autosubmit", dest="autosubmit", action='store_true', help="Go into auto-submit mode. In this mode, all remaining arguments are interpreted as the crashing command. This tool will automatically obtain GDB crash information and submit it.")
     parser.add_argument("--download", dest="download", type=int, help="Download the testcase for the specified crash entry", metavar="ID")
+    parser.add_argument("--upload", dest="upload", action='store_true', help="Upload all submissions in the spool directory")
+    parser.add_argument("--daemon", dest="daemon", action='store_true', help="Run a daemon serving searches and submissions of local clients on the socket given by --daemonsocket")
 
     # Settings
     parser.add_argument("--sigdir", dest="sigdir", help="Signature cache directory", metavar="DIR")
@@ -441,6 +868,9 @@ def main(argv=None):
     parser.add_argument("--productversion", dest="product_version", help="Product version this crash appeared on", metavar="VERSION")
     parser.add_argument("--os", dest="os", help="OS this crash appeared on", metavar="(windows|linux|macosx|b2g|android)")
     parser.add_argument("--tool", dest="tool", help="Name of the tool that found this issue", metavar="NAME")
+    parser.add_argument("--spooldir", dest="spooldir", help="Directory to spool submissions in, instead of submitting directly. Use --daemon or --upload to upload submissions left in the spool", metavar="DIR")
+    parser.add_argument("--daemonsocket", dest="daemonsocket", help="Unix domain socket of the collector daemon", metavar="FILE")
+    parser.add_argument("--refreshinterval", dest="refreshinterval", type=int, help="In daemon mode, refresh signatures every SECONDS seconds", metavar="SECONDS")
     parser.add_argument('--args', dest='args', nargs='+', type=str, help="List of program arguments. Backslashes can be used for escaping and are stripped.")
     parser.add_argument('--env', dest='env', nargs='+', type=str, help="List of environment variables in the form 'KEY=VALUE'")
     parser.add_argument('--metadata', dest='metadata', nargs='+', type=str, help="List of metadata variables in the form 'KEY=VALUE'")
@@ -465,7 +895,7 @@ def main(argv=None):
     opts = parser.parse_args(argv)
     
     # Check that one action is specified
-    actions = [ "refresh", "submit", "search", "generate", "autosubmit", "download" ]
+    actions = [ "refresh", "submit", "search", "generate", "autosubmit", "download", "upload", "daemon" ]
     
     haveAction = False
     for action in actions:
@@ -508,9 +938,6 @@ def main(argv=None):
             print("Error: Specified binary does not exist: %s" % opts.binary)
             return 2
         
-    stdout = None
-    stderr = None
-    crashdata = None
     crashInfo = None
     args = None
     env = None
@@ -565,19 +992,8 @@ def main(argv=None):
                 print("Error: Must specify at least either --stderr or --crashdata file", file=sys.stderr)
                 return 2
             
-            if opts.stdout:
-                with open(opts.stdout) as f:
-                    stdout = f.read()
-            
-            if opts.stderr:
-                with open(opts.stderr) as f:
-                    stderr = f.read()
-                
-            if opts.crashdata:
-                with open(opts.crashdata) as f:
-                    crashdata = f.read()
-
-            crashInfo = CrashInfo.fromRawCrashData(stdout, stderr, configuration, auxCrashData=crashdata)
+            # Logs can be very large, so don't read them into memory
+            crashInfo = CrashInfo.fromFiles(opts.stdout, opts.stderr, configuration, auxCrashDataFile=opts.crashdata)
             if opts.testcase:
                 (testCaseData, isBinary) = Collector.read_testcase(opts.testcase)
                 if not isBinary:
@@ -588,7 +1004,25 @@ def main(argv=None):
         with open(opts.serverauthtokenfile) as f:
             serverauthtoken = f.read().rstrip()
 
-    collector = Collector(opts.sigdir, opts.serverhost, opts.serverport, opts.serverproto, serverauthtoken, opts.clientid, opts.tool)
+    collector = Collector(opts.sigdir, opts.serverhost, opts.serverport, opts.serverproto, serverauthtoken, opts.clientid, opts.tool,
+                          opts.daemonsocket, opts.spooldir)
+    
+    if opts.daemon:
+        if not collector.daemonSocket:
+            print("Error: Action --daemon requires a socket (--daemonsocket or configuration property: daemonsocket)", file=sys.stderr)
+            return 2
+        
+        CollectorDaemon(collector, collector.daemonSocket, opts.refreshinterval).serveForever()
+        return 0
+    
+    if opts.upload:
+        if not collector.spoolDir:
+            print("Error: Action --upload requires a spool directory (--spooldir or configuration property: spooldir)", file=sys.stderr)
+            return 2
+        
+        count = SpoolUploader(collector, SubmissionSpool(collector.spoolDir)).uploadAll()
+        print("Uploaded %s submissions" % count)
+        return 0
     
     if opts.refresh:
         collector.refresh()
@@ -596,7 +1030,21 @@ def main(argv=None):
         
     if opts.submit:
         testcase = opts.testcase        
+        
+        # A background uploader would die with this process, so we upload synchronously
+        # instead. Setting our uploader keeps submit from starting the background one.
+        uploader = None
+        if collector.spoolDir:
+            uploader = SpoolUploader(collector, SubmissionSpool(collector.spoolDir))
+            collector.uploader = uploader
+        
         collector.submit(crashInfo, testcase, opts.testcasequality, metadata)
+        
+        if uploader != None:
+            try:
+                uploader.uploadAll(SUBMIT_UPLOAD_TIMEOUT)
+            except RuntimeError, e:
+                print("Warning: Submission remains spooled in %s: %s" % (collector.spoolDir, e), file=sys.stderr)
         return 0
     
     if opts.search:
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Collector Daemon -- Serves signature searches and submissions to local clients
+
+Loading the signatures of a large signature cache directory is expensive. This
+daemon keeps the signatures loaded and answers the searches (and submissions)
+of all fuzzers running on the same machine over a Unix domain socket. A Collector
+configured with the socket (configuration property: daemonsocket) forwards its
+requests to the daemon and only falls back to doing the work itself if the
+daemon isn't running.
+
+Every request is a single line of JSON sent over a new connection, the daemon
+answers with a single line of JSON and closes the connection. Crash data and
+testcases are transferred as Latin-1 strings, so arbitrary bytes survive the
+JSON encoding unchanged. Searches for crashes read with L{CrashInfo.fromFiles}
+only send the paths of the files, the daemon maps them itself. The socket is
+only accessible by the user running the daemon.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import json
+import os
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.LineBuffer import LineBuffer
+from FTB.Signatures.SignatureIndex import SignatureIndex
+
+def _getText(lines):
+    if isinstance(lines, LineBuffer):
+        return lines.getText()
+    return "\n".join(lines)
+
+def serializeCrashInfo(crashInfo, allowFiles=False):
+    '''
+    Serialize the raw data, configuration and testcase of a crash for a request
+    to the daemon.
+
+    @type crashInfo: CrashInfo
+    @param crashInfo: The crash to serialize
+    @type allowFiles: bool
+    @param allowFiles: If the crash was read with L{CrashInfo.fromFiles}, send
+                       the paths of the files instead of their contents.
+
+    @rtype: dict
+    @return: JSON serializable representation of the crash
+    '''
+    configuration = crashInfo.configuration
+
+    obj = {
+           "product" : configuration.product,
+           "platform" : configuration.platform,
+           "os" : configuration.os,
+           "version" : configuration.version,
+           "env" : configuration.env,
+           "args" : configuration.args,
+           "metadata" : configuration.metadata,
+           }
+
+    if allowFiles and crashInfo.rawFiles != None:
+        # Copying and decoding large logs is expensive, and the daemon would
+        # have to parse them as a whole again.
+        obj["rawFiles"] = list(crashInfo.rawFiles)
+    else:
+        obj["rawStdout"] = _getText(crashInfo.rawStdout).decode("latin-1")
+        obj["rawStderr"] = _getText(crashInfo.rawStderr).decode("latin-1")
+        obj["rawCrashData"] = None
+
+        # Without crash data, the crash is parsed from stderr
+        if crashInfo.useCrashData:
+            obj["rawCrashData"] = _getText(crashInfo.rawCrashData).decode("latin-1")
+
+    testcase = crashInfo.testcase
+    if isinstance(testcase, LineBuffer):
+        testcase = testcase.getText()
+    if testcase != None:
+        obj["testcase"] = testcase.decode("latin-1")
+
+    return obj
+
+def deserializeCrashInfo(obj):
+    '''
+    Create the crash information for a crash serialized by L{serializeCrashInfo}.
+
+    @type obj: dict
+    @param obj: The serialized crash
+
+    @rtype: CrashInfo
+    @return: Crash information object
+    '''
+    configuration = ProgramConfiguration(obj["product"], obj["platform"], obj["os"], obj["version"],
+                                         obj["env"], obj["args"], obj["metadata"])
+
+    if "rawFiles" in obj:
+        (stdoutFile, stderrFile, crashDataFile) = obj["rawFiles"]
+        crashInfo = CrashInfo.fromFiles(stdoutFile, stderrFile, configuration, crashDataFile)
+    else:
+        rawCrashData = None
+        if obj["rawCrashData"] != None:
+            rawCrashData = obj["rawCrashData"].encode("latin-1")
+
+        crashInfo = CrashInfo.fromRawCrashData(obj["rawStdout"].encode("latin-1"), obj["rawStderr"].encode("latin-1"),
+                                               configuration, rawCrashData)
+
+    if "testcase" in obj:
+        crashInfo.testcase = obj["testcase"].encode("latin-1")
+
+    return crashInfo
+
+def sendRequest(socketPath, request):
+    '''
+    Send a request to the daemon listening on the given socket.
+
+    @type socketPath: string
+    @param socketPath: Path of the Unix domain socket of the daemon
+    @type request: dict
+    @param request: The request, with the action to perform in "action"
+
+    @rtype: object
+    @return: The result returned by the daemon
+
+    @raise socket.error: If the daemon is not running
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+        sock.sendall(json.dumps(request) + "\n")
+        sock.shutdown(socket.SHUT_WR)
+
+        data = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads("".join(data))
+    except ValueError:
+        raise RuntimeError("Collector daemon sent malformed response")
+
+    if "error" in response:
+        raise RuntimeError("Collector daemon failed to process request: %s" % response["error"])
+
+    return response["result"]
+
+class CollectorDaemonHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = { "result" : self.server.daemon.process(request) }
+        except Exception, e:
+            traceback.print_exc(file=sys.stderr)
+            response = { "error" : "%s: %s" % (e.__class__.__name__, e) }
+
+        self.wfile.write(json.dumps(response) + "\n")
+
+class CollectorDaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class CollectorDaemon():
+    def __init__(self, collector, socketPath, refreshInterval=None):
+        '''
+        @type collector: Collector
+        @param collector: Collector used to answer requests
+        @type socketPath: string
+        @param socketPath: Path of the Unix domain socket to listen on
+        @type refreshInterval: int
+        @param refreshInterval: If specified, signatures are refreshed every
+                                refreshInterval seconds
+        '''
+        self.collector = collector
+        self.socketPath = socketPath
+        self.refreshInterval = refreshInterval
+
+        # We are the daemon, so the collector must not forward requests to us
+        self.collector.daemonSocket = None
+
+        # The signatures are shared by all connections, so search one crash at a time
+        self.searchLock = threading.Lock()
+
+        self.server = None
+
+    def process(self, request):
+        '''
+        Process a request sent with L{sendRequest}.
+
+        @type request: dict
+        @param request: The request to process
+
+        @rtype: object
+        @return: JSON serializable result of the request
+        '''
+        action = request.get("action")
+
+        if action == "ping":
+            return None
+        elif action == "search":
+            crashInfo = deserializeCrashInfo(request["crashInfo"])
+            with self.searchLock:
+                return self.collector.search(crashInfo)
+        elif action == "submit":
+            crashInfo = deserializeCrashInfo(request["crashInfo"])
+
+            # Clients send the testcase itself, we don't open files on their behalf
+            testCaseFile = None
+            if request["testCase"] != None:
+                (fd, testCaseFile) = tempfile.mkstemp(suffix=request["testCaseExt"], prefix="collector-testcase-")
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(request["testCase"].encode("latin-1"))
+
+            try:
+                self.collector.submit(crashInfo, testCaseFile, request["testCaseQuality"], request["metaData"])
+            finally:
+                if testCaseFile != None:
+                    os.remove(testCaseFile)
+            return None
+
+        raise RuntimeError("Unknown action: %s" % action)
+
+    def refreshPeriodically(self):
+        while True:
+            time.sleep(self.refreshInterval)
+            try:
+                self.collector.refresh()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+
+    def serveForever(self):
+        '''
+        Listen on our socket and answer requests until interrupted.
+        '''
+        # Don't take over the socket of a daemon that is still running
+        if os.path.exists(self.socketPath):
+            try:
+                sendRequest(self.socketPath, { "action" : "ping" })
+            except socket.error:
+                # Left behind by a daemon that didn't exit cleanly
+                os.remove(self.socketPath)
+            else:
+                raise RuntimeError("Collector daemon already running on %s" % self.socketPath)
+
+        # Load the signatures now, so the first client doesn't have to wait
+        if self.collector.sigCacheDir and os.path.isdir(self.collector.sigCacheDir):
+            SignatureIndex.forDirectory(self.collector.sigCacheDir)
+
+        self.server = CollectorDaemonServer(self.socketPath, CollectorDaemonHandler)
+        self.server.daemon = self
+
+        # The daemon submits on behalf of its clients, other users must not connect
+        os.chmod(self.socketPath, 0600)
+
+        # Submissions are spooled, upload the ones left over from before right away
+        if self.collector.spoolDir:
+            self.collector.startUploader()
+
+        if self.refreshInterval:
+            refreshThread = threading.Thread(target=self.refreshPeriodically)
+            refreshThread.daemon = True
+            refreshThread.start()
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socketPath)
+
+    def shutdown(self):
+        '''
+        Stop serving requests, L{serveForever} returns once the current
+        request is answered. Must be called from a different thread.
+        '''
+        self.server.shutdown()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Submission Spool -- Durable local queue of crash submissions
+
+With a spool directory configured (configuration property: spooldir), the
+Collector doesn't submit crashes to the server directly. Instead, it writes each
+submission (including the testcase) atomically into the spool and returns. A
+L{SpoolUploader} uploads the spooled submissions in the background, retrying
+with exponential backoff while the server is unavailable. Every submission
+carries an idempotency key, so the server stores a submission only once, even
+if it is uploaded again after a failure. Submissions the server rejects as
+invalid, or fails to process too many times, are moved to a subdirectory of
+the spool, so they don't block the others.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Suffix of submission files in the spool
+SUBMISSION_SUFFIX = ".submission"
+
+# Subdirectory of the spool for submissions that the server rejected
+REJECTED_DIR = "rejected"
+
+# Suffix of the files counting the server errors of a submission
+ERRORS_SUFFIX = ".errors"
+
+# File in the spool locked by the uploader that is currently active
+LOCK_FILE_NAME = ".lock"
+
+# Seconds to wait for the server when uploading submissions
+SUBMIT_REQUEST_TIMEOUT = 60
+
+class SubmissionSpool():
+    def __init__(self, spoolDir):
+        '''
+        @type spoolDir: string
+        @param spoolDir: Directory to store submissions in, created if missing
+        '''
+        self.spoolDir = spoolDir
+
+        if not os.path.isdir(spoolDir):
+            try:
+                os.makedirs(spoolDir)
+            except OSError:
+                # Created concurrently by another process
+                if not os.path.isdir(spoolDir):
+                    raise
+
+    def add(self, data):
+        '''
+        Store a submission in the spool. The submission becomes visible to
+        uploaders only once it is written completely.
+
+        @type data: dict
+        @param data: Data to POST to the server, an idempotency key is added
+
+        @rtype: string
+        @return: File the submission was stored in
+        '''
+        # Crash data can contain arbitrary bytes, store them as Latin-1 so they survive JSON
+        data = dict([(key, value.decode("latin-1") if isinstance(value, str) else value) for (key, value) in data.items()])
+        data["idempotency_key"] = uuid.uuid4().hex
+
+        # The name sorts submissions by time, so they are uploaded in order
+        name = "%016d-%s" % (int(time.time() * 1000000), data["idempotency_key"])
+        tmpFile = os.path.join(self.spoolDir, "." + name + ".tmp")
+        spoolFile = os.path.join(self.spoolDir, name + SUBMISSION_SUFFIX)
+
+        with open(tmpFile, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmpFile, spoolFile)
+        return spoolFile
+
+    def getPending(self, limit=None):
+        '''
+        @type limit: int
+        @param limit: Maximum number of submissions to return, all if None
+
+        @rtype: list
+        @return: Files of the spooled submissions, oldest first
+        '''
+        pending = sorted([name for name in os.listdir(self.spoolDir) if name.endswith(SUBMISSION_SUFFIX)])
+        if limit != None:
+            pending = pending[:limit]
+        return [os.path.join(self.spoolDir, name) for name in pending]
+
+    def load(self, spoolFile):
+        '''
+        @type spoolFile: string
+        @param spoolFile: File of a spooled submission
+
+        @rtype: dict
+        @return: The submission data
+        '''
+        with open(spoolFile) as f:
+            data = json.load(f)
+
+        return dict([(key, value.encode("latin-1") if isinstance(value, unicode) else value) for (key, value) in data.items()])
+
+    def remove(self, spoolFile):
+        '''
+        Remove an uploaded submission from the spool.
+
+        @type spoolFile: string
+        @param spoolFile: File of a spooled submission
+        '''
+        try:
+            os.remove(spoolFile)
+        except OSError:
+            # Already removed by another uploader
+            if os.path.exists(spoolFile):
+                raise
+
+        self.__removeErrors(spoolFile)
+
+    def reject(self, spoolFile):
+        '''
+        Move a submission that can't be uploaded out of the spool, so it can be
+        inspected manually.
+
+        @type spoolFile: string
+        @param spoolFile: File of a spooled submission
+        '''
+        rejectedDir = os.path.join(self.spoolDir, REJECTED_DIR)
+        if not os.path.isdir(rejectedDir):
+            os.mkdir(rejectedDir)
+        os.rename(spoolFile, os.path.join(rejectedDir, os.path.basename(spoolFile)))
+        self.__removeErrors(spoolFile)
+
+    def addServerError(self, spoolFile):
+        '''
+        Count a failed attempt to upload a submission, caused by a server error.
+
+        @type spoolFile: string
+        @param spoolFile: File of a spooled submission
+
+        @rtype: int
+        @return: Number of server errors of the submission so far
+        '''
+        errorFile = self.__getErrorFile(spoolFile)
+
+        errors = 0
+        try:
+            with open(errorFile) as f:
+                errors = int(f.read())
+        except (IOError, ValueError):
+            pass
+
+        errors += 1
+        with open(errorFile, 'w') as f:
+            f.write(str(errors))
+
+        return errors
+
+    def __getErrorFile(self, spoolFile):
+        # Hidden like temporary files, so it's never mistaken for a submission
+        return os.path.join(self.spoolDir, "." + os.path.basename(spoolFile) + ERRORS_SUFFIX)
+
+    def __removeErrors(self, spoolFile):
+        try:
+            os.remove(self.__getErrorFile(spoolFile))
+        except OSError:
+            pass
+
+class SpoolUploader():
+    def __init__(self, collector, spool, batchSize=50, pollInterval=5, minBackoff=1, maxBackoff=300, maxServerErrors=5,
+                 requestTimeout=SUBMIT_REQUEST_TIMEOUT):
+        '''
+        @type collector: Collector
+        @param collector: Collector used to upload the submissions
+        @type spool: SubmissionSpool
+        @param spool: The spool to upload
+        @type batchSize: int
+        @param batchSize: Maximum number of submissions uploaded by L{uploadBatch}
+        @type pollInterval: float
+        @param pollInterval: Seconds to wait before checking an empty spool again
+        @type minBackoff: float
+        @param minBackoff: Seconds to wait after the first failed upload
+        @type maxBackoff: float
+        @param maxBackoff: Maximum number of seconds to wait after failed uploads
+        @type maxServerErrors: int
+        @param maxServerErrors: Number of times the server may fail to process a
+                                submission before it is rejected
+        @type requestTimeout: float
+        @param requestTimeout: Seconds to wait for the server to respond
+        '''
+        self.collector = collector
+        self.spool = spool
+        self.batchSize = batchSize
+        self.pollInterval = pollInterval
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.maxServerErrors = maxServerErrors
+        self.requestTimeout = requestTimeout
+
+        # Cleared if the server doesn't support bulk submissions
+        self.bulk = True
+
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def uploadBatch(self, deadline=None):
+        '''
+        Upload the oldest spooled submissions, at most batchSize of them, in one
+        bulk request. Submissions the server rejects as invalid, or fails to
+        process maxServerErrors times (status code 500), are moved out of the
+        spool. Other failures (e.g. the server being unavailable) are retried
+        indefinitely.
+
+        @type deadline: float
+        @param deadline: If specified, the time (as returned by time.time()) after
+                         which no further request is sent and the server isn't
+                         waited for anymore
+
+        @rtype: int
+        @return: Number of submissions that were handled
+
+        @raise RuntimeError: If the server is unavailable or failed. The
+                             submissions not uploaded yet remain in the spool.
+        '''
+        handled = 0
+        batch = []
+
+        for spoolFile in self.spool.getPending(self.batchSize):
+            try:
+                batch.append((spoolFile, self.spool.load(spoolFile)))
+            except IOError:
+                # Uploaded and removed by another uploader
+                continue
+            except ValueError:
+                print("Warning: Rejecting corrupted submission %s" % spoolFile, file=sys.stderr)
+                self.spool.reject(spoolFile)
+                handled += 1
+
+        if self.bulk and batch:
+            timeout = self.__getRequestTimeout(deadline)
+            if timeout <= 0:
+                return handled
+
+            try:
+                response = self.collector.postSubmissions([data for (_, data) in batch], timeout)
+            except requests.exceptions.RequestException, e:
+                raise RuntimeError("Failed to upload submissions: %s" % e)
+
+            if response.status_code in (requests.codes["ok"], requests.codes["created"]):
+                for (spoolFile, _) in batch:
+                    self.spool.remove(spoolFile)
+                return handled + len(batch)
+            elif response.status_code == requests.codes["bad_request"] and "index" in response.json():
+                # Nothing was stored, reject the invalid submission and retry the others with the next batch
+                spoolFile = batch[response.json()["index"]][0]
+                print("Warning: Server rejected submission %s: %s" % (spoolFile, response.json().get("detail")),
+                      file=sys.stderr)
+                self.spool.reject(spoolFile)
+                return handled + 1
+            elif response.status_code == requests.codes["not_found"]:
+                # The server doesn't support bulk submissions, upload them one by one
+                self.bulk = False
+            elif response.status_code in (requests.codes["bad_request"], requests.codes["internal_server_error"]):
+                # The server didn't tell which submission failed (e.g. the batch was too
+                # large), upload this batch one by one to find out.
+                pass
+            else:
+                raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+
+        for (spoolFile, data) in batch:
+            timeout = self.__getRequestTimeout(deadline)
+            if timeout <= 0:
+                break
+
+            try:
+                response = self.collector.postSubmission(data, timeout)
+            except requests.exceptions.RequestException, e:
+                raise RuntimeError("Failed to upload submission: %s" % e)
+
+            # Retries of uploads the server already stored are answered like new ones
+            if response.status_code in (requests.codes["ok"], requests.codes["created"]):
+                self.spool.remove(spoolFile)
+            elif response.status_code == requests.codes["bad_request"]:
+                # Invalid submissions will never be accepted, unlike e.g. failed authentication
+                print("Warning: Server rejected submission %s with status code %s" % (spoolFile, response.status_code),
+                      file=sys.stderr)
+                self.spool.reject(spoolFile)
+            elif response.status_code == requests.codes["internal_server_error"]:
+                # Most likely caused by this submission, don't let it block the others forever
+                errors = self.spool.addServerError(spoolFile)
+                if errors < self.maxServerErrors:
+                    raise RuntimeError("Server failed to process submission %s (%s of %s attempts)" % (spoolFile, errors,
+                                                                                                     self.maxServerErrors))
+
+                print("Warning: Server failed to process submission %s %s times, rejecting it" % (spoolFile, errors),
+                      file=sys.stderr)
+                self.spool.reject(spoolFile)
+            else:
+                raise RuntimeError("Server unexpectedly responded with status code %s" % response.status_code)
+
+            handled += 1
+
+        return handled
+
+    def uploadAll(self, timeout=None):
+        '''
+        Upload all spooled submissions.
+
+        @type timeout: float
+        @param timeout: If specified, the upload is stopped after this many
+                        seconds, the remaining submissions stay spooled.
+
+        @rtype: int
+        @return: Number of submissions that were handled. If another uploader
+                 is active for the spool, nothing is uploaded, it uploads them.
+
+        @raise RuntimeError: If the server is unavailable or failed
+        '''
+        deadline = None
+        if timeout != None:
+            deadline = time.time() + timeout
+
+        lockFile = self.__openLockFile()
+        try:
+            if not self.__lock(lockFile):
+                return 0
+
+            total = 0
+            while deadline == None or time.time() < deadline:
+                handled = self.uploadBatch(deadline)
+                if not handled:
+                    break
+                total += handled
+
+            return total
+        finally:
+            if lockFile != None:
+                lockFile.close()
+
+    def run(self):
+        '''
+        Upload spooled submissions until L{stop} is called.
+        '''
+        # Only one uploader per spool is active, the others wait for it to exit
+        lockFile = self.__openLockFile()
+
+        try:
+            backoff = self.minBackoff
+            while not self.stopEvent.is_set():
+                if not self.__lock(lockFile):
+                    self.stopEvent.wait(self.pollInterval)
+                    continue
+
+                try:
+                    handled = self.uploadBatch()
+                    backoff = self.minBackoff
+                    if not handled:
+                        self.stopEvent.wait(self.pollInterval)
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+
+                    # Randomize the delay, so clients don't retry all at the same time
+                    self.stopEvent.wait(backoff * random.uniform(0.5, 1.0))
+                    backoff = min(backoff * 2, self.maxBackoff)
+        finally:
+            if lockFile != None:
+                lockFile.close()
+
+    def __getRequestTimeout(self, deadline):
+        if deadline == None:
+            return self.requestTimeout
+        return min(self.requestTimeout, deadline - time.time())
+
+    def __openLockFile(self):
+        # Platforms without flock can't tell whether another uploader is active
+        if fcntl == None:
+            return None
+        return open(os.path.join(self.spool.spoolDir, LOCK_FILE_NAME), 'a')
+
+    def __lock(self, lockFile):
+        if lockFile == None:
+            return True
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except IOError:
+            return False
+
+    def start(self):
+        '''
+        Start uploading in a background thread.
+        '''
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread started with L{start}, after the current batch.
+        '''
+        self.stopEvent.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
@@ -11,14 +11,24 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 @contact:    choller@mozilla.com
 '''
+import BaseHTTPServer
+import hashlib
+import json
+import stat
 import unittest
 import requests
 import tempfile
 import os
+import urlparse
 
 from requests.exceptions import ConnectionError
+import Collector as CollectorModule
 from Collector import Collector
+from CollectorDaemon import CollectorDaemon
+from SubmissionSpool import SubmissionSpool, SpoolUploader, REJECTED_DIR, LOCK_FILE_NAME, fcntl
 import shutil
+import threading
+import time
 from FTB.Signatures.CrashInfo import CrashInfo
 from FTB.ProgramConfiguration import ProgramConfiguration
 from FTB.Signatures.CrashSignature import CrashSignature
@@ -117,5 +127,371 @@ class TestCollectorRefresh(unittest.TestCase):
             self.skipTest("Server did not provide signatures")
 
 
+class SignatureServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves the signatures in server.signatures like the manifest and export endpoints
+    def do_GET(self):
+        (path, _, query) = self.path.partition("?")
+        self.server.requests.append(path)
+        
+        if path == "/crashmanager/rest/signatures/manifest/":
+            manifest = dict([(sigId, sig["hash"]) for (sigId, sig) in self.server.signatures.items()])
+            etag = '"%s"' % hashlib.sha1(json.dumps(manifest, sort_keys=True)).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.sendJSON(manifest, { "ETag" : etag })
+        elif path == "/crashmanager/rest/signatures/export/":
+            ids = urlparse.parse_qs(query)["ids"][0].split(",")
+            self.server.exportedIds.extend(ids)
+            self.sendJSON(dict([(sigId, self.server.signatures[sigId]) for sigId in ids if sigId in self.server.signatures]))
+        else:
+            self.send_response(404)
+            self.end_headers()
+    
+    def sendJSON(self, obj, headers={}):
+        data = json.dumps(obj)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, *args):
+        pass
+
+class TestCollectorRefreshDelta(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="collector-tmp-")
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), SignatureServerHandler)
+        self.server.signatures = {}
+        self.server.requests = []
+        self.server.exportedIds = []
+        self.serverThread = threading.Thread(target=self.server.serve_forever)
+        self.serverThread.start()
+        
+    def tearDown(self):
+        self.server.shutdown()
+        self.serverThread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpDir)
+    
+    def setSignature(self, sigId, signature, shortDescription):
+        metadata = json.dumps({ "shortDescription" : shortDescription })
+        self.server.signatures[sigId] = { "signature" : signature, "metadata" : metadata,
+                                          "hash" : hashlib.sha1(signature + metadata).hexdigest() }
+        
+    def runTest(self):
+        sigCacheDir = os.path.join(self.tmpDir, "signatures")
+        os.mkdir(sigCacheDir)
+        
+        collector = Collector(sigCacheDir, serverHost="127.0.0.1", serverPort=self.server.server_address[1],
+                              serverProtocol="http", serverAuthToken="token", clientId="test-fuzzer1", tool="test-tool")
+        
+        config = ProgramConfiguration("mozilla-central", "x86-64", "linux", version="ba0bc4f26681")
+        crashInfo = CrashInfo.fromRawCrashData([], asanTraceCrash.splitlines(), config)
+        
+        self.setSignature("1", '{"symptoms" : [ { "type" : "output", "value" : "/^nothing/" } ] }', "bucket1")
+        self.setSignature("2", '{"symptoms" : [ { "type" : "output", "value" : "/^nowhere/" } ] }', "bucket2")
+        
+        collector.refresh()
+        self.assertEqual(sorted(self.server.exportedIds), [ "1", "2" ])
+        self.assertEqual(sorted([ sigFile for sigFile in os.listdir(sigCacheDir) if not sigFile.startswith(".") ]),
+                         [ "1.metadata", "1.signature", "2.metadata", "2.signature" ])
+        self.assertEqual(collector.search(crashInfo), (None, None))
+        
+        # Nothing changed, so only the manifest is requested
+        self.server.requests = []
+        collector.refresh()
+        self.assertEqual(self.server.requests, [ "/crashmanager/rest/signatures/manifest/" ])
+        
+        # Only new and changed signatures are downloaded
+        self.server.exportedIds = []
+        del self.server.signatures["1"]
+        self.setSignature("2", '{"symptoms" : [ { "type" : "output", "value" : "/^nowhere/" } ] }', "renamed")
+        self.setSignature("3", '{"symptoms" : [ { "type" : "crashAddress", "address" : "< 0x100" } ] }', "bucket3")
+        
+        collector.refresh()
+        self.assertEqual(sorted(self.server.exportedIds), [ "2", "3" ])
+        self.assertEqual(sorted([ sigFile for sigFile in os.listdir(sigCacheDir) if not sigFile.startswith(".") ]),
+                         [ "2.metadata", "2.signature", "3.metadata", "3.signature" ])
+        
+        (sigFile, metadata) = collector.search(crashInfo)
+        self.assertEqual(os.path.basename(sigFile), "3.signature")
+        self.assertEqual(metadata, { "shortDescription" : "bucket3" })
+        
+        with open(os.path.join(sigCacheDir, "2.metadata")) as f:
+            self.assertEqual(json.load(f), { "shortDescription" : "renamed" })
+
+
+class TestCollectorRefreshGenerations(TestCollectorRefreshDelta):
+    def getGenerations(self):
+        return sorted([ name for name in os.listdir(self.tmpDir) if CollectorModule.GENERATION_SUFFIX in name
+                        and not name.endswith(CollectorModule.REPLACED_SUFFIX) ])
+    
+    def runTest(self):
+        sigCacheDir = os.path.join(self.tmpDir, "signatures")
+        os.mkdir(sigCacheDir)
+        
+        collector = Collector(sigCacheDir, serverHost="127.0.0.1", serverPort=self.server.server_address[1],
+                              serverProtocol="http", serverAuthToken="token", clientId="test-fuzzer1", tool="test-tool")
+        
+        config = ProgramConfiguration("mozilla-central", "x86-64", "linux", version="ba0bc4f26681")
+        crashInfo = CrashInfo.fromRawCrashData([], asanTraceCrash.splitlines(), config)
+        
+        # A regular cache directory becomes the first previous generation
+        localSigFile = collector.generate(crashInfo, numFrames=4)
+        self.setSignature("1", '{"symptoms" : [ { "type" : "output", "value" : "/^nothing/" } ] }', "version1")
+        collector.refresh()
+        
+        self.assertTrue(os.path.islink(sigCacheDir))
+        legacyGenDir = os.path.join(self.tmpDir, [ name for name in self.getGenerations() if
+                                                   os.path.join(self.tmpDir, name) != os.path.realpath(sigCacheDir) ][0])
+        self.assertTrue(os.path.exists(os.path.join(legacyGenDir, os.path.basename(localSigFile))))
+        self.assertTrue(os.path.exists(os.path.join(sigCacheDir, "1.signature")))
+        
+        # Readers wait for a cache directory that is being replaced
+        firstGenDir = os.path.realpath(sigCacheDir)
+        self.setSignature("1", '{"symptoms" : [ { "type" : "crashAddress", "address" : "< 0x100" } ] }', "version1")
+        collector.refresh()
+        os.rename(sigCacheDir, sigCacheDir + ".moved")
+        restoreThread = threading.Timer(0.05, os.rename, (sigCacheDir + ".moved", sigCacheDir))
+        restoreThread.start()
+        (sigFile, _) = collector.search(crashInfo)
+        restoreThread.join()
+        self.assertEqual(os.path.basename(sigFile), "1.signature")
+        
+        # Generations that existed for a long time but were replaced just now must be kept
+        genDirs = [ legacyGenDir, firstGenDir ]
+        for version in range(2, 5):
+            genDirs.append(os.path.realpath(sigCacheDir))
+            os.utime(genDirs[-1], (time.time() - 2 * CollectorModule.GENERATION_GRACE_PERIOD,) * 2)
+            self.setSignature("1", '{"symptoms" : [ { "type" : "output", "value" : "/^nothing/" } ] }', "version%s" % version)
+            collector.refresh()
+        
+        for genDir in genDirs:
+            self.assertTrue(os.path.isdir(genDir))
+            self.assertTrue(os.path.exists(genDir + CollectorModule.REPLACED_SUFFIX))
+        
+        # Once the grace period after replacing them has passed, they are removed
+        for genDir in genDirs[:2]:
+            os.utime(genDir + CollectorModule.REPLACED_SUFFIX, (time.time() - 2 * CollectorModule.GENERATION_GRACE_PERIOD,) * 2)
+        genDirs.append(os.path.realpath(sigCacheDir))
+        self.setSignature("1", '{"symptoms" : [ { "type" : "output", "value" : "/^nothing/" } ] }', "version5")
+        collector.refresh()
+        
+        for genDir in genDirs[:2]:
+            self.assertFalse(os.path.exists(genDir))
+            self.assertFalse(os.path.exists(genDir + CollectorModule.REPLACED_SUFFIX))
+        self.assertEqual(self.getGenerations(), sorted([ os.path.basename(genDir) for genDir in genDirs[2:] ] +
+                                                       [ os.path.basename(os.path.realpath(sigCacheDir)) ]))
+        
+        with open(os.path.join(sigCacheDir, "1.metadata")) as f:
+            self.assertEqual(json.load(f), { "shortDescription" : "version5" })
+
+
+class TestCollectorDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpCacheDir = tempfile.mkdtemp(prefix="collector-tmp-")
+        self.tmpSocketDir = tempfile.mkdtemp(prefix="collector-sock-")
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpCacheDir)
+        shutil.rmtree(self.tmpSocketDir)
+        
+    def runTest(self):
+        socketPath = os.path.join(self.tmpSocketDir, "collector.sock")
+        
+        config = ProgramConfiguration("mozilla-central", "x86-64", "linux", version="ba0bc4f26681")
+        crashInfo = CrashInfo.fromRawCrashData([], asanTraceCrash.splitlines(), config)
+        
+        # Generate a signature locally, then search it through the daemon
+        collector = Collector(self.tmpCacheDir, serverHost="127.0.0.1", serverPort=8000, serverProtocol="http",
+                              serverAuthToken="token", clientId="test-fuzzer1", tool="test-tool", daemonSocket=socketPath)
+        sigFile = collector.generate(crashInfo, numFrames=4)
+        
+        # Without daemon, the client searches the signatures itself
+        (daemonSigFile, metadata) = collector.search(crashInfo)
+        self.assertEqual(os.path.basename(daemonSigFile), os.path.basename(sigFile))
+        
+        class SubmitCollector(Collector):
+            def __init__(self, *args, **kwargs):
+                Collector.__init__(self, *args, **kwargs)
+                self.posted = []
+            
+            def postSubmission(self, data):
+                self.posted.append(data)
+                
+                class Response():
+                    status_code = 201
+                return Response()
+        
+        daemonCollector = SubmitCollector(self.tmpCacheDir, serverHost="127.0.0.1", serverPort=8000, serverProtocol="http",
+                                          serverAuthToken="token", clientId="test-daemon", tool="test-tool")
+        daemon = CollectorDaemon(daemonCollector, socketPath)
+        daemonThread = threading.Thread(target=daemon.serveForever)
+        daemonThread.start()
+        try:
+            while not os.path.exists(socketPath):
+                time.sleep(0.01)
+            
+            # Only the user running the daemon may connect
+            self.assertEqual(stat.S_IMODE(os.stat(socketPath).st_mode), 0600)
+            
+            (daemonSigFile, metadata) = collector.search(crashInfo)
+            self.assertEqual(os.path.basename(daemonSigFile), os.path.basename(sigFile))
+            
+            # Crashes read from files are mapped by the daemon itself
+            stderrFile = os.path.join(self.tmpSocketDir, "stderr")
+            with open(stderrFile, 'w') as f:
+                f.write(asanTraceCrash)
+            fileCrashInfo = CrashInfo.fromFiles(None, stderrFile, config)
+            (daemonSigFile, metadata) = collector.search(fileCrashInfo)
+            self.assertEqual(os.path.basename(daemonSigFile), os.path.basename(sigFile))
+            
+            # Submissions carry the testcase itself, not its path
+            testCaseFile = os.path.join(self.tmpSocketDir, "test.js")
+            with open(testCaseFile, 'w') as f:
+                f.write(exampleTestCase)
+            collector.submit(fileCrashInfo, testCaseFile, 5, { "foo" : "bar" })
+            os.remove(testCaseFile)
+            
+            self.assertEqual(len(daemonCollector.posted), 1)
+            data = daemonCollector.posted[0]
+            self.assertEqual(data["testcase"], exampleTestCase)
+            self.assertEqual(data["testcase_ext"], "js")
+            self.assertEqual(data["testcase_quality"], 5)
+            self.assertEqual(data["rawStderr"], os.linesep.join(asanTraceCrash.splitlines()))
+            self.assertEqual(json.loads(data["metadata"]), { "foo" : "bar" })
+            self.assertEqual(data["client"], "test-daemon")
+            self.assertEqual([ name for name in os.listdir(tempfile.gettempdir()) if name.startswith("collector-testcase-") ], [])
+            
+            # Arbitrary bytes must survive the transfer
+            crashInfo = CrashInfo.fromRawCrashData(["\xff\xfe"], ["foo"], config)
+            self.assertEqual(collector.search(crashInfo), (None, None))
+        finally:
+            daemon.shutdown()
+            daemonThread.join()
+        
+        self.assertFalse(os.path.exists(socketPath))
+
+class TestSubmissionSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpSpoolDir = tempfile.mkdtemp(prefix="collector-spool-")
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpSpoolDir)
+        
+    def runTest(self):
+        class Response():
+            def __init__(self, status_code, data=None):
+                self.status_code = status_code
+                self.data = data
+            
+            def json(self):
+                return self.data
+        
+        class UploadCollector():
+            def __init__(self):
+                self.responses = []
+                self.posted = []
+                self.timeouts = []
+            
+            def postSubmission(self, data, timeout):
+                self.posted.append(data)
+                self.timeouts.append(timeout)
+                return self.responses.pop(0)
+            
+            def postSubmissions(self, dataList, timeout):
+                self.posted.append(dataList)
+                self.timeouts.append(timeout)
+                return self.responses.pop(0)
+        
+        spool = SubmissionSpool(self.tmpSpoolDir)
+        spool.add({ "rawStderr" : "\xff\xfe", "testcase_quality" : 0 })
+        spool.add({ "rawStderr" : "invalid" })
+        spool.add({ "rawStderr" : "foo" })
+        self.assertEqual(len(spool.getPending()), 3)
+        
+        collector = UploadCollector()
+        uploader = SpoolUploader(collector, spool, batchSize=2)
+        
+        # Nothing is lost while the server fails
+        collector.responses = [ Response(500), Response(500) ]
+        self.assertRaises(RuntimeError, uploader.uploadBatch)
+        self.assertEqual(len(spool.getPending()), 3)
+        
+        # Invalid submissions are rejected, the others are retried
+        collector.responses = [ Response(400, { "detail" : "Missing field", "index" : 1 }), Response(201) ]
+        self.assertEqual(uploader.uploadAll(), 3)
+        self.assertEqual(spool.getPending(), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.tmpSpoolDir, REJECTED_DIR))), 1)
+        
+        # Retries carry the same idempotency key
+        self.assertEqual(len(collector.posted), 4)
+        self.assertEqual(collector.posted[0][0], collector.posted[1])
+        self.assertEqual(collector.posted[0][0], collector.posted[3][0])
+        self.assertEqual(collector.posted[3][0]["rawStderr"], "\xff\xfe")
+        self.assertEqual(collector.posted[3][0]["testcase_quality"], 0)
+        self.assertNotEqual(collector.posted[3][0]["idempotency_key"], collector.posted[3][1]["idempotency_key"])
+        
+        # Without bulk support, submissions are uploaded one by one
+        spool.add({ "rawStderr" : "bar" })
+        collector.responses = [ Response(404), Response(201) ]
+        self.assertEqual(uploader.uploadAll(), 1)
+        self.assertEqual(spool.getPending(), [])
+        self.assertFalse(uploader.bulk)
+        self.assertEqual(collector.posted[-1]["rawStderr"], "bar")
+        
+        rejectedDir = os.path.join(self.tmpSpoolDir, REJECTED_DIR)
+        
+        # Batches rejected without telling which submission is invalid are retried one by one
+        uploader = SpoolUploader(collector, spool, batchSize=2, maxServerErrors=2)
+        spool.add({ "rawStderr" : "invalid" })
+        spool.add({ "rawStderr" : "foo" })
+        collector.responses = [ Response(400, { "detail" : "Too many submissions" }), Response(400), Response(201) ]
+        self.assertEqual(uploader.uploadBatch(), 2)
+        self.assertEqual(spool.getPending(), [])
+        self.assertEqual(len(os.listdir(rejectedDir)), 2)
+        self.assertEqual(collector.posted[-2]["rawStderr"], "invalid")
+        
+        # Submissions the server keeps failing to process are rejected eventually
+        spool.add({ "rawStderr" : "failure" })
+        spool.add({ "rawStderr" : "foo" })
+        collector.responses = [ Response(500), Response(500) ]
+        self.assertRaises(RuntimeError, uploader.uploadBatch)
+        self.assertEqual(len(spool.getPending()), 2)
+        
+        collector.responses = [ Response(500), Response(500), Response(201) ]
+        self.assertEqual(uploader.uploadBatch(), 2)
+        self.assertEqual(spool.getPending(), [])
+        self.assertEqual(len(os.listdir(rejectedDir)), 3)
+        self.assertEqual(sorted([name for name in os.listdir(self.tmpSpoolDir) if name != LOCK_FILE_NAME]), [ REJECTED_DIR ])
+        
+        # Requests don't outlast the upload timeout
+        spool.add({ "rawStderr" : "foo" })
+        uploader = SpoolUploader(collector, spool, requestTimeout=30)
+        collector.responses = [ Response(201) ]
+        self.assertEqual(uploader.uploadAll(5), 1)
+        self.assertTrue(0 < collector.timeouts[-1] <= 5)
+        
+        spool.add({ "rawStderr" : "foo" })
+        self.assertEqual(uploader.uploadAll(0), 0)
+        self.assertEqual(len(spool.getPending()), 1)
+        
+        # Only one uploader per spool is active, the submissions are left to it
+        if fcntl != None:
+            with open(os.path.join(self.tmpSpoolDir, LOCK_FILE_NAME), 'a') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.assertEqual(uploader.uploadAll(), 0)
+                self.assertEqual(len(spool.getPending()), 1)
+            
+            collector.responses = [ Response(201) ]
+            self.assertEqual(uploader.uploadAll(), 1)
+            self.assertEqual(spool.getPending(), [])
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -16,7 +16,196 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
 
-def getAssertion(output, onlyProgramAssertions=False):
+# PID tag at the beginning of a line, e.g. "[26289] "
+PID_PATTERN = re.compile("^\\[\\d+\\]\\s+")
+
+class AssertionDetector():
+    def __init__(self, name, literals, pattern=None, anchored=False, isProgramAssertion=True,
+                 isTrueAssertion=False, requiresNoTrueAssertion=False, consumesRest=False):
+        '''
+        Describes one type of assertion message.
+        
+        @type name: string
+        @param name: Short description of the assertion type
+        
+        @type literals: list
+        @param literals: Strings that must all be contained in a matching line (at
+                         least one). These are checked before the pattern as they are
+                         cheap, the first one is used to quickly find candidate lines.
+        
+        @type pattern: string
+        @param pattern: Optional regular expression a matching line must contain
+        
+        @type anchored: bool
+        @param anchored: If True, the pattern must match at the beginning of the line
+        
+        @type isProgramAssertion: bool
+        @param isProgramAssertion: False for aborts not caused by the program itself
+                                   (e.g. ASan or glibc), see L{getAssertion}
+        
+        @type isTrueAssertion: bool
+        @param isTrueAssertion: Lines of this type take precedence over any later
+                                lines requiring no true assertion
+        
+        @type requiresNoTrueAssertion: bool
+        @param requiresNoTrueAssertion: Only use lines of this type if no true assertion
+                                        appeared before them (e.g. the ASan head line)
+        
+        @type consumesRest: bool
+        @param consumesRest: The assertion spans all remaining lines (e.g. v8 fatal errors).
+                             The first line of this type ends the search.
+        '''
+        self.name = name
+        self.literals = literals
+        self.pattern = None
+        self.anchored = anchored
+        self.isProgramAssertion = isProgramAssertion
+        self.isTrueAssertion = isTrueAssertion
+        self.requiresNoTrueAssertion = requiresNoTrueAssertion
+        self.consumesRest = consumesRest
+        
+        if pattern != None:
+            self.pattern = re.compile(pattern)
+        
+        if not literals:
+            raise RuntimeError("Assertion detectors must specify at least one literal")
+    
+    def matches(self, line):
+        for literal in self.literals:
+            if not literal in line:
+                return False
+        
+        if self.pattern == None:
+            return True
+        elif self.anchored:
+            return self.pattern.match(line) != None
+        else:
+            return self.pattern.search(line) != None
+
+class AssertionDetectorRegistry():
+    def __init__(self):
+        self.detectors = []
+        
+        # Matches (at least) all lines that match one of the detectors
+        self.prefilter = None
+    
+    def register(self, detector, index=None):
+        '''
+        Add a detector. If a line matches multiple detectors, the one registered
+        first is used.
+        
+        @type detector: AssertionDetector
+        @param detector: The detector to add
+        
+        @type index: int
+        @param index: Optional position to insert the detector at, default is the end
+        '''
+        if index == None:
+            self.detectors.append(detector)
+        else:
+            self.detectors.insert(index, detector)
+        
+        alternatives = []
+        for x in self.detectors:
+            # Unanchored patterns are a stricter condition than the literal
+            if x.pattern != None and not x.anchored:
+                alternatives.append("(?:%s)" % x.pattern.pattern)
+            else:
+                alternatives.append(re.escape(x.literals[0]))
+        self.prefilter = re.compile("|".join(alternatives))
+    
+    def classify(self, line, onlyProgramAssertions):
+        '''
+        Determine the type of assertion in the given line.
+        
+        @type line: string
+        @param line: The line to check, without PID tag
+        
+        @type onlyProgramAssertions: bool
+        @param onlyProgramAssertions: Ignore detectors that are no program assertions
+        
+        @rtype: tuple
+        @return: Tuple of the first matching detector and, if that detector requires
+                 no true assertion, the next matching detector without that requirement
+                 (which is used instead if there was a true assertion).
+        '''
+        detector = None
+        for candidate in self.detectors:
+            if onlyProgramAssertions and not candidate.isProgramAssertion:
+                continue
+            
+            if detector != None and candidate.requiresNoTrueAssertion:
+                continue
+            
+            if candidate.matches(line):
+                if detector != None:
+                    return (detector, candidate)
+                
+                if not candidate.requiresNoTrueAssertion:
+                    return (candidate, None)
+                
+                detector = candidate
+        
+        return (detector, None)
+
+# Default registry used by getAssertion, register new assertion types here
+assertionDetectors = AssertionDetectorRegistry()
+
+# Firefox JS assertion
+assertionDetectors.register(AssertionDetector("js", ["Assertion failure"], "Assertion failure", anchored=True, isTrueAssertion=True))
+
+# Firefox assertion
+assertionDetectors.register(AssertionDetector("firefox", ["###!!! ASSERTION:"], "###!!! ASSERTION:", anchored=True, isTrueAssertion=True))
+
+# Support v8 non-standard multi-line assertion output
+assertionDetectors.register(AssertionDetector("v8", ["# Fatal error in"], "# Fatal error in", anchored=True, isTrueAssertion=True, consumesRest=True))
+
+# ASan head line, ignored in case of an assertion
+assertionDetectors.register(AssertionDetector("asan", ["ERROR: AddressSanitizer"], isProgramAssertion=False, requiresNoTrueAssertion=True))
+
+# Firefox ANGLE assertion
+assertionDetectors.register(AssertionDetector("angle", ["Assertion", "failed"]))
+
+# Aborts caused by glibc runtime error detection
+assertionDetectors.register(AssertionDetector("glibc", ["glibc detected"], isProgramAssertion=False))
+
+# MOZ_CRASH line, but with a message (we should only look at these)
+assertionDetectors.register(AssertionDetector("mozcrash", ["MOZ_CRASH"], "MOZ_CRASH\\(.+\\)"))
+
+def stripPID(line):
+    '''
+    Remove any PID output at the beginning of the line
+    '''
+    if line.startswith("["):
+        return PID_PATTERN.sub("", line, count=1)
+    return line
+
+def containsLiteral(output, literal):
+    '''
+    Check if any line of the given output contains the literal.
+    '''
+    if hasattr(output, "find"):
+        # LineBuffer, check without splitting the output into lines
+        return output.find(literal) >= 0
+    
+    for line in output:
+        if literal in line:
+            return True
+    
+    return False
+
+def getCandidateLinesReversed(output, registry):
+    '''
+    Iterate backwards over all lines of the given output that can match any of
+    the detectors in the given registry.
+    '''
+    if hasattr(output, "searchLinesReversed"):
+        # LineBuffer, search for the literals on the whole buffer at once
+        return output.searchLinesReversed([ detector.literals[0] for detector in registry.detectors ])
+    
+    return (line for line in reversed(output) if registry.prefilter.search(line) != None)
+
+def getAssertion(output, onlyProgramAssertions=False, registry=None):
     '''
     This helper class provides a way to extract and process the 
     different types of assertions from a given buffer. 
@@ -28,51 +217,80 @@ def getAssertion(output, onlyProgramAssertions=False):
     Some aborts, like ASan or glibc, are not desirable in some
     cases, like signature generation and lead to incompatible
     signatures.
+    
+    If multiple assertions are found, the last one is used. The output is
+    scanned backwards, so the search can usually stop at the last assertion.
      
     @type output: list
     @param output: List of strings to be searched
     
     @type onlyProgramAssertions: bool
     @param onlyProgramAssertions: Boolean, see above
+    
+    @type registry: AssertionDetectorRegistry
+    @param registry: Detectors to use, defaults to L{assertionDetectors}
     '''
-    lastLine = None
-    addNext = False
+    if registry == None:
+        registry = assertionDetectors
+    
+    # Assertions spanning the remaining output override everything else and
+    # end the search, so they have to be found from the beginning. Checking
+    # for their literals first avoids this in most cases.
+    if any([ detector.consumesRest and containsLiteral(output, detector.literals[0]) for detector in registry.detectors ]):
+        lastLine = None
+        for line in output:
+            line = stripPID(line)
+            
+            if lastLine != None:
+                lastLine += " "
+                lastLine += line
+            else:
+                detector = registry.classify(line, onlyProgramAssertions)[0]
+                if detector != None and detector.consumesRest:
+                    lastLine = line
         
-    # Use this to ignore the ASan head line in case of an assertion
-    haveTrueAssertion = False
+        if lastLine != None:
+            return lastLine
     
-    for line in output:
-        # Remove any PID output at the beginning of the line
-        line = re.sub("^\\[\\d+\\]\\s+", "", line, count=1)
-        
-        if addNext:
-            lastLine += " "
-            lastLine += line
-        elif line.startswith("Assertion failure"):
-            # Firefox JS assertion
-            lastLine = line
-            haveTrueAssertion = True
-        elif line.startswith("###!!! ASSERTION:"):
-            # Firefox assertion
-            lastLine = line
-            haveTrueAssertion = True
-        elif line.startswith("# Fatal error in"):
-            # Support v8 non-standard multi-line assertion output
-            lastLine = line
-            haveTrueAssertion = True
-            addNext = True
-        elif not onlyProgramAssertions and not haveTrueAssertion and "ERROR: AddressSanitizer" in line:
-            lastLine = line
-        elif "Assertion" in line and "failed" in line:
-            # Firefox ANGLE assertion
-            lastLine = line
-        elif not onlyProgramAssertions and "glibc detected" in line:
-            # Aborts caused by glibc runtime error detection
-            lastLine = line
-        elif "MOZ_CRASH" in line and re.search("MOZ_CRASH\(.+\)", line):
-            # MOZ_CRASH line, but with a message (we should only look at these)
+    # The last line that is only valid if no true assertion precedes it and
+    # the last of those lines that matches another detector otherwise.
+    conditionalLine = None
+    fallbackLine = None
+    
+    # The last line that is valid regardless of the preceding lines
+    lastLine = None
+    
+    # Lines not containing any detector literal can't be assertions
+    for line in getCandidateLinesReversed(output, registry):
+        line = stripPID(line)
+        
+        (detector, fallbackDetector) = registry.classify(line, onlyProgramAssertions)
+        if detector == None:
+            continue
+        
+        if lastLine == None:
+            if detector.requiresNoTrueAssertion:
+                if conditionalLine == None:
+                    conditionalLine = line
+                if fallbackLine == None and fallbackDetector != None:
+                    fallbackLine = line
+                continue
+            
             lastLine = line
+            
+            if conditionalLine == None:
+                return lastLine
         
+        # We have a conditional line behind the last regular line, which is only
+        # valid if no true assertion precedes it.
+        if detector.isTrueAssertion:
+            if fallbackLine != None:
+                return fallbackLine
+            return lastLine
+    
+    if conditionalLine != None:
+        return conditionalLine
+    
     return lastLine
 
 def getSanitizedAssertionPattern(msg):
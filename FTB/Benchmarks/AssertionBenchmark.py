@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Assertion Benchmark
+
+Compares AssertionHelper.getAssertion with its previous implementation (kept
+in FTB.Signatures.TestHelpers) on large stderr captures.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path += [BASE_DIR]
+
+from FTB import AssertionHelper
+from FTB.Signatures.LineBuffer import LineBuffer
+from FTB.Signatures.TestHelpers import legacyGetAssertion
+
+def getTestCases(lineCount):
+    '''
+    Create the stderr captures to benchmark with.
+
+    @type lineCount: int
+    @param lineCount: Number of lines of regular output in each capture
+
+    @rtype: list
+    @return: List of tuples (description, lines)
+    '''
+    noise = [ "[%s] Running test %s: everything is fine" % (idx % 1000, idx) for idx in range(lineCount) ]
+
+    testCases = []
+
+    testCases.append(("no-assertion", noise))
+
+    testCases.append(("assertion-end", noise + [
+                      "[26289] ###!!! ASSERTION: Unexpected non-ASCII character: '!(*s2 & ~0x7F)', file nsCharTraits.h, line 168",
+                      "Hit MOZ_CRASH() at mozalloc_abort.cpp:30",
+                      "==26289==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000000",
+                      ]))
+
+    testCases.append(("asan-only", noise + [
+                      "==26289==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000000",
+                      "    #0 0x7fac9b54873a in foo",
+                      ]))
+
+    testCases.append(("mozcrash-start", [ "Hit MOZ_CRASH(oops) at foo.cpp:3" ] + noise))
+
+    return testCases
+
+def runBenchmark(lineCount, iterations):
+    '''
+    Run the benchmark, making sure both implementations agree on every result.
+
+    @type lineCount: int
+    @param lineCount: Number of lines of regular output in each capture
+    @type iterations: int
+    @param iterations: Number of times each capture is searched
+
+    @rtype: list
+    @return: List of tuples (description, legacy seconds, new seconds)
+    '''
+    results = []
+
+    for (description, lines) in getTestCases(lineCount):
+        # CrashInfo stores stderr in a LineBuffer
+        lineBuffer = LineBuffer(lines)
+
+        for onlyProgramAssertions in (False, True):
+            if legacyGetAssertion(lines, onlyProgramAssertions) != AssertionHelper.getAssertion(lineBuffer, onlyProgramAssertions):
+                raise RuntimeError("Implementations disagree on test case %s" % description)
+
+        legacyTime = timeit.timeit(lambda: legacyGetAssertion(lines, True), number=iterations)
+        newTime = timeit.timeit(lambda: AssertionHelper.getAssertion(lineBuffer, True), number=iterations)
+
+        results.append((description, legacyTime, newTime))
+
+    return results
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", dest="lines", default=100000, type=int, help="Number of stderr lines (default is 100000)", metavar="N")
+    parser.add_argument("--iterations", dest="iterations", default=10, type=int, help="Number of iterations per test case (default is 10)", metavar="N")
+
+    opts = parser.parse_args(argv)
+
+    print("%-20s %12s %12s %8s" % ("Test case", "Legacy (s)", "New (s)", "Speedup"))
+    for (description, legacyTime, newTime) in runBenchmark(opts.lines, opts.iterations):
+        print("%-20s %12.4f %12.4f %7.1fx" % (description, legacyTime, newTime, legacyTime / newTime))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
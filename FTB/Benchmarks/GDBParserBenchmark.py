@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+GDB Parser Benchmark
+
+Measures the throughput of the GDB trace parser in GDBCrashInfo in lines per
+second and compares it with the previous implementation (kept here as
+L{legacyParse}) on large synthetic traces.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path += [BASE_DIR]
+
+from FTB.Signatures.TestHelpers import getTrace, legacyParse, parse
+
+def runBenchmark(frameCount, noiseLines, iterations):
+    '''
+    Run the benchmark, making sure both implementations agree on the result.
+
+    @type frameCount: int
+    @param frameCount: Number of frames in the trace
+    @type noiseLines: int
+    @param noiseLines: Number of program output lines before the trace
+    @type iterations: int
+    @param iterations: Number of times the trace is parsed
+
+    @rtype: tuple
+    @return: Tuple of line count, legacy lines per second and new lines per second
+    '''
+    lines = getTrace(frameCount, noiseLines)
+
+    if legacyParse(lines) != parse(lines):
+        raise RuntimeError("Implementations disagree on the synthetic trace")
+
+    legacyTime = timeit.timeit(lambda: legacyParse(lines), number=iterations)
+    newTime = timeit.timeit(lambda: parse(lines), number=iterations)
+
+    lineCount = len(lines) * iterations
+    return (len(lines), lineCount / legacyTime, lineCount / newTime)
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", dest="frames", default=256, type=int, help="Number of frames in the trace (default is 256)", metavar="N")
+    parser.add_argument("--noise", dest="noise", default=10000, type=int, help="Number of output lines before the trace (default is 10000)", metavar="N")
+    parser.add_argument("--iterations", dest="iterations", default=20, type=int, help="Number of iterations (default is 20)", metavar="N")
+
+    opts = parser.parse_args(argv)
+
+    (lineCount, legacyRate, newRate) = runBenchmark(opts.frames, opts.noise, opts.iterations)
+
+    print("Trace lines: %s" % lineCount)
+    print("%-10s %16s" % ("Parser", "Lines/s"))
+    print("%-10s %16.0f" % ("Legacy", legacyRate))
+    print("%-10s %16.0f" % ("New", newRate))
+    print("Speedup: %.1fx" % (newRate / legacyRate))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
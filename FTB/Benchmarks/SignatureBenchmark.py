@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Signature Benchmark
+
+Measures the performance of the whole signature pipeline: parse throughput,
+signature matches per second (single, batched and through a SignatureIndex),
+diff/fit latency and memory usage. It runs either on synthetic GDB/ASan crashes
+and signatures of configurable size, or on a recorded corpus (see L{loadCorpus}).
+The results are written as JSON, so runs on different revisions can be compared.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+from timeit import default_timer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path += [BASE_DIR]
+
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.SignatureIndex import SignatureIndex
+
+# Version of the JSON result format, increase on incompatible changes
+RESULT_FORMAT_VERSION = 1
+
+def getBugFrames(bugIdx, frameCount):
+    '''
+    Get the stack of a synthetic bug. The top frames are specific to the bug,
+    the remaining frames are shared by many bugs, like in real crashes.
+
+    @type bugIdx: int
+    @param bugIdx: Number of the bug
+    @type frameCount: int
+    @param frameCount: Number of frames in the stack
+
+    @rtype: list
+    @return: List of function names
+    '''
+    rand = random.Random(bugIdx)
+
+    frames = [ "js::jit::Bug%sFrame%s(JSContext*, JS::HandleValue)" % (bugIdx, idx) for idx in range(min(4, frameCount)) ]
+    while len(frames) < frameCount:
+        frames.append("js::Interpret%s(JSContext*, js::RunState&)" % rand.randint(0, 63))
+
+    return frames
+
+def getGDBCrash(rand, frames, noiseLines):
+    '''
+    Create the output of a synthetic crash caught by GDB.
+
+    @rtype: tuple
+    @return: Tuple of stdout, stderr and crash data lines
+    '''
+    stdout = [ "Running test %s" % idx for idx in range(noiseLines) ]
+    stderr = [ "[%s] Warning: something unusual happened" % rand.randint(1, 10000) for idx in range(noiseLines // 10) ]
+
+    crashData = [ "Program received signal SIGSEGV, Segmentation fault." ]
+    for (idx, frame) in enumerate(frames):
+        functionName = frame.split("(")[0]
+        if idx % 5 == 4:
+            # Frames with many arguments are wrapped by GDB
+            crashData.append("#%s  0x%016x in %s (cx=0x7ffff6a16000, " % (idx, rand.randint(0x400000, 0x800000), functionName))
+            crashData.append("    args=..., rval=...) at /srv/repos/mozilla-central/js/src/jit/Source%s.cpp:%s" % (idx, idx * 10))
+        else:
+            crashData.append("#%s  0x%016x in %s (cx=0x7ffff6a16000) at /srv/repos/mozilla-central/js/src/jit/Source%s.cpp:%s"
+                             % (idx, rand.randint(0x400000, 0x800000), functionName, idx, idx * 10))
+
+    for (idx, register) in enumerate([ "rax", "rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp", "rip" ]):
+        value = rand.choice([ 0, 0x2b2b2b2b, 0x7fffffffa2d0 + idx * 8 ])
+        crashData.append("%s            0x%x      %s" % (register, value, value))
+    crashData.append("=> 0x4a2c3b <%s+27>:\tmov    0x8(%%rax),%%rcx" % frames[0].split("(")[0])
+
+    return (stdout, stderr, crashData)
+
+def getASanCrash(rand, frames, noiseLines):
+    '''
+    Create the output of a synthetic crash caught by AddressSanitizer.
+
+    @rtype: tuple
+    @return: Tuple of stdout, stderr and crash data lines
+    '''
+    stdout = [ "Running test %s" % idx for idx in range(noiseLines) ]
+    stderr = [ "[%s] Warning: something unusual happened" % rand.randint(1, 10000) for idx in range(noiseLines // 10) ]
+
+    pid = rand.randint(1000, 30000)
+    stderr.append("ASAN:SIGSEGV")
+    stderr.append("=================================================================")
+    stderr.append("==%s==ERROR: AddressSanitizer: SEGV on unknown address 0x%08x (pc 0x%08x sp 0x%08x bp 0x%08x T0)"
+                  % (pid, rand.randint(0, 0x1000), rand.randint(0x8000000, 0x9000000), 0xffc57860, 0xffc57f18))
+    for (idx, frame) in enumerate(frames):
+        stderr.append("    #%s 0x%x in %s /srv/repos/mozilla-central/js/src/vm/Source%s.cpp:%s"
+                      % (idx, rand.randint(0x8000000, 0x9000000), frame, idx, idx * 10))
+    stderr.append("")
+    stderr.append("==%s==ABORTING" % pid)
+
+    return (stdout, stderr, None)
+
+def getSyntheticCrashes(crashCount, bugCount, frameCount, noiseLines, seed=0):
+    '''
+    Create synthetic crashes. Each crash belongs to one of bugCount bugs,
+    every second one is an ASan crash, the others are GDB crashes. Every
+    third bug also has an assertion failure on stderr.
+
+    @type crashCount: int
+    @param crashCount: Number of crashes to create
+    @type bugCount: int
+    @param bugCount: Number of distinct bugs the crashes belong to
+    @type frameCount: int
+    @param frameCount: Number of frames per crash
+    @type noiseLines: int
+    @param noiseLines: Number of regular output lines per crash
+    @type seed: int
+    @param seed: Seed for the random generator
+
+    @rtype: list
+    @return: List of tuples (stdout, stderr, crash data, configuration)
+    '''
+    rand = random.Random(seed)
+    configuration = ProgramConfiguration("mozilla-central", "x86-64", "linux")
+
+    crashes = []
+    for idx in range(crashCount):
+        bugIdx = rand.randint(0, bugCount - 1)
+        frames = getBugFrames(bugIdx, frameCount)
+
+        if idx % 2:
+            (stdout, stderr, crashData) = getASanCrash(rand, frames, noiseLines)
+        else:
+            (stdout, stderr, crashData) = getGDBCrash(rand, frames, noiseLines)
+
+        if bugIdx % 3 == 0:
+            stderr.insert(len(stderr) // 2, "Assertion failure: bug%s->isValid(), at /srv/repos/mozilla-central/js/src/jit/Bug%s.cpp:%s"
+                          % (bugIdx, bugIdx, bugIdx * 7))
+
+        crashes.append((stdout, stderr, crashData, configuration))
+
+    return crashes
+
+def getSyntheticSignatures(signatureCount, frameCount, seed=0):
+    '''
+    Create synthetic signatures, one per bug of L{getSyntheticCrashes}. They
+    are generated from crashes like in the server, some of them are modified
+    to contain wildcards or to require a crash address.
+
+    @type signatureCount: int
+    @param signatureCount: Number of signatures (and bugs) to create
+    @type frameCount: int
+    @param frameCount: Number of frames of the crashes the signatures are created from
+
+    @rtype: list
+    @return: List of raw signatures
+    '''
+    rand = random.Random(seed)
+    configuration = ProgramConfiguration("mozilla-central", "x86-64", "linux")
+
+    rawSignatures = []
+    for bugIdx in range(signatureCount):
+        (stdout, stderr, crashData) = getGDBCrash(rand, getBugFrames(bugIdx, frameCount), 0)
+        if bugIdx % 3 == 0:
+            stderr.append("Assertion failure: bug%s->isValid(), at /srv/repos/mozilla-central/js/src/jit/Bug%s.cpp:%s"
+                          % (bugIdx, bugIdx, bugIdx * 7))
+
+        crashInfo = CrashInfo.fromRawCrashData(stdout, stderr, configuration, crashData)
+        signature = crashInfo.createCrashSignature(forceCrashAddress=(bugIdx % 4 == 1))
+        sigObj = json.loads(str(signature))
+
+        if bugIdx % 5 == 2:
+            # Allow any frames between the top frame and the rest
+            for symptom in sigObj["symptoms"]:
+                if symptom["type"] == "stackFrames":
+                    symptom["functionNames"] = symptom["functionNames"][:2] + [ "???" ] + symptom["functionNames"][3:]
+
+        rawSignatures.append(json.dumps(sigObj, indent=2))
+
+    return rawSignatures
+
+def loadCorpus(corpusDir):
+    '''
+    Load a recorded corpus. The corpus directory contains signature files
+    (*.signature, like a signature cache directory) and one subdirectory per
+    crash with the files "stdout", "stderr" and "crashdata" (all optional).
+    A "configuration" file in the crash directory may contain a JSON object
+    with "product", "platform" and "os", otherwise x86-64 linux is assumed.
+
+    Corpora are meant to be shared, so they should be anonymized when they
+    are recorded (e.g. by removing paths, hostnames and environment data).
+
+    @type corpusDir: string
+    @param corpusDir: Directory containing the corpus
+
+    @rtype: tuple
+    @return: Tuple of the crashes (see L{getSyntheticCrashes}) and the raw signatures
+    '''
+    crashes = []
+    rawSignatures = []
+
+    for name in sorted(os.listdir(corpusDir)):
+        path = os.path.join(corpusDir, name)
+
+        if name.endswith(".signature"):
+            with open(path) as f:
+                rawSignatures.append(f.read())
+            continue
+
+        if not os.path.isdir(path):
+            continue
+
+        def readLines(fileName):
+            fileName = os.path.join(path, fileName)
+            if not os.path.exists(fileName):
+                return None
+            with open(fileName) as f:
+                return f.read().splitlines()
+
+        configObj = { "product" : "corpus", "platform" : "x86-64", "os" : "linux" }
+        configFile = os.path.join(path, "configuration")
+        if os.path.exists(configFile):
+            with open(configFile) as f:
+                configObj.update(json.load(f))
+
+        configuration = ProgramConfiguration(configObj["product"], configObj["platform"], configObj["os"])
+        crashes.append((readLines("stdout") or [], readLines("stderr") or [], readLines("crashdata"), configuration))
+
+    return (crashes, rawSignatures)
+
+def getMaxRSS():
+    '''
+    @rtype: int
+    @return: Peak resident set size of this process in KiB
+    '''
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes instead of KiB
+        maxRSS //= 1024
+    return maxRSS
+
+def getLatencyStatistics(latencies):
+    '''
+    @type latencies: list
+    @param latencies: Measured latencies in seconds
+
+    @rtype: dict
+    @return: Mean, median, 95th percentile and maximum in milliseconds
+    '''
+    if not latencies:
+        return None
+
+    latencies = sorted(latencies)
+    return {
+            "count" : len(latencies),
+            "meanMs" : sum(latencies) * 1000 / len(latencies),
+            "medianMs" : latencies[len(latencies) // 2] * 1000,
+            "p95Ms" : latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+            "maxMs" : latencies[-1] * 1000
+            }
+
+def getRevision():
+    '''
+    @rtype: string
+    @return: The git revision of the source tree, or None if unknown
+    '''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmark(crashes, rawSignatures, iterations=1, maxFitPairs=200):
+    '''
+    Run the benchmark on the given crashes and signatures.
+
+    @type crashes: list
+    @param crashes: Crashes as returned by L{getSyntheticCrashes} or L{loadCorpus}
+    @type rawSignatures: list
+    @param rawSignatures: Signatures to match
+    @type iterations: int
+    @param iterations: Number of times the crashes are parsed and matched
+    @type maxFitPairs: int
+    @param maxFitPairs: Maximum number of signature/crash pairs to measure diff/fit latency on
+
+    @rtype: dict
+    @return: The results, suitable for serialization with JSON
+    '''
+    results = {}
+
+    # Parse throughput, including the initial parse on first access
+    lineCount = sum([ len(stdout) + len(stderr) + len(crashData or []) for (stdout, stderr, crashData, configuration) in crashes ])
+    rssBefore = getMaxRSS()
+
+    parseTime = 0.0
+    for iteration in range(iterations):
+        startTime = default_timer()
+        crashInfos = []
+        for (stdout, stderr, crashData, configuration) in crashes:
+            crashInfo = CrashInfo.fromRawCrashData(stdout, stderr, configuration, crashData)
+            crashInfo.backtrace
+            crashInfo.assertion
+            crashInfos.append(crashInfo)
+        parseTime += default_timer() - startTime
+
+    results["parse"] = {
+                        "crashes" : len(crashes),
+                        "lines" : lineCount,
+                        "seconds" : parseTime,
+                        "crashesPerSecond" : len(crashes) * iterations / parseTime if parseTime else None,
+                        "linesPerSecond" : lineCount * iterations / parseTime if parseTime else None
+                        }
+
+    # The peak RSS only grows, so this is an upper bound for the parsed crashes
+    rssAfter = getMaxRSS()
+    results["memory"] = {
+                         "maxRSSKiB" : rssAfter,
+                         "parsedCrashesKiB" : rssAfter - rssBefore
+                         }
+
+    signatures = [ CrashSignature(rawSignature) for rawSignature in rawSignatures ]
+    pairCount = len(signatures) * len(crashInfos)
+
+    # Single matches, like the server does when viewing crashes
+    matchCount = 0
+    startTime = default_timer()
+    for iteration in range(iterations):
+        for signature in signatures:
+            for crashInfo in crashInfos:
+                if signature.matches(crashInfo):
+                    matchCount += 1
+    matchTime = default_timer() - startTime
+
+    # Batched matches, like the server does when reassigning a bucket
+    startTime = default_timer()
+    for iteration in range(iterations):
+        for signature in signatures:
+            signature.matchesMany(crashInfos)
+    matchManyTime = default_timer() - startTime
+
+    # Index searches, like the client does when searching a crash
+    index = SignatureIndex()
+    for (idx, signature) in enumerate(signatures):
+        index.addSignature(idx, signature)
+
+    # The first search builds the lookup structures
+    if crashInfos:
+        index.search(crashInfos[0])
+
+    startTime = default_timer()
+    for iteration in range(iterations):
+        for crashInfo in crashInfos:
+            index.search(crashInfo)
+    searchTime = default_timer() - startTime
+
+    results["match"] = {
+                        "signatures" : len(signatures),
+                        "pairs" : pairCount,
+                        "matchingPairs" : matchCount // iterations,
+                        "matchesPerSecond" : pairCount * iterations / matchTime if matchTime else None,
+                        "batchedMatchesPerSecond" : pairCount * iterations / matchManyTime if matchManyTime else None,
+                        "indexSearchesPerSecond" : len(crashInfos) * iterations / searchTime if searchTime else None
+                        }
+
+    # Diff/fit latency, like the server does when proposing signatures
+    rand = random.Random(0)
+    pairs = [ (signature, crashInfo) for signature in signatures for crashInfo in crashInfos ]
+    if len(pairs) > maxFitPairs:
+        pairs = rand.sample(pairs, maxFitPairs)
+
+    distanceLatencies = []
+    fitLatencies = []
+    for (signature, crashInfo) in pairs:
+        startTime = default_timer()
+        signature.getDistance(crashInfo)
+        distanceLatencies.append(default_timer() - startTime)
+
+        startTime = default_timer()
+        signature.fit(crashInfo)
+        fitLatencies.append(default_timer() - startTime)
+
+    results["diff"] = getLatencyStatistics(distanceLatencies)
+    results["fit"] = getLatencyStatistics(fitLatencies)
+
+    return results
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", dest="corpus", help="Directory containing a recorded corpus to use instead of synthetic data", metavar="DIR")
+    parser.add_argument("--crashes", dest="crashes", default=500, type=int, help="Number of synthetic crashes (default is 500)", metavar="N")
+    parser.add_argument("--signatures", dest="signatures", default=100, type=int, help="Number of synthetic signatures (default is 100)", metavar="N")
+    parser.add_argument("--frames", dest="frames", default=32, type=int, help="Number of frames per synthetic crash (default is 32)", metavar="N")
+    parser.add_argument("--noise", dest="noise", default=200, type=int, help="Number of output lines per synthetic crash (default is 200)", metavar="N")
+    parser.add_argument("--seed", dest="seed", default=0, type=int, help="Seed for the synthetic data (default is 0)", metavar="N")
+    parser.add_argument("--iterations", dest="iterations", default=1, type=int, help="Number of iterations (default is 1)", metavar="N")
+    parser.add_argument("--output", dest="output", help="File to write the JSON results to (default is stdout)", metavar="FILE")
+
+    opts = parser.parse_args(argv)
+
+    if opts.corpus:
+        (crashes, rawSignatures) = loadCorpus(opts.corpus)
+        parameters = { "corpus" : os.path.basename(os.path.normpath(opts.corpus)) }
+    else:
+        # Every signature belongs to one bug, so about half of the crashes match
+        crashes = getSyntheticCrashes(opts.crashes, opts.signatures * 2, opts.frames, opts.noise, opts.seed)
+        rawSignatures = getSyntheticSignatures(opts.signatures, opts.frames, opts.seed)
+        parameters = {
+                      "crashes" : opts.crashes,
+                      "signatures" : opts.signatures,
+                      "frames" : opts.frames,
+                      "noise" : opts.noise,
+                      "seed" : opts.seed
+                      }
+
+    parameters["iterations"] = opts.iterations
+
+    output = {
+              "version" : RESULT_FORMAT_VERSION,
+              "revision" : getRevision(),
+              "python" : sys.version.split()[0],
+              "parameters" : parameters,
+              "results" : runBenchmark(crashes, rawSignatures, opts.iterations)
+              }
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(output, indent=2, sort_keys=True))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Stack Frames Benchmark
+
+Compares the index-based StackFramesSymptom matcher and the alignment based
+diff with their previous implementations (kept in FTB.Signatures.TestHelpers)
+on large stacks with wildcards.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path += [BASE_DIR]
+
+from FTB.Signatures.Matchers import StringMatch
+from FTB.Signatures.Symptom import StackFramesSymptom
+from FTB.Signatures.TestHelpers import legacyMatch, legacyDiffDistance
+
+def getTestCases(frameCount):
+    '''
+    Create the stacks and signatures to benchmark with.
+
+    @type frameCount: int
+    @param frameCount: Number of frames in each stack
+
+    @rtype: list
+    @return: List of tuples (description, stack, functionNames)
+    '''
+    stack = [ "js::frame%s" % idx for idx in range(frameCount) ]
+
+    testCases = []
+
+    # Plain prefix, as created by createCrashSignature
+    testCases.append(("prefix", stack, [ StringMatch(x) for x in stack[:8] ]))
+
+    # Several multi wildcards with the last frame at the very end of the stack
+    rawNames = [ "js::frame0", "???", "js::frame%s" % (frameCount / 4), "???", "js::frame%s" % (frameCount / 2), "???", stack[-1] ]
+    testCases.append(("wildcards-match", stack, [ StringMatch(x) for x in rawNames ]))
+
+    # Multi wildcards around a frame that matches everywhere, but the last
+    # frame doesn't exist, so every alternative has to be tried
+    rawNames = [ "js::frame0", "???", "js::frame", "???", "js::missing" ]
+    testCases.append(("wildcards-nomatch", stack, [ StringMatch(x) for x in rawNames ]))
+
+    # Single wildcards mixed with PCREs
+    rawNames = [ "?", "/^js::frame[0-9]$/", "?", "?", "/frame1[0-9]$/", "???", "/frame%s$/" % (frameCount - 1) ]
+    testCases.append(("pcre-wildcards", stack, [ StringMatch(x) for x in rawNames ]))
+
+    return testCases
+
+def getDiffTestCases(frameCount):
+    '''
+    Create the stacks and signatures to benchmark the diff with.
+
+    @type frameCount: int
+    @param frameCount: Number of frames in each stack
+
+    @rtype: list
+    @return: List of tuples (description, stack, functionNames)
+    '''
+    stack = [ "js::frame%s" % idx for idx in range(frameCount) ]
+
+    testCases = []
+
+    # Two frames missing from the signature, as after inlining changes
+    rawNames = stack[:3] + stack[4:6] + stack[7:10]
+    testCases.append(("diff-missing", stack, [ StringMatch(x) for x in rawNames ]))
+
+    # Three frames replaced in the stack
+    rawNames = list(stack[:8])
+    for idx in (1, 4, 6):
+        rawNames[idx] = "js::renamed%s" % idx
+    testCases.append(("diff-replaced", stack, [ StringMatch(x) for x in rawNames ]))
+
+    return testCases
+
+def runBenchmark(frameCount, iterations):
+    '''
+    Run the benchmark, making sure both implementations agree on every result.
+
+    @type frameCount: int
+    @param frameCount: Number of frames in each stack
+    @type iterations: int
+    @param iterations: Number of times each test case is matched
+
+    @rtype: list
+    @return: List of tuples (description, result, legacy seconds, new seconds)
+    '''
+    results = []
+
+    for (description, stack, functionNames) in getTestCases(frameCount):
+        legacyResult = legacyMatch(stack, functionNames)
+        result = StackFramesSymptom._match(stack, functionNames)
+
+        if legacyResult != result:
+            raise RuntimeError("Implementations disagree on test case %s" % description)
+
+        functionNameTypes = StackFramesSymptom._getFunctionNameTypes(functionNames)
+
+        legacyTime = timeit.timeit(lambda: legacyMatch(stack, functionNames), number=iterations)
+        newTime = timeit.timeit(lambda: StackFramesSymptom._match(stack, functionNames, functionNameTypes), number=iterations)
+
+        results.append((description, result, legacyTime, newTime))
+
+    for (description, stack, functionNames) in getDiffTestCases(frameCount):
+        legacyResult = legacyDiffDistance(stack, functionNames)
+        result = StackFramesSymptom._diff(stack, functionNames)[0]
+
+        if legacyResult != result:
+            raise RuntimeError("Implementations disagree on test case %s" % description)
+
+        legacyTime = timeit.timeit(lambda: legacyDiffDistance(stack, functionNames), number=iterations)
+        newTime = timeit.timeit(lambda: StackFramesSymptom._diff(stack, functionNames), number=iterations)
+
+        results.append((description, result, legacyTime, newTime))
+
+    return results
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", dest="frames", default=128, type=int, help="Number of frames per stack (default is 128)", metavar="N")
+    parser.add_argument("--iterations", dest="iterations", default=100, type=int, help="Number of iterations per test case (default is 100)", metavar="N")
+
+    opts = parser.parse_args(argv)
+
+    # The legacy implementation recurses once per frame
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), opts.frames * 4))
+
+    print("%-20s %-8s %12s %12s %8s" % ("Test case", "Result", "Legacy (s)", "New (s)", "Speedup"))
+    for (description, result, legacyTime, newTime) in runBenchmark(opts.frames, opts.iterations):
+        print("%-20s %-8s %12.4f %12.4f %7.1fx" % (description, result, legacyTime, newTime, legacyTime / newTime))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+'''
+Tests
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+import json
+import unittest
+
+from FTB.Benchmarks.SignatureBenchmark import getSyntheticCrashes, getSyntheticSignatures, runBenchmark
+
+class SignatureBenchmarkTest(unittest.TestCase):
+    def runTest(self):
+        crashes = getSyntheticCrashes(20, 4, 8, 10)
+        rawSignatures = getSyntheticSignatures(2, 8)
+        
+        results = runBenchmark(crashes, rawSignatures, maxFitPairs=10)
+        
+        # Crashes of the bugs we have signatures for must match
+        self.assertEqual(results["parse"]["crashes"], 20)
+        self.assertEqual(results["match"]["pairs"], 40)
+        self.assertTrue(results["match"]["matchingPairs"] > 0)
+        self.assertEqual(results["fit"]["count"], 10)
+        
+        # Results must be serializable
+        json.dumps(results)
+
+if __name__ == "__main__":
+    unittest.main()
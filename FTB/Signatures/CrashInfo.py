@@ -23,12 +23,51 @@ import re
 import sys
 from FTB.Signatures import RegisterHelper
 from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.LineBuffer import LineBuffer, MappedLineBuffer
+from FTB.Signatures.SymbolTable import Backtrace
 from FTB.ProgramConfiguration import ProgramConfiguration
 
 from numpy import int32, int64, uint32, uint64
 import json
 from FTB import AssertionHelper
+import mmap
 import os
+import shutil
+import stat
+import tempfile
+
+# Markers used to detect the type of crash output
+ASAN_MARKER = "ERROR: AddressSanitizer:"
+GDB_MARKER = "Program received signal "
+GDB_CORE_MARKER = "Program terminated with signal "
+
+# Last line of an ASan report (see AutoRunner), mapped output isn't parsed beyond it
+ASAN_END_MARKER = "==ABORTING"
+
+# Version of the parsed data produced by the parsers in this module. This must
+# be increased whenever a parser change affects its results, so parsed data
+# stored by older versions (see L{CrashInfo.toCacheObject}) is discarded.
+PARSER_VERSION = 1
+
+# Size of the chunks used to copy streams that can't be mapped directly
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Patterns used by the GDB trace parser
+GDB_FRAME_START_PATTERN = re.compile("\\s*#\\d+.+")
+GDB_FRAME_PATTERNS = [
+                      re.compile("\\s*#(\\d+)\\s+(0x[0-9a-f]+) in (.+?) \\(.*?\\)( at .+)?"),
+                      re.compile("\\s*#(\\d+)\\s+()(.+?) \\(.*?\\)( at .+)?"),
+                      ]
+GDB_REGISTER_PATTERN = re.compile(RegisterHelper.getRegisterPattern() + "\\s+0x([0-9a-f]+)")
+GDB_CRASH_ADDRESS_PATTERN = re.compile("Crash Address:\\s+0x([0-9a-f]+)")
+GDB_CRASH_INSTRUCTION_PATTERN = re.compile("=> 0x[0-9a-f]+(?: <.+>)?:\\s+(.+)")
+
+# Searching GDB_REGISTER_PATTERN is slow because it tries all register names
+# at every position. Instead, we search for register values (which are rare)
+# and check for a register name in front of them (see L{GDBCrashInfo.searchRegister}).
+GDB_REGISTER_VALUE_PATTERN = re.compile("\\s+0x[0-9a-f]")
+GDB_REGISTER_NAMES = set([ name for names in RegisterHelper.validRegisters.values() for name in names ])
+GDB_REGISTER_NAME_LENGTHS = sorted(set([ len(name) for name in GDB_REGISTER_NAMES ]))
 
 class CrashInfo():
     '''
@@ -37,28 +76,203 @@ class CrashInfo():
     '''
     __metaclass__ = ABCMeta
     
+    # Many crash information objects are kept in memory during triage
+    __slots__ = ("rawStdout", "rawStderr", "rawCrashData", "_parsed", "_parsing", "_parseError", "_backtrace", "_registers",
+                 "_crashAddress", "_crashInstruction", "configuration", "_testcase", "_testcaseLines", "_failureReason",
+                 "useCrashData", "traceOffset", "rawFiles", "_assertion", "_assertionParsed")
+    
     def __init__(self):
         # Store the raw data
-        self.rawStdout = []
-        self.rawStderr = []
-        self.rawCrashData = []
-        
-        # Store processed data
-        self.backtrace = []
-        self.registers = {}
-        self.crashAddress = None
-        self.crashInstruction = None
+        self.rawStdout = LineBuffer()
+        self.rawStderr = LineBuffer()
+        self.rawCrashData = LineBuffer()
+        
+        # Store processed data. This is only computed when any of it is
+        # accessed for the first time (see L{_ensureParsed}), because many
+        # crashes are rejected before any of this data is needed.
+        self._parsed = False
+        self._parsing = False
+        self._parseError = None
+        self._resetParsedData()
         
         # Store configuration data (platform, product, os, etc.)
         self.configuration = None
         
         # This is an optional testcase that is not stored with the crashInfo but
         # can be "attached" before matching signatures that might require the
-        # testcase.
-        self.testcase = None
+        # testcase (see L{testcase}).
+        self._testcase = None
+        self._testcaseLines = None
+        
+        # Whether to parse the trace from crashData instead of stderr, and
+        # optionally the offset of the trace within it (see L{fromStreams}).
+        self.useCrashData = False
+        self.traceOffset = None
+        
+        # Absolute paths of the files (stdout, stderr, crashData) the raw data
+        # was mapped from, if it was created with L{fromFiles}.
+        self.rawFiles = None
+        
+        # The program assertion found on stderr, also computed on first access
+        self._assertion = None
+        self._assertionParsed = False
+    
+    def _resetParsedData(self):
+        self._backtrace = Backtrace()
+        self._registers = {}
+        self._crashAddress = None
+        self._crashInstruction = None
         
         # This can be used to record failures during signature creation
-        self.failureReason = None
+        self._failureReason = None
+    
+    def _ensureParsed(self):
+        # Accessing the data while parsing must not recurse
+        if self._parsed or self._parsing:
+            return
+        
+        # A crash that failed to parse fails on every access, not only the first
+        if self._parseError != None:
+            raise self._parseError
+        
+        self._parsing = True
+        try:
+            self._parse()
+        except Exception, e:
+            self._resetParsedData()
+            self._parseError = e
+            raise
+        finally:
+            self._parsing = False
+        
+        self._parsed = True
+    
+    def _parse(self):
+        '''
+        Compute the processed data (backtrace, registers, crash address and
+        crash instruction) from the raw data. Subclasses override this to
+        implement the actual parsing, it is called at most once.
+        '''
+        pass
+    
+    def _getTraceLines(self, endMarker=None):
+        '''
+        @type endMarker: string
+        @param endMarker: For mapped output, stop after the first line containing this marker
+        
+        @rtype: iterable
+        @return: The lines the trace should be parsed from. For mapped output,
+                 only the lines of the crash trace section are read, one at a time.
+        '''
+        if self.useCrashData:
+            lines = self.rawCrashData
+        else:
+            lines = self.rawStderr
+        
+        if self.traceOffset != None:
+            return CrashInfo._iterTraceSection(lines, self.traceOffset, endMarker)
+        
+        return lines
+    
+    @staticmethod
+    def _iterTraceSection(lines, offset, endMarker):
+        for line in lines.iterFrom(offset):
+            yield line
+            if endMarker != None and endMarker in line:
+                return
+    
+    @property
+    def backtrace(self):
+        self._ensureParsed()
+        return self._backtrace
+    
+    @backtrace.setter
+    def backtrace(self, value):
+        self._ensureParsed()
+        if not isinstance(value, Backtrace):
+            value = Backtrace(value)
+        self._backtrace = value
+    
+    @property
+    def registers(self):
+        self._ensureParsed()
+        return self._registers
+    
+    @registers.setter
+    def registers(self, value):
+        self._ensureParsed()
+        self._registers = value
+    
+    @property
+    def crashAddress(self):
+        self._ensureParsed()
+        return self._crashAddress
+    
+    @crashAddress.setter
+    def crashAddress(self, value):
+        self._ensureParsed()
+        self._crashAddress = value
+    
+    @property
+    def crashInstruction(self):
+        self._ensureParsed()
+        return self._crashInstruction
+    
+    @crashInstruction.setter
+    def crashInstruction(self, value):
+        self._ensureParsed()
+        self._crashInstruction = value
+    
+    @property
+    def failureReason(self):
+        self._ensureParsed()
+        return self._failureReason
+    
+    @failureReason.setter
+    def failureReason(self, value):
+        self._ensureParsed()
+        self._failureReason = value
+    
+    @property
+    def testcase(self):
+        '''
+        The attached testcase. It can be attached as string, as L{LineBuffer}
+        (e.g. a L{MappedLineBuffer} over the testcase file) or as function
+        returning either of these. The function is only called when the
+        testcase is accessed for the first time.
+        '''
+        if callable(self._testcase):
+            self._testcase = self._testcase()
+        return self._testcase
+    
+    @testcase.setter
+    def testcase(self, value):
+        self._testcase = value
+        self._testcaseLines = None
+    
+    def getTestcaseLines(self):
+        '''
+        @rtype: LineBuffer
+        @return: The lines of the attached testcase, or None if there is no testcase
+        '''
+        if self._testcaseLines == None:
+            testcase = self.testcase
+            if isinstance(testcase, basestring):
+                # Only split once, no matter how many symptoms need the lines
+                testcase = LineBuffer(testcase.splitlines())
+            self._testcaseLines = testcase
+        return self._testcaseLines
+    
+    @property
+    def assertion(self):
+        '''
+        @rtype: string
+        @return: The last program assertion on stderr (see L{AssertionHelper.getAssertion}), or None
+        '''
+        if not self._assertionParsed:
+            self._assertionParsed = True
+            self._assertion = AssertionHelper.getAssertion(self.rawStderr, True)
+        return self._assertion
     
     def __str__(self):
         buf = []
@@ -115,10 +329,6 @@ class CrashInfo():
         if isinstance(auxCrashData, basestring):
             auxCrashData = auxCrashData.splitlines()
         
-        asanString = "ERROR: AddressSanitizer:"
-        gdbString = "Program received signal "
-        gdbCoreString = "Program terminated with signal "
-        
         # Search both crashData and stderr, but prefer crashData
         lines = []
         if (auxCrashData != None):
@@ -127,9 +337,9 @@ class CrashInfo():
             lines.extend(stderr)
         
         for line in lines:
-            if asanString in line:
+            if ASAN_MARKER in line:
                 return ASanCrashInfo(stdout, stderr, configuration, auxCrashData)
-            elif gdbString in line or gdbCoreString in line:
+            elif GDB_MARKER in line or GDB_CORE_MARKER in line:
                 return GDBCrashInfo(stdout, stderr, configuration, auxCrashData)
         
         # Default fallback to be used if there is neither ASan nor GDB output.
@@ -137,13 +347,260 @@ class CrashInfo():
         # e.g. stdout/stderr output with signatures.
         return NoCrashInfo(stdout, stderr, configuration, auxCrashData)
     
+    @staticmethod
+    def fromFiles(stdoutFile, stderrFile, configuration, auxCrashDataFile=None):
+        '''
+        Create appropriate CrashInfo instance from files containing the raw
+        crash data, see L{fromStreams}.
+        
+        @type stdoutFile: string
+        @param stdoutFile: Path to the file containing stdout, or None
+        @type stderrFile: string
+        @param stderrFile: Path to the file containing stderr, or None
+        @type configuration: ProgramConfiguration
+        @param configuration: Exact program configuration that is associated with the crash
+        @type auxCrashDataFile: string
+        @param auxCrashDataFile: Optional path to a file containing additional crash output (e.g. GDB)
+        
+        @rtype: CrashInfo
+        @return: Crash information object
+        '''
+        streams = []
+        try:
+            for fileName in (stdoutFile, stderrFile, auxCrashDataFile):
+                if fileName == None:
+                    streams.append(None)
+                else:
+                    streams.append(open(fileName, 'rb'))
+            
+            crashInfo = CrashInfo.fromStreams(streams[0], streams[1], configuration, streams[2])
+        finally:
+            for stream in streams:
+                if stream != None:
+                    stream.close()
+        
+        crashInfo.rawFiles = tuple([ os.path.abspath(fileName) if fileName != None else None
+                                     for fileName in (stdoutFile, stderrFile, auxCrashDataFile) ])
+        
+        return crashInfo
+    
+    @staticmethod
+    def fromStreams(stdout, stderr, configuration, auxCrashData=None):
+        '''
+        Create appropriate CrashInfo instance from file objects containing the
+        raw crash data. Unlike L{fromRawCrashData}, this never reads the data
+        into memory as a whole, so it is suitable for very large logs:
+        
+        Regular files are memory mapped, other streams are copied to a temporary
+        file and mapped from there. The crash type is detected by searching the
+        maps for the ASan/GDB markers and the raw data is exposed as
+        L{MappedLineBuffer}s. Only the crash trace section, starting with the
+        line containing the marker, is read into memory for parsing.
+        
+        The streams can be closed once this method returns.
+        
+        @type stdout: file
+        @param stdout: File object to read stdout from, or None
+        @type stderr: file
+        @param stderr: File object to read stderr from, or None
+        @type configuration: ProgramConfiguration
+        @param configuration: Exact program configuration that is associated with the crash
+        @type auxCrashData: file
+        @param auxCrashData: Optional file object to read additional crash output (e.g. GDB) from.
+                             If not specified, stderr is used.
+        
+        @rtype: CrashInfo
+        @return: Crash information object
+        '''
+        assert isinstance(configuration, ProgramConfiguration)
+        
+        stdout = CrashInfo._mapStream(stdout)
+        stderr = CrashInfo._mapStream(stderr)
+        auxCrashData = CrashInfo._mapStream(auxCrashData)
+        
+        # Search both crashData and stderr, but prefer crashData
+        crashClass = NoCrashInfo
+        traceOffset = None
+        for (lines, isCrashData) in ((auxCrashData, True), (stderr, False)):
+            if lines == None:
+                continue
+            
+            marker = CrashInfo._findTraceMarker(lines)
+            if marker != None:
+                (crashClass, markerOffset) = marker
+                
+                # The trace is only parsed from crashData if it is available,
+                # regardless of where the marker was found.
+                if isCrashData or auxCrashData == None:
+                    traceOffset = markerOffset
+                break
+        
+        crashInfo = crashClass(None, None, configuration)
+        
+        if stdout != None:
+            crashInfo.rawStdout = stdout
+        if stderr != None:
+            crashInfo.rawStderr = stderr
+        if auxCrashData != None:
+            crashInfo.rawCrashData = auxCrashData
+        
+        crashInfo.useCrashData = auxCrashData != None
+        crashInfo.traceOffset = traceOffset
+        
+        return crashInfo
+    
+    @staticmethod
+    def fromCacheObject(cacheObject, stdout, stderr, configuration, auxCrashData=None):
+        '''
+        Create a CrashInfo instance from the parsed data returned by
+        L{toCacheObject} and the raw crash data it was created from. The raw
+        data is only stored (e.g. for output symptoms), it is not parsed again.
+        
+        @type cacheObject: dict
+        @param cacheObject: Parsed data as returned by L{toCacheObject}
+        @type stdout: List of strings
+        @param stdout: List of lines as they appeared on stdout
+        @type stderr: List of strings
+        @param stderr: List of lines as they appeared on stderr
+        @type configuration: ProgramConfiguration
+        @param configuration: Exact program configuration that is associated with the crash
+        @type auxCrashData: List of strings
+        @param auxCrashData: Optional additional crash output (e.g. GDB)
+        
+        @rtype: CrashInfo
+        @return: Crash information object, or None if the parsed data was
+                 created by a different parser version and must be discarded.
+        '''
+        assert isinstance(configuration, ProgramConfiguration)
+        
+        if cacheObject.get("version") != PARSER_VERSION:
+            return None
+        
+        crashClasses = dict([ (crashClass.__name__, crashClass) for crashClass in (NoCrashInfo, ASanCrashInfo, GDBCrashInfo) ])
+        crashClass = crashClasses.get(cacheObject.get("type"))
+        if crashClass == None:
+            return None
+        
+        if isinstance(stdout, basestring):
+            stdout = stdout.splitlines()
+        
+        if isinstance(stderr, basestring):
+            stderr = stderr.splitlines()
+        
+        if isinstance(auxCrashData, basestring):
+            auxCrashData = auxCrashData.splitlines()
+        
+        crashInfo = crashClass(stdout, stderr, configuration, auxCrashData)
+        
+        crashInfo._parsed = True
+        crashInfo._backtrace = Backtrace(cacheObject["backtrace"])
+        crashInfo._registers = dict([ (str(register), long(value)) for (register, value) in cacheObject["registers"].items() ])
+        crashInfo._crashInstruction = cacheObject["crashInstruction"]
+        crashInfo._failureReason = cacheObject["failureReason"]
+        
+        if cacheObject["crashAddress"] != None:
+            crashInfo._crashAddress = long(cacheObject["crashAddress"])
+        
+        crashInfo._assertionParsed = True
+        crashInfo._assertion = cacheObject["assertion"]
+        
+        return crashInfo
+    
+    def toCacheObject(self):
+        '''
+        Get the parsed data of this crash (backtrace, registers, crash address,
+        crash instruction and assertion) in a form that can be serialized with
+        JSON and stored next to the raw data. L{fromCacheObject} recreates the
+        crash information from it without parsing the raw data again.
+        
+        @rtype: dict
+        @return: The parsed data, tagged with the parser version
+        '''
+        crashAddress = self.crashAddress
+        if crashAddress != None:
+            # Might be a numpy type, which can't be serialized
+            crashAddress = long(crashAddress)
+        
+        return {
+                "version" : PARSER_VERSION,
+                "type" : self.__class__.__name__,
+                "backtrace" : list(self.backtrace),
+                "registers" : self.registers,
+                "crashAddress" : crashAddress,
+                "crashInstruction" : self.crashInstruction,
+                "failureReason" : self.failureReason,
+                "assertion" : self.assertion,
+                }
+    
+    @staticmethod
+    def _mapStream(stream):
+        '''
+        Map the given stream into memory.
+        
+        @type stream: file
+        @param stream: File object to map, or None
+        
+        @rtype: LineBuffer
+        @return: Lines contained in the stream, or None if no stream was given
+        '''
+        if stream == None:
+            return None
+        
+        try:
+            fileno = stream.fileno()
+            isRegularFile = stat.S_ISREG(os.fstat(fileno).st_mode)
+        except (AttributeError, IOError, OSError, ValueError):
+            # E.g. in-memory streams
+            isRegularFile = False
+        
+        if not isRegularFile:
+            spoolFile = tempfile.TemporaryFile()
+            try:
+                shutil.copyfileobj(stream, spoolFile, STREAM_CHUNK_SIZE)
+                spoolFile.flush()
+                return CrashInfo._mapStream(spoolFile)
+            finally:
+                spoolFile.close()
+        
+        if os.fstat(fileno).st_size == 0:
+            # Empty files can't be mapped
+            return LineBuffer()
+        
+        return MappedLineBuffer(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+    
+    @staticmethod
+    def _findTraceMarker(lines):
+        '''
+        Find the first line containing an ASan or GDB marker.
+        
+        @type lines: MappedLineBuffer
+        @param lines: The lines to search
+        
+        @rtype: tuple
+        @return: Tuple of the CrashInfo class to use and the offset of the line
+                 containing the marker, or None if there is no marker.
+        '''
+        result = None
+        
+        # ASan markers take precedence if both appear on the same line
+        for (marker, crashClass) in ((ASAN_MARKER, ASanCrashInfo), (GDB_MARKER, GDBCrashInfo), (GDB_CORE_MARKER, GDBCrashInfo)):
+            offset = lines.find(marker)
+            if offset < 0:
+                continue
+            
+            lineStart = lines.getLineStart(offset)
+            if result == None or lineStart < result[1]:
+                result = (crashClass, lineStart)
+        
+        return result
+    
     def createShortSignature(self):
         '''
         @rtype: String
         @return: A string representing this crash (short signature)
         '''
         # See if we have an abort message and if so, use that as short signature
-        abortMsg = AssertionHelper.getAssertion(self.rawStderr, True)
+        abortMsg = self.assertion
         if abortMsg != None:
             return abortMsg
         
@@ -175,7 +632,7 @@ class CrashInfo():
             numFrames = len(self.backtrace)
         
         # See if we have an abort message and if so, get a sanitized version of it
-        abortMsg = AssertionHelper.getAssertion(self.rawStderr, True)
+        abortMsg = self.assertion
         if abortMsg != None:
             abortMsg = AssertionHelper.getSanitizedAssertionPattern(abortMsg)
         
@@ -277,6 +734,8 @@ class CrashInfo():
         return CrashSignature(json.dumps(sigObj, indent=2))
 
 class NoCrashInfo(CrashInfo):
+    __slots__ = ()
+    
     def __init__(self, stdout, stderr, configuration, crashData=None):
         '''
         Private constructor, called by L{CrashInfo.fromRawCrashData}. Do not use directly.
@@ -284,17 +743,19 @@ class NoCrashInfo(CrashInfo):
         CrashInfo.__init__(self)
         
         if stdout != None:
-            self.rawStdout.extend(stdout)
+            self.rawStdout = LineBuffer(stdout)
             
         if stderr != None:
-            self.rawStderr.extend(stderr)
+            self.rawStderr = LineBuffer(stderr)
         
         if crashData != None:
-            self.rawCrashData.extend(crashData)
+            self.rawCrashData = LineBuffer(crashData)
         
         self.configuration = configuration
     
 class ASanCrashInfo(CrashInfo):
+    __slots__ = ()
+    
     def __init__(self, stdout, stderr, configuration, crashData=None):
         '''
         Private constructor, called by L{CrashInfo.fromRawCrashData}. Do not use directly.
@@ -302,21 +763,21 @@ class ASanCrashInfo(CrashInfo):
         CrashInfo.__init__(self)
         
         if stdout != None:
-            self.rawStdout.extend(stdout)
+            self.rawStdout = LineBuffer(stdout)
             
         if stderr != None:
-            self.rawStderr.extend(stderr)
+            self.rawStderr = LineBuffer(stderr)
         
         if crashData != None:
-            self.rawCrashData.extend(crashData)
+            self.rawCrashData = LineBuffer(crashData)
         
         self.configuration = configuration
         
         # If crashData is given, use that to find the ASan trace, otherwise use stderr
-        if crashData == None:
-            asanOutput = stderr
-        else:
-            asanOutput = crashData
+        self.useCrashData = crashData != None
+    
+    def _parse(self):
+        asanOutput = self._getTraceLines(ASAN_END_MARKER)
 
         # For better readability, list all the formats here, then join them into the regular expression
         asanMessages = [
@@ -334,18 +795,18 @@ class ASanCrashInfo(CrashInfo):
         
         expectedIndex = 0
         for traceLine in asanOutput:
-            if self.crashAddress == None:
+            if self._crashAddress == None:
                 match = re.search(asanCrashAddressPattern, traceLine)
                 
                 if match != None:
-                    self.crashAddress = long(match.group(1), 16)
+                    self._crashAddress = long(match.group(1), 16)
                 
                     # Crash Address and Registers are in the same line for ASan
                     match = re.search(asanRegisterPattern, traceLine)
                     if match != None:
-                        self.registers["pc"] = long(match.group(1), 16)
-                        self.registers[match.group(2)] = long(match.group(3), 16)
-                        self.registers[match.group(4)] = long(match.group(5), 16)
+                        self._registers["pc"] = long(match.group(1), 16)
+                        self._registers[match.group(2)] = long(match.group(3), 16)
+                        self._registers[match.group(4)] = long(match.group(5), 16)
                     else:
                         raise RuntimeError("Fatal error parsing ASan trace: Failed to isolate registers in line: %s" % traceLine)
 
@@ -376,10 +837,12 @@ class ASanCrashInfo(CrashInfo):
                 print("Warning: Missing component in this line: %s" % traceLine, file=sys.stderr)
                 component = "<missing>"
                 
-            self.backtrace.append(component)
+            self._backtrace.append(component)
             expectedIndex += 1
         
 class GDBCrashInfo(CrashInfo):
+    __slots__ = ()
+    
     def __init__(self, stdout, stderr, configuration, crashData=None):
         '''
         Private constructor, called by L{CrashInfo.fromRawCrashData}. Do not use directly.
@@ -387,119 +850,153 @@ class GDBCrashInfo(CrashInfo):
         CrashInfo.__init__(self)
         
         if stdout != None:
-            self.rawStdout.extend(stdout)
+            self.rawStdout = LineBuffer(stdout)
             
         if stderr != None:
-            self.rawStderr.extend(stderr)
+            self.rawStderr = LineBuffer(stderr)
         
         if crashData != None:
-            self.rawCrashData.extend(crashData)
+            self.rawCrashData = LineBuffer(crashData)
             
         self.configuration = configuration
         
         # If crashData is given, use that to find the GDB trace, otherwise use stderr
-        if crashData == None:
-            gdbOutput = stderr
-        else:
-            gdbOutput = crashData
-        
-        gdbFramePatterns = [
-                            "\\s*#(\\d+)\\s+(0x[0-9a-f]+) in (.+?) \\(.*?\\)( at .+)?",
-                            "\\s*#(\\d+)\\s+()(.+?) \\(.*?\\)( at .+)?"
-                            ]
-        
-        gdbRegisterPattern = RegisterHelper.getRegisterPattern() + "\\s+0x([0-9a-f]+)"
-        gdbCrashAddressPattern = "Crash Address:\\s+0x([0-9a-f]+)"
-        gdbCrashInstructionPattern = "=> 0x[0-9a-f]+(?: <.+>)?:\\s+(.+)"
+        self.useCrashData = crashData != None
+    
+    def _parse(self):
+        gdbOutput = self._getTraceLines()
         
+        # Frames can be wrapped over several lines, this holds the incomplete frame
         lastLineBuf = ""
         
         pastFrames = False
         
         for traceLine in gdbOutput:
+            isFrameStart = not pastFrames and GDB_FRAME_START_PATTERN.match(traceLine) != None
+            
             # Do a very simple check for a frame number in combination with pending
             # buffer content. If we detect this constellation, then it's highly likely
             # that we have a valid trace line but no pattern that fits it. We need
             # to make sure that we report this.
-            if not pastFrames and re.match("\\s*#\\d+.+", lastLineBuf) != None and re.match("\\s*#\\d+.+", traceLine) != None:
+            if lastLineBuf and isFrameStart:
                 print("Fatal error parsing this GDB trace line:", file=sys.stderr)
                 print(lastLineBuf, file=sys.stderr)
                 raise RuntimeError("Fatal error parsing GDB trace")
             
-            if not len(lastLineBuf):
-                match = re.search(gdbRegisterPattern, traceLine)
+            if not lastLineBuf:
+                match = GDBCrashInfo.searchRegister(traceLine)
                 if match != None:
-                    pastFrames = True;
+                    pastFrames = True
                     register = match.group(1)
                     value = long(match.group(2), 16)
-                    self.registers[register] = value
-                else:
-                    match = re.search(gdbCrashAddressPattern, traceLine)
+                    self._registers[register] = value
+                elif "Crash Address:" in traceLine:
+                    match = GDB_CRASH_ADDRESS_PATTERN.search(traceLine)
                     if match != None:
-                        self.crashAddress = long(match.group(1), 16)
-                    else:
-                        match = re.search(gdbCrashInstructionPattern, traceLine)
-                        if match != None:
-                            self.crashInstruction = match.group(1)
+                        self._crashAddress = long(match.group(1), 16)
+                elif "=> 0x" in traceLine:
+                    match = GDB_CRASH_INSTRUCTION_PATTERN.search(traceLine)
+                    if match != None:
+                        self._crashInstruction = match.group(1)
+            
+            if pastFrames:
+                continue
             
-            if not pastFrames:
-                if not len(lastLineBuf) and re.match("\\s*#\\d+.+", traceLine) == None:
+            if not lastLineBuf:
+                if not isFrameStart:
                     # Skip additional lines
                     continue
-                
+            elif traceLine.find(")") < 0:
+                # All frame patterns end in a closing parenthesis, so if the buffer
+                # didn't match before, it can't match without a new one either.
                 lastLineBuf += traceLine
-                
-                functionName = None
-                frameIndex = None
-                
-                for gdbPattern in gdbFramePatterns:
-                    match = re.search(gdbPattern, lastLineBuf)
-                    if match != None:
-                        frameIndex = int(match.group(1))
-                        functionName = match.group(3)
-                        break
-                
-                if frameIndex == None:
-                    # Line might not be complete yet, try adding the next
-                    continue
-                else:
-                    # Successfully parsed line, reset last line buffer
-                    lastLineBuf = ""
-                
-                # Allow #0 to appear twice in the beginning, GDB does this for core dumps ... 
-                if len(self.backtrace) != frameIndex and frameIndex == 0:
-                    self.backtrace.pop(0)
-                elif len(self.backtrace) != frameIndex:
-                    print("Fatal error parsing this GDB trace (Index mismatch, wanted %s got %s ): " % (len(self.backtrace), frameIndex), file=sys.stderr)
-                    print(os.linesep.join(gdbOutput) , file=sys.stderr)
-                    raise RuntimeError("Fatal error parsing GDB trace")
+                continue
+            
+            lastLineBuf += traceLine
+            
+            functionName = None
+            frameIndex = None
+            
+            for gdbPattern in GDB_FRAME_PATTERNS:
+                match = gdbPattern.search(lastLineBuf)
+                if match != None:
+                    frameIndex = int(match.group(1))
+                    functionName = match.group(3)
+                    break
+            
+            if frameIndex == None:
+                # Line might not be complete yet, try adding the next
+                continue
+            else:
+                # Successfully parsed line, reset last line buffer
+                lastLineBuf = ""
+            
+            # Allow #0 to appear twice in the beginning, GDB does this for core dumps ... 
+            if len(self._backtrace) != frameIndex and frameIndex == 0:
+                self._backtrace.pop(0)
+            elif len(self._backtrace) != frameIndex:
+                print("Fatal error parsing this GDB trace (Index mismatch, wanted %s got %s ): " % (len(self._backtrace), frameIndex), file=sys.stderr)
+                print(os.linesep.join(gdbOutput) , file=sys.stderr)
+                raise RuntimeError("Fatal error parsing GDB trace")
 
-                # This is a workaround for GDB throwing an error while resolving function arguments
-                # in the trace and aborting. We try to remove the error message to at least recover
-                # the function name properly.
-                gdbErrorIdx = functionName.find(" (/build/buildd/gdb")
-                if gdbErrorIdx > 0:
-                    functionName = functionName[:gdbErrorIdx]
-                
-                self.backtrace.append(functionName)
+            # This is a workaround for GDB throwing an error while resolving function arguments
+            # in the trace and aborting. We try to remove the error message to at least recover
+            # the function name properly.
+            gdbErrorIdx = functionName.find(" (/build/buildd/gdb")
+            if gdbErrorIdx > 0:
+                functionName = functionName[:gdbErrorIdx]
+            
+            self._backtrace.append(functionName)
         
         # If we have no crash address but the instruction, try to calculate the crash address
-        if self.crashAddress == None and self.crashInstruction != None:
-            crashAddress = GDBCrashInfo.calculateCrashAddress(self.crashInstruction, self.registers)
+        if self._crashAddress == None and self._crashInstruction != None:
+            crashAddress = GDBCrashInfo.calculateCrashAddress(self._crashInstruction, self._registers)
             
             if isinstance(crashAddress, basestring):
-                self.failureReason = crashAddress
+                self._failureReason = crashAddress
                 return
             
-            self.crashAddress = crashAddress
+            self._crashAddress = crashAddress
             
-            if (self.crashAddress != None and self.crashAddress < 0):
-                if RegisterHelper.getBitWidth(self.registers) == 32:
-                    self.crashAddress = uint32(self.crashAddress)
+            if (self._crashAddress != None and self._crashAddress < 0):
+                if RegisterHelper.getBitWidth(self._registers) == 32:
+                    self._crashAddress = uint32(self._crashAddress)
                 else:
                     # Assume 64 bit width
-                    self.crashAddress = uint64(self.crashAddress)
+                    self._crashAddress = uint64(self._crashAddress)
+        
+    @staticmethod
+    def searchRegister(traceLine):
+        '''
+        Search the given line for a register value. This is equivalent to
+        searching GDB_REGISTER_PATTERN, but a lot faster on lines without
+        registers.
+        
+        @type traceLine: string
+        @param traceLine: The line to search
         
+        @rtype: MatchObject
+        @return: The leftmost match of GDB_REGISTER_PATTERN or None
+        '''
+        if not "0x" in traceLine:
+            return None
+        
+        start = None
+        
+        # Register names never contain whitespace, so a register name must end
+        # where the whitespace in front of the value starts.
+        for match in GDB_REGISTER_VALUE_PATTERN.finditer(traceLine):
+            end = match.start()
+            for length in GDB_REGISTER_NAME_LENGTHS:
+                if length <= end and traceLine[end - length:end] in GDB_REGISTER_NAMES:
+                    if start == None or end - length < start:
+                        start = end - length
+        
+        if start == None:
+            return None
+        
+        return GDB_REGISTER_PATTERN.match(traceLine, start)
+    
     @staticmethod
     def calculateCrashAddress(crashInstruction, registerMap):
         '''
@@ -14,11 +14,18 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 @contact:    choller@mozilla.com
 '''
 
+import hashlib
 import json
+import numpy
+from timeit import default_timer
 from FTB.Signatures import JSONHelper
 from FTB.Signatures.Symptom import Symptom, TestcaseSymptom, StackFramesSymptom
 import FTB.Signatures
 
+# Number of matches after which signatures with adaptive ordering
+# update their symptom order based on the observed rejection rates.
+ADAPTIVE_ORDERING_INTERVAL = 100
+
 class CrashSignature():
     def __init__(self, rawSignature):
         '''
@@ -56,40 +63,243 @@ class CrashSignature():
         self.platforms = JSONHelper.getArrayChecked(obj, "platforms")
         self.operatingSystems = JSONHelper.getArrayChecked(obj, "operatingSystems")
         self.products = JSONHelper.getArrayChecked(obj, "products")
+        
+        # Indices into self.symptoms in the order we match them. Cheap
+        # symptoms come first, so we can reject crashes as early as possible.
+        # The order of self.symptoms itself is preserved for serialization.
+        self.matchOrder = sorted(range(len(self.symptoms)), key=lambda idx: self.symptoms[idx].MATCH_COST)
+        
+        # Statistics for adaptive ordering, None unless enabled
+        self.symptomEvaluations = None
+        self.symptomRejections = None
+        self.adaptiveMatchCount = 0
+        
+        # Profiler and the key to record our statistics under, None unless enabled
+        self.profiler = None
+        self.profilerKey = None
     
     @staticmethod
     def fromFile(signatureFile):
         with open(signatureFile, 'r') as sigFd:
             return CrashSignature(sigFd.read())
     
+    @staticmethod
+    def getCanonicalJSON(rawSignature):
+        '''
+        Get a canonical representation of the given signature, that does not
+        depend on whitespace, line endings or the order of keys.
+        
+        @type rawSignature: string
+        @param rawSignature: A JSON-formatted string representing the crash signature
+        
+        @rtype: string
+        @return: Canonical JSON representation of the signature
+        '''
+        try:
+            obj = json.loads(rawSignature)
+        except ValueError, e:
+            raise RuntimeError("Invalid JSON: %s" % e)
+        
+        return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    
+    @staticmethod
+    def getSignatureHash(rawSignature):
+        '''
+        Get a hash of the canonical representation of the given signature.
+        Signatures that only differ in formatting have the same hash.
+        
+        @type rawSignature: string
+        @param rawSignature: A JSON-formatted string representing the crash signature
+        
+        @rtype: string
+        @return: SHA1 hex digest of the canonical signature
+        '''
+        return hashlib.sha1(CrashSignature.getCanonicalJSON(rawSignature)).hexdigest()
+    
     def __str__(self):
         return self.rawSignature
     
-    def matches(self, crashInfo):
+    def matches(self, crashInfo, symptomResults=None):
         '''
         Match this signature against the given crash information
         
         @type crashInfo: CrashInfo
         @param crashInfo: The crash info to match the signature against
+        @type symptomResults: dict
+        @param symptomResults: Optional precomputed symptom results (see L{OutputMatcher.match})
         
         @rtype: bool
         @return: True if the signature matches, False otherwise
         '''
-        if self.platforms != None and not crashInfo.platform in self.platforms:
+        if not self._matchesConfiguration(crashInfo):
             return False
         
-        if self.operatingSystems != None and not crashInfo.os in self.operatingSystems:
+        if self.profiler != None:
+            return self._matchesProfiled(crashInfo, symptomResults)
+        
+        adaptive = self.symptomEvaluations != None
+        
+        if adaptive:
+            self.adaptiveMatchCount += 1
+            if self.adaptiveMatchCount % ADAPTIVE_ORDERING_INTERVAL == 0:
+                self.updateMatchOrder()
+        
+        for idx in self.matchOrder:
+            symptom = self.symptoms[idx]
+            
+            if symptomResults != None and symptom in symptomResults:
+                result = symptomResults[symptom]
+            else:
+                result = symptom.matches(crashInfo)
+            
+            if adaptive:
+                self.symptomEvaluations[idx] += 1
+                if not result:
+                    self.symptomRejections[idx] += 1
+            
+            if not result:
+                return False
+        
+        return True
+    
+    def _matchesProfiled(self, crashInfo, symptomResults):
+        '''
+        Implementation of L{matches} that records the time spent on each
+        symptom with our profiler. The configuration is already checked.
+        '''
+        profiler = self.profiler
+        startTime = default_timer()
+        result = True
+        
+        for idx in self.matchOrder:
+            symptom = self.symptoms[idx]
+            symptomStartTime = default_timer()
+            
+            if symptomResults != None and symptom in symptomResults:
+                result = symptomResults[symptom]
+            else:
+                result = symptom.matches(crashInfo)
+            
+            profiler.recordSymptom(self.profilerKey, symptom, default_timer() - symptomStartTime, 1, int(not result))
+            
+            if not result:
+                break
+        
+        profiler.recordSignature(self.profilerKey, default_timer() - startTime, 1, int(result))
+        return result
+    
+    def matchesMany(self, crashInfos):
+        '''
+        Match this signature against many crashes at once. Each symptom is only
+        checked for the crashes that haven't been rejected yet, and symptoms share
+        work between the crashes (e.g. numeric comparisons are vectorized and
+        string matches are cached for values occurring in multiple crashes).
+        
+        The result for each crash is the same as the result of L{matches}.
+        Adaptive ordering statistics are not updated by this method.
+        
+        @type crashInfos: list
+        @param crashInfos: List of CrashInfo objects to match the signature against
+        
+        @rtype: numpy.ndarray
+        @return: Boolean array, True for each crash that matches the signature
+        '''
+        crashInfos = list(crashInfos)
+        
+        if self.platforms == None and self.operatingSystems == None and self.products == None:
+            results = numpy.ones(len(crashInfos), dtype=bool)
+        else:
+            results = numpy.array([ self._matchesConfiguration(crashInfo) for crashInfo in crashInfos ], dtype=bool)
+        
+        profiler = self.profiler
+        if profiler != None:
+            startTime = default_timer()
+        
+        for idx in self.matchOrder:
+            remaining = numpy.flatnonzero(results)
+            if not len(remaining):
+                break
+            
+            if profiler != None:
+                symptomStartTime = default_timer()
+            
+            results[remaining] = self.symptoms[idx].matchesMany([ crashInfos[crashIdx] for crashIdx in remaining ])
+            
+            if profiler != None:
+                rejections = len(remaining) - numpy.count_nonzero(results[remaining])
+                profiler.recordSymptom(self.profilerKey, self.symptoms[idx], default_timer() - symptomStartTime,
+                                       len(remaining), rejections)
+        
+        if profiler != None:
+            profiler.recordSignature(self.profilerKey, default_timer() - startTime, len(crashInfos),
+                                     numpy.count_nonzero(results))
+        
+        return results
+    
+    def _matchesConfiguration(self, crashInfo):
+        configuration = crashInfo.configuration
+        
+        if self.platforms != None and not configuration.platform in self.platforms:
             return False
         
-        if self.products != None and not crashInfo.product in self.products:
+        if self.operatingSystems != None and not configuration.os in self.operatingSystems:
             return False
         
-        for symptom in self.symptoms:
-            if not symptom.matches(crashInfo):
-                return False
+        if self.products != None and not configuration.product in self.products:
+            return False
         
         return True
     
+    def enableAdaptiveOrdering(self):
+        '''
+        Enable adaptive ordering of symptoms for this signature. In addition to
+        the estimated cost of each symptom, the order then takes into account how
+        often each symptom rejected a crash so far. This only affects performance,
+        not the result of L{matches}.
+        '''
+        if self.symptomEvaluations == None:
+            self.symptomRejections = [0] * len(self.symptoms)
+            self.symptomEvaluations = [0] * len(self.symptoms)
+    
+    def enableProfiling(self, profiler, key=None):
+        '''
+        Record the time spent matching this signature and each of its symptoms
+        with the given profiler. This slows down matching a bit, so it should
+        only be used on signature objects that aren't shared.
+        
+        @type profiler: SignatureProfiler
+        @param profiler: The profiler to record the statistics with
+        @type key: string
+        @param key: Key to record the statistics under, defaults to the signature hash
+        '''
+        if key == None:
+            key = CrashSignature.getSignatureHash(self.rawSignature)
+        
+        self.profiler = profiler
+        self.profilerKey = key
+    
+    def disableProfiling(self):
+        self.profiler = None
+        self.profilerKey = None
+    
+    def updateMatchOrder(self):
+        '''
+        Reorder the symptoms based on the statistics collected with adaptive
+        ordering. Symptoms are sorted by their estimated cost per rejection,
+        which minimizes the expected cost of matching if symptoms are independent.
+        '''
+        if self.symptomEvaluations == None:
+            return
+        
+        def getCostPerRejection(idx):
+            # Smooth the rejection rate, so symptoms we haven't seen
+            # often enough (or not at all) don't get extreme values.
+            rejectionRate = (self.symptomRejections[idx] + 1.0) / (self.symptomEvaluations[idx] + 2.0)
+            return self.symptoms[idx].MATCH_COST / rejectionRate
+        
+        # Assign a new list, so concurrent matches keep a consistent order
+        self.matchOrder = sorted(range(len(self.symptoms)), key=getCostPerRejection)
+    
     def matchRequiresTest(self):
         '''
         Check if the signature requires a testcase to match.
@@ -0,0 +1,280 @@
+'''
+Line Buffer
+
+Stores the lines of a crash output (stdout, stderr or crash data) as a single
+string with line offsets, instead of one string object per line.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+from array import array
+import bisect
+import mmap
+import os
+
+# Files smaller than this are read into memory by L{MappedLineBuffer.fromFile}
+# instead of being mapped, because every map keeps a file descriptor open.
+MIN_MAP_SIZE = 1024 * 1024
+
+class LineBuffer(object):
+    '''
+    A read-only list of lines backed by one buffer. Lines are joined with
+    newlines, the offsets are kept separately so lines that contain newlines
+    themselves are preserved.
+    '''
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, lines=None):
+        '''
+        @type lines: list
+        @param lines: List of lines to store
+        '''
+        if not lines:
+            lines = []
+
+        self.data = "\n".join(lines)
+
+        # Start offset of every line, plus one entry past the end of the
+        # buffer so the end of line N is always offsets[N + 1] - 1.
+        self.offsets = array('L', [ 0 ])
+        offset = 0
+        for line in lines:
+            offset += len(line) + 1
+            self.offsets.append(offset)
+
+    def getText(self):
+        '''
+        @rtype: string
+        @return: All lines, joined with newlines
+        '''
+        return self.data
+
+    def find(self, value, start=0):
+        '''
+        Find the given value in the buffer without copying it.
+
+        @type value: string
+        @param value: Value to search for
+        @type start: int
+        @param start: Offset to start searching at
+
+        @rtype: int
+        @return: Offset of the first occurrence or -1
+        '''
+        return self.data.find(value, start)
+
+    def searchLinesReversed(self, literals):
+        '''
+        Iterate backwards over all lines containing any of the given literals.
+        The literals are searched on the whole buffer, so this is a lot faster
+        than checking every line if only few lines match.
+
+        @type literals: list
+        @param literals: Strings to search for, must not contain newlines
+
+        @rtype: generator
+        @return: Generator of matching lines, last line first
+        '''
+        for (offset, lineStart) in self._searchLinesReversed(literals):
+            yield self[bisect.bisect_right(self.offsets, offset) - 1]
+
+    def _searchLinesReversed(self, literals):
+        '''
+        Find the lines for L{searchLinesReversed}.
+
+        @rtype: generator
+        @return: Generator of tuples (match offset, line start offset)
+        '''
+        data = self.data
+        end = len(data)
+
+        # Last known position of each literal before end
+        positions = [ data.rfind(literal, 0, end) for literal in literals ]
+
+        while True:
+            offset = max(positions)
+            if offset < 0:
+                return
+
+            lineStart = self.getLineStart(offset)
+            yield (offset, lineStart)
+
+            # Continue in front of this line
+            end = lineStart
+            for (idx, literal) in enumerate(literals):
+                if positions[idx] >= end:
+                    positions[idx] = data.rfind(literal, 0, end)
+
+    def getLineStart(self, offset):
+        '''
+        @type offset: int
+        @param offset: Offset into the buffer
+
+        @rtype: int
+        @return: Offset of the beginning of the line containing the given offset
+        '''
+        return self.offsets[bisect.bisect_right(self.offsets, offset) - 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [ self[x] for x in xrange(*idx.indices(len(self))) ]
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("line index out of range")
+
+        return self.data[self.offsets[idx]:self.offsets[idx + 1] - 1]
+
+    def __iter__(self):
+        data = self.data
+        offsets = self.offsets
+        for idx in xrange(len(offsets) - 1):
+            yield data[offsets[idx]:offsets[idx + 1] - 1]
+
+    def __eq__(self, other):
+        if type(self) == LineBuffer and type(other) == LineBuffer:
+            return self.data == other.data and self.offsets == other.offsets
+        if not isinstance(other, (LineBuffer, list)):
+            # Avoid splitting all lines for comparisons like "lines == None"
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class MappedLineBuffer(LineBuffer):
+    '''
+    A read-only list of lines backed by a memory map (or any other buffer that
+    supports find and slicing). Lines are only split when they are accessed,
+    iterating doesn't keep any lines in memory. The line offsets are computed
+    on the first random access. Like splitlines, a trailing newline doesn't
+    add an empty line and carriage returns before newlines are removed.
+    '''
+    __slots__ = ()
+
+    def __init__(self, data):
+        '''
+        @type data: mmap
+        @param data: The buffer to provide lines for
+        '''
+        self.data = data
+        self.offsets = None
+
+    @staticmethod
+    def fromFile(fileName):
+        '''
+        Provide the lines of the given file. Large files are memory mapped, so
+        only the parts that are accessed are read, smaller files are read
+        into memory as a whole.
+
+        @type fileName: string
+        @param fileName: The file to provide lines for
+
+        @rtype: MappedLineBuffer
+        @return: Lines contained in the file
+        '''
+        with open(fileName, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < MIN_MAP_SIZE:
+                return MappedLineBuffer(f.read())
+            return MappedLineBuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def getText(self):
+        # This has to copy the whole buffer
+        text = self.data[:]
+        if text.endswith("\n"):
+            text = text[:-1]
+        return text.replace("\r\n", "\n")
+
+    def getLineStart(self, offset):
+        '''
+        @type offset: int
+        @param offset: Offset into the buffer
+
+        @rtype: int
+        @return: Offset of the beginning of the line containing the given offset
+        '''
+        return self.data.rfind("\n", 0, offset) + 1
+
+    def iterFrom(self, offset):
+        '''
+        Iterate over the lines starting with the line that begins at the given offset.
+
+        @type offset: int
+        @param offset: Offset of the beginning of a line
+        '''
+        data = self.data
+        end = len(data)
+        while offset < end:
+            idx = data.find("\n", offset)
+            if idx < 0:
+                idx = end
+            line = data[offset:idx]
+            if line.endswith("\r"):
+                line = line[:-1]
+            yield line
+            offset = idx + 1
+
+    def searchLinesReversed(self, literals):
+        data = self.data
+        for (offset, lineStart) in self._searchLinesReversed(literals):
+            lineEnd = data.find("\n", offset)
+            if lineEnd < 0:
+                lineEnd = len(data)
+            line = data[lineStart:lineEnd]
+            if line.endswith("\r"):
+                line = line[:-1]
+            yield line
+
+    def _getOffsets(self):
+        if self.offsets == None:
+            offsets = array('L', [ 0 ])
+            data = self.data
+            end = len(data)
+            offset = 0
+            while offset < end:
+                idx = data.find("\n", offset)
+                if idx < 0:
+                    idx = end
+                offset = idx + 1
+                offsets.append(offset)
+            self.offsets = offsets
+        return self.offsets
+
+    def __len__(self):
+        return len(self._getOffsets()) - 1
+
+    def __getitem__(self, idx):
+        offsets = self._getOffsets()
+
+        if isinstance(idx, slice):
+            return [ self[x] for x in xrange(*idx.indices(len(self))) ]
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("line index out of range")
+
+        line = self.data[offsets[idx]:offsets[idx + 1] - 1]
+        if line.endswith("\r"):
+            line = line[:-1]
+        return line
+
+    def __iter__(self):
+        return self.iterFrom(0)
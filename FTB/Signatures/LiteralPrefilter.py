@@ -0,0 +1,316 @@
+'''
+Literal Prefilter
+
+Maps literals that are required by signatures to the signatures requiring them.
+Given a crash, this allows to determine a (usually short) list of candidate
+signatures that can possibly match, so the full CrashSignature.matches() check
+only needs to run on these candidates.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+import re
+
+from FTB.Signatures.LineBuffer import LineBuffer
+
+TOKEN_PATTERN = re.compile("\\w+")
+
+# Size of the chunks that sources are scanned for tokens in
+TOKEN_CHUNK_SIZE = 1024 * 1024
+
+# Up to this many tokens are searched for one by one, instead of scanning all
+# tokens of a source. Searching a single string is a lot faster than scanning.
+MAX_SEARCHED_TOKENS = 8
+
+# Cost of checking a literal against each source. We prefer to key signatures
+# on literals in small sources (frames, instruction) over the full output.
+SOURCE_COST = {
+               "instruction" : 0,
+               "frames" : 1,
+               "stdout" : 2,
+               "stderr" : 2,
+               "output" : 3,
+               "testcase" : 4,
+               }
+
+def getCompleteTokens(literal):
+    '''
+    Get all word tokens of the literal that are guaranteed to appear as complete
+    tokens in any string that contains the literal. A token qualifies only if it
+    is surrounded by non-word characters inside the literal itself, otherwise the
+    containing string could extend it.
+
+    @type literal: string
+    @param literal: The literal to tokenize
+
+    @rtype: list
+    @return: List of complete tokens
+    '''
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(literal):
+        if match.start() > 0 and match.end() < len(literal):
+            tokens.append(match.group(0))
+    return tokens
+
+class ChainedLines():
+    '''
+    Iterable over the lines of several sources, one after another, without
+    copying them into one list.
+    '''
+    def __init__(self, *sources):
+        self.sources = sources
+
+    def __iter__(self):
+        for lines in self.sources:
+            for line in lines:
+                yield line
+
+def iterTokenChunks(data, chunkSize=TOKEN_CHUNK_SIZE):
+    '''
+    Split the given buffer into chunks of bounded size, without splitting any
+    word token across two chunks (unless the token is larger than a chunk).
+
+    @type data: string
+    @param data: The buffer to split, either a string or a memory map
+
+    @rtype: generator
+    @return: Generator of string chunks
+    '''
+    offset = 0
+    end = len(data)
+    while offset < end:
+        chunk = data[offset:offset + chunkSize]
+
+        if offset + len(chunk) < end:
+            cut = len(chunk)
+            while cut > 0 and isWordCharacter(chunk[cut - 1]):
+                cut -= 1
+            if cut > 0:
+                chunk = chunk[:cut]
+
+        yield chunk
+        offset += len(chunk)
+
+def isWordCharacter(char):
+    return char.isalnum() or char == "_"
+
+def containsToken(data, token):
+    '''
+    @type data: string
+    @param data: The buffer to search, either a string or a memory map
+    @type token: string
+    @param token: Word token to search for
+
+    @rtype: bool
+    @return: True if the buffer contains the token as a complete token
+    '''
+    offset = data.find(token)
+    while offset >= 0:
+        end = offset + len(token)
+        if (offset == 0 or not isWordCharacter(data[offset - 1])) and (end == len(data) or not isWordCharacter(data[end])):
+            return True
+        offset = data.find(token, offset + 1)
+    return False
+
+class CrashLiteralView():
+    '''
+    Lazily computed line and buffer views on the sources of a crash. Mapped
+    output (see L{MappedLineBuffer}) is searched in place, it is never copied
+    as a whole.
+    '''
+    def __init__(self, crashInfo):
+        self.crashInfo = crashInfo
+        self.lines = {}
+        self.buffers = {}
+
+    def getLines(self, source):
+        '''
+        @rtype: iterable
+        @return: The lines of the given source
+        '''
+        if not source in self.lines:
+            if source == "frames":
+                lines = self.crashInfo.backtrace
+            elif source == "stdout":
+                lines = self.crashInfo.rawStdout
+            elif source == "stderr":
+                lines = self.crashInfo.rawStderr
+            elif source == "output":
+                lines = ChainedLines(self.crashInfo.rawStdout, self.crashInfo.rawStderr)
+            elif source == "instruction":
+                lines = []
+                if self.crashInfo.crashInstruction:
+                    lines.append(self.crashInfo.crashInstruction)
+            elif source == "testcase":
+                lines = self.crashInfo.getTestcaseLines()
+                if lines == None:
+                    lines = []
+            else:
+                raise RuntimeError("Unknown literal source: %s" % source)
+            self.lines[source] = lines
+        return self.lines[source]
+
+    def getBuffers(self, source):
+        '''
+        @rtype: list
+        @return: Buffers (strings or memory maps) containing the lines of the given
+                 source, separated by line breaks. Literals that don't contain line
+                 breaks are found in the buffers exactly if they are on any line.
+        '''
+        if not source in self.buffers:
+            if source == "output":
+                buffers = self.getBuffers("stdout") + self.getBuffers("stderr")
+            else:
+                lines = self.getLines(source)
+                if isinstance(lines, LineBuffer):
+                    # Already stored as one buffer
+                    buffers = [ lines.data ]
+                else:
+                    buffers = [ "\n".join(lines) ]
+            self.buffers[source] = buffers
+        return self.buffers[source]
+
+    def contains(self, source, literal):
+        '''
+        @type literal: string
+        @param literal: Literal without line breaks
+
+        @rtype: bool
+        @return: True if any line of the given source contains the literal
+        '''
+        for data in self.getBuffers(source):
+            if data.find(literal) >= 0:
+                return True
+        return False
+
+    def findTokens(self, source, tokens):
+        '''
+        Determine which of the given tokens appear as complete tokens in the given
+        source. Few tokens are searched for one by one, otherwise the source is
+        scanned in chunks of bounded size and only the tokens found are kept.
+
+        @type tokens: set
+        @param tokens: Tokens to look for
+
+        @rtype: set
+        @return: The tokens that were found
+        '''
+        found = set()
+        for data in self.getBuffers(source):
+            if len(tokens) <= MAX_SEARCHED_TOKENS:
+                found.update([ token for token in tokens if not token in found and containsToken(data, token) ])
+                continue
+
+            for chunk in iterTokenChunks(data):
+                for token in TOKEN_PATTERN.findall(chunk):
+                    if token in tokens:
+                        found.add(token)
+        return found
+
+class LiteralPrefilter():
+    def __init__(self, signatures):
+        '''
+        Build the prefilter for the given signatures.
+
+        @type signatures: list
+        @param signatures: List of CrashSignature objects
+        '''
+        self.signatureCount = len(signatures)
+
+        # Maps source -> token -> list of signature indices
+        self.tokenIndex = {}
+
+        # Maps source -> literal -> list of signature indices
+        self.substringIndex = {}
+
+        # Signatures without any usable literal, these are always candidates
+        self.unkeyed = []
+
+        for (idx, signature) in enumerate(signatures):
+            key = LiteralPrefilter.selectKey(signature)
+
+            if key == None:
+                self.unkeyed.append(idx)
+                continue
+
+            (isToken, source, literal) = key
+
+            if isToken:
+                sourceIndex = self.tokenIndex.setdefault(source, {})
+            else:
+                sourceIndex = self.substringIndex.setdefault(source, {})
+
+            sourceIndex.setdefault(literal, []).append(idx)
+
+    @staticmethod
+    def selectKey(signature):
+        '''
+        Select the most selective required literal of the given signature.
+        Any single required literal is sufficient, as all of them must be
+        present for the signature to match.
+
+        @type signature: CrashSignature
+        @param signature: The signature to select a key for
+
+        @rtype: tuple
+        @return: Tuple (isToken, source, literal) or None if the signature has no usable literal
+        '''
+        bestKey = None
+        bestScore = None
+
+        for symptom in signature.symptoms:
+            for (source, literal) in symptom.getRequiredLiterals():
+                # Lines never contain line breaks, so a literal containing
+                # one can't be looked up in the joined sources.
+                if "\n" in literal or "\r" in literal:
+                    continue
+
+                tokens = getCompleteTokens(literal)
+                if tokens:
+                    token = max(tokens, key=len)
+                    candidate = (True, source, token)
+                    score = (1, -SOURCE_COST[source], len(token))
+                else:
+                    candidate = (False, source, literal)
+                    score = (0, -SOURCE_COST[source], len(literal))
+
+                if bestScore == None or score > bestScore:
+                    bestKey = candidate
+                    bestScore = score
+
+        return bestKey
+
+    def getCandidates(self, crashInfo):
+        '''
+        Determine all signatures that can possibly match the given crash.
+
+        @type crashInfo: CrashInfo
+        @param crashInfo: The crash information to check
+
+        @rtype: list
+        @return: Sorted list of indices of the candidate signatures
+        '''
+        view = CrashLiteralView(crashInfo)
+        candidates = list(self.unkeyed)
+
+        for source in self.tokenIndex:
+            sourceIndex = self.tokenIndex[source]
+            for token in view.findTokens(source, sourceIndex):
+                candidates.extend(sourceIndex[token])
+
+        for source in self.substringIndex:
+            sourceIndex = self.substringIndex[source]
+            for literal in sourceIndex:
+                if view.contains(source, literal):
+                    candidates.extend(sourceIndex[literal])
+
+        candidates.sort()
+        return candidates
@@ -17,9 +17,13 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # Ensure print() compatibility with Python 3
 from __future__ import print_function
 
+import numpy
 import re
 from FTB.Signatures import JSONHelper
 
+# Maximum number of distinct values a StringMatchCache remembers
+STRING_MATCH_CACHE_SIZE = 100000
+
 class StringMatch():
     def __init__(self, obj):
         self.isPCRE = False
@@ -52,6 +56,89 @@ class StringMatch():
         else:
             return self.value in val
     
+    def getRequiredLiterals(self):
+        '''
+        Determine strings that must be contained in every value matched by this
+        StringMatch. For PCREs, this is a conservative approximation: Patterns
+        that are too complex to analyze yield no literals at all.
+        
+        @rtype: list
+        @return: List of (non-empty) strings required for a match
+        '''
+        if not self.isPCRE:
+            if self.value:
+                return [ self.value ]
+            return []
+        
+        return StringMatch._getPCRELiterals(self.value)
+    
+    @staticmethod
+    def _getPCRELiterals(pattern):
+        # Alternations and extensions (flags, lookarounds, etc.) change which
+        # parts of a pattern are required, so we don't even try to analyze them.
+        if "|" in pattern or "(?" in pattern:
+            return []
+        
+        literals = []
+        current = []
+        
+        def flush():
+            if current:
+                literals.append("".join(current))
+                del current[:]
+        
+        depth = 0
+        idx = 0
+        while idx < len(pattern):
+            c = pattern[idx]
+            
+            if c == "\\":
+                if idx + 1 < len(pattern) and not pattern[idx + 1].isalnum():
+                    # Escaped special character, which is a literal
+                    if depth == 0:
+                        current.append(pattern[idx + 1])
+                else:
+                    # Character class (\d, \s, ...), backreference or numeric escape
+                    flush()
+                idx += 2
+                continue
+            elif c == "[":
+                flush()
+                # Skip the whole character class, a leading ] is part of the class
+                idx += 1
+                if idx < len(pattern) and pattern[idx] == "^":
+                    idx += 1
+                if idx < len(pattern) and pattern[idx] == "]":
+                    idx += 1
+                while idx < len(pattern) and pattern[idx] != "]":
+                    if pattern[idx] == "\\":
+                        idx += 1
+                    idx += 1
+            elif c == "(":
+                flush()
+                depth += 1
+            elif c == ")":
+                flush()
+                depth -= 1
+            elif c in "*?{":
+                # The preceding character is optional
+                if current:
+                    current.pop()
+                flush()
+                if c == "{":
+                    while idx < len(pattern) and pattern[idx] != "}":
+                        idx += 1
+            elif c in ".^$+":
+                flush()
+            elif depth == 0:
+                current.append(c)
+            
+            idx += 1
+        
+        flush()
+        
+        return literals
+    
     def __str__(self):
         return self.value
     
@@ -61,6 +148,59 @@ class StringMatch():
         
         return self.value
 
+class StringMatchCache():
+    '''
+    Remembers the results of a StringMatch for distinct values. This is useful
+    when matching many crashes at once, as the same frames and output lines
+    appear in many of them. Only PCRE results are cached, plain substring
+    checks are cheaper than the cache lookup. Function names from a Backtrace
+    can be matched by symbol id instead, see L{matchesSymbol}.
+    '''
+    def __init__(self, stringMatch):
+        self.stringMatch = stringMatch
+        self.results = {}
+        self.symbolTable = None
+        self.symbolResults = {}
+    
+    def matches(self, val):
+        if not self.stringMatch.isPCRE:
+            return self.stringMatch.matches(val)
+        
+        result = self.results.get(val)
+        if result == None:
+            if len(self.results) >= STRING_MATCH_CACHE_SIZE:
+                self.results.clear()
+            result = self.stringMatch.matches(val)
+            self.results[val] = result
+        return result
+    
+    def matchesSymbol(self, symbolTable, symbolId):
+        '''
+        Match the function name with the given symbol id. The result is
+        remembered by symbol id, so this is cheaper than L{matches} for both
+        PCREs and plain strings.
+        
+        @type symbolTable: SymbolTable
+        @param symbolTable: Symbol table of the backtrace the symbol id is from
+        @type symbolId: int
+        @param symbolId: Symbol id of the function name
+        
+        @rtype: bool
+        @return: True if the function name matches
+        '''
+        # Symbol ids of different tables are unrelated, so results are kept per table
+        if symbolTable is not self.symbolTable:
+            self.symbolTable = symbolTable
+            self.symbolResults = {}
+        
+        result = self.symbolResults.get(symbolId)
+        if result == None:
+            if len(self.symbolResults) >= STRING_MATCH_CACHE_SIZE:
+                self.symbolResults.clear()
+            result = self.stringMatch.matches(symbolTable.getName(symbolId))
+            self.symbolResults[symbolId] = result
+        return result
+
 class NumberMatchType:
     GE, GT, LE, LT = range(4)
 
@@ -112,3 +252,27 @@ class NumberMatch():
             return value < self.value
         else:
             return value == self.value
+    
+    def matchesMany(self, values):
+        '''
+        Match many values at once
+        
+        @type values: numpy.ndarray
+        @param values: Array of values to match, must not contain None. Use an
+                       object array for values that might exceed 64 bits.
+        
+        @rtype: numpy.ndarray
+        @return: Boolean array with the result for each value
+        '''
+        if self.matchType == NumberMatchType.GE:
+            result = values >= self.value
+        elif self.matchType == NumberMatchType.GT:
+            result = values > self.value
+        elif self.matchType == NumberMatchType.LE:
+            result = values <= self.value
+        elif self.matchType == NumberMatchType.LT:
+            result = values < self.value
+        else:
+            result = values == self.value
+        
+        return numpy.asarray(result, dtype=bool)
@@ -0,0 +1,175 @@
+'''
+Output Matcher
+
+Matches the output and testcase symptoms of a whole set of signatures against
+a crash at once. Identical string matches (same source and value) are only
+evaluated once and all regular expressions of a source are combined into one
+alternation, so each line has to be scanned once instead of once per symptom.
+The results can be passed to CrashSignature.matches to avoid matching the
+symptoms again.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+import re
+
+from FTB.Signatures.LiteralPrefilter import CrashLiteralView, getCompleteTokens
+from FTB.Signatures.Symptom import OutputSymptom, TestcaseSymptom
+
+# Inline extensions other than non-capturing groups and lookarounds (e.g. flags
+# or named groups) affect the whole pattern, so they can't be combined.
+UNCOMBINABLE_EXTENSION = re.compile("\\(\\?(?![:=!]|<[=!])")
+
+def getSymptomSource(symptom):
+    '''
+    Determine the literal source (see L{CrashLiteralView}) that is checked by
+    the given output or testcase symptom.
+
+    @type symptom: Symptom
+    @param symptom: Output or testcase symptom
+
+    @rtype: string
+    @return: Name of the source
+    '''
+    if isinstance(symptom, TestcaseSymptom):
+        return "testcase"
+    elif symptom.src == None:
+        return "output"
+    return symptom.src
+
+class OutputMatcher():
+    def __init__(self, signatures):
+        '''
+        Compile the output and testcase symptoms of the given signatures.
+
+        @type signatures: list
+        @param signatures: List of CrashSignature objects
+        '''
+        # Maps (source, isPCRE, value) -> list of symptoms using that match
+        self.symptomsByKey = {}
+
+        # Keys required by each signature, by signature index
+        self.signatureKeys = []
+
+        # Maps literal key -> complete token that must be present for a match
+        self.literalTokens = {}
+
+        # Maps source -> (combined pattern, set of keys contained in it)
+        self.combinedPatterns = {}
+
+        combinableKeys = {}
+
+        for signature in signatures:
+            keys = set()
+
+            for symptom in signature.symptoms:
+                if not isinstance(symptom, OutputSymptom) and not isinstance(symptom, TestcaseSymptom):
+                    continue
+
+                match = symptom.output
+                source = getSymptomSource(symptom)
+
+                if not match.isPCRE:
+                    # Values spanning multiple lines or empty values can't be
+                    # checked against the joined text, leave them to the symptom.
+                    if not match.value or match.value.splitlines() != [ match.value ]:
+                        continue
+                    key = (source, False, match.value)
+                    tokens = getCompleteTokens(match.value)
+                    if tokens:
+                        self.literalTokens[key] = max(tokens, key=len)
+                    else:
+                        self.literalTokens[key] = None
+                else:
+                    key = (source, True, match.value)
+                    if match.compiledValue.groups == 0 and not UNCOMBINABLE_EXTENSION.search(match.value):
+                        combinableKeys.setdefault(source, set()).add(key)
+
+                self.symptomsByKey.setdefault(key, []).append(symptom)
+                keys.add(key)
+
+            self.signatureKeys.append(keys)
+
+        for source in combinableKeys:
+            keys = combinableKeys[source]
+
+            # A single pattern doesn't gain anything from combining
+            if len(keys) < 2:
+                continue
+
+            combinedValue = "|".join([ "(?:%s)" % value for (_, _, value) in sorted(keys) ])
+            self.combinedPatterns[source] = (re.compile(combinedValue), keys)
+
+    def match(self, crashInfo, signatureIndices=None):
+        '''
+        Match the compiled symptoms against the given crash information.
+
+        @type crashInfo: CrashInfo
+        @param crashInfo: The crash information to check against
+        @type signatureIndices: list
+        @param signatureIndices: Optional list of signature indices to restrict matching to
+
+        @rtype: dict
+        @return: Maps each matched symptom to True or False. Symptoms that are not handled
+                 by this matcher are not contained and must be matched directly.
+        '''
+        if signatureIndices == None:
+            keys = self.symptomsByKey.keys()
+        else:
+            keys = set()
+            for idx in signatureIndices:
+                keys.update(self.signatureKeys[idx])
+
+        view = CrashLiteralView(crashInfo)
+
+        # Lines that match any of the combined patterns, by source
+        candidateLines = {}
+
+        # Look up the tokens of all literals of a source in one pass over it
+        requiredTokens = {}
+        for key in keys:
+            (source, isPCRE, _) = key
+            if not isPCRE and self.literalTokens[key] != None:
+                requiredTokens.setdefault(source, set()).add(self.literalTokens[key])
+
+        foundTokens = {}
+        for source in requiredTokens:
+            foundTokens[source] = view.findTokens(source, requiredTokens[source])
+
+        results = {}
+
+        for key in keys:
+            (source, isPCRE, value) = key
+            compiledValue = self.symptomsByKey[key][0].output.compiledValue
+
+            if not isPCRE:
+                token = self.literalTokens[key]
+                result = (token == None or token in foundTokens[source]) and view.contains(source, value)
+            else:
+                lines = view.getLines(source)
+
+                if source in self.combinedPatterns and key in self.combinedPatterns[source][1]:
+                    # Only lines matching the combined pattern can match any of its parts
+                    if not source in candidateLines:
+                        combinedPattern = self.combinedPatterns[source][0]
+                        candidateLines[source] = [ line for line in lines if combinedPattern.search(line) != None ]
+                    lines = candidateLines[source]
+
+                result = False
+                for line in lines:
+                    if compiledValue.search(line) != None:
+                        result = True
+                        break
+
+            for symptom in self.symptomsByKey[key]:
+                results[symptom] = result
+
+        return results
@@ -0,0 +1,116 @@
+'''
+Signature Cache
+
+Provides a bounded, thread-safe LRU cache of parsed CrashSignature objects.
+Signatures are keyed by their text, so a lookup is only a dictionary access and
+the returned signature always has exactly the requested text.
+
+The cached CrashSignature objects are shared between all callers and must not
+be modified.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+from collections import OrderedDict
+import threading
+
+from FTB.Signatures.CrashSignature import CrashSignature
+
+# Default number of signatures to keep. This should be larger than the number
+# of signatures typically iterated in one go, otherwise the LRU order causes
+# every lookup of a full iteration to miss.
+DEFAULT_MAX_SIZE = 8192
+
+class SignatureCache():
+    def __init__(self, maxSize=DEFAULT_MAX_SIZE):
+        '''
+        Create an empty signature cache
+
+        @type maxSize: int
+        @param maxSize: Maximum number of signatures to keep
+        '''
+        self.maxSize = maxSize
+        self.signatures = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def getSignature(self, rawSignature):
+        '''
+        Get the parsed signature for the given signature text, parsing it
+        only if it isn't cached yet.
+
+        @type rawSignature: string
+        @param rawSignature: A JSON-formatted string representing the crash signature
+
+        @rtype: CrashSignature
+        @return: The (shared) parsed signature
+        '''
+        key = rawSignature
+
+        with self.lock:
+            signature = self.signatures.pop(key, None)
+            if signature != None:
+                # Re-insert to mark the entry as most recently used
+                self.signatures[key] = signature
+                self.hits += 1
+                return signature
+            self.misses += 1
+
+        # Parse outside of the lock, this is the expensive part
+        signature = CrashSignature(rawSignature)
+
+        with self.lock:
+            # Another thread might have added the signature in the meantime
+            if key in self.signatures:
+                return self.signatures[key]
+
+            self.signatures[key] = signature
+            while len(self.signatures) > self.maxSize:
+                self.signatures.popitem(last=False)
+
+        return signature
+
+    def invalidate(self, rawSignature):
+        '''
+        Remove the given signature from the cache, if present.
+
+        @type rawSignature: string
+        @param rawSignature: A JSON-formatted string representing the crash signature
+        '''
+        with self.lock:
+            self.signatures.pop(rawSignature, None)
+
+    def clear(self):
+        '''
+        Remove all signatures from the cache and reset the statistics.
+        '''
+        with self.lock:
+            self.signatures.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def getStatistics(self):
+        '''
+        Get the cache statistics
+
+        @rtype: dict
+        @return: Dictionary with the number of hits, misses and cached signatures
+        '''
+        with self.lock:
+            return { "hits" : self.hits, "misses" : self.misses, "size" : len(self.signatures) }
+
+# Process-wide signature cache
+signatureCache = SignatureCache()
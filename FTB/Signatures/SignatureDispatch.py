@@ -0,0 +1,175 @@
+'''
+Signature Dispatch
+
+Partitions a set of signatures by the products, operating systems and platforms
+they are restricted to and, where a signature fixes it, by its top stack frame.
+Given a crash, only the signatures in the partitions of its configuration and
+top frame need to be matched.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+from FTB.Signatures.Symptom import StackFrameSymptom, StackFramesSymptom, FunctionNameType
+
+# Length of the substrings used to index top frames. Function names are
+# substring matches, so we can't index the frames by their full name.
+TOP_FRAME_GRAM_SIZE = 4
+
+def getGrams(value):
+    '''
+    Get all substrings of length TOP_FRAME_GRAM_SIZE of the given value
+
+    @type value: string
+    @param value: The value to split
+
+    @rtype: set
+    @return: Set of substrings
+    '''
+    return set([ value[idx:idx + TOP_FRAME_GRAM_SIZE] for idx in xrange(len(value) - TOP_FRAME_GRAM_SIZE + 1) ])
+
+def getTopFrameLiterals(signature):
+    '''
+    Get literals that the top frame of every crash matching the given signature
+    must contain.
+
+    @type signature: CrashSignature
+    @param signature: The signature to check
+
+    @rtype: list
+    @return: List of required literals, empty if the signature doesn't restrict the top frame
+    '''
+    for symptom in signature.symptoms:
+        if isinstance(symptom, StackFrameSymptom):
+            frameNumber = symptom.frameNumber
+            if frameNumber.matchType != None or frameNumber.value != 0:
+                continue
+            functionName = symptom.functionName
+        elif isinstance(symptom, StackFramesSymptom):
+            if not symptom.functionNames or symptom.functionNameTypes[0] != FunctionNameType.MATCH:
+                continue
+            functionName = symptom.functionNames[0]
+        else:
+            continue
+
+        literals = [ literal for literal in functionName.getRequiredLiterals() if len(literal) >= TOP_FRAME_GRAM_SIZE ]
+        if literals:
+            return literals
+
+    return []
+
+def getRestrictionKeys(values):
+    '''
+    Get the tree keys for the given signature restriction (e.g. the list of
+    products). No restriction (None) maps to the None key, an empty list
+    means the signature can never match, so it has no keys at all.
+
+    @type values: list
+    @param values: The restriction as specified in the signature or None
+
+    @rtype: set
+    @return: Set of keys the signature has to be added to
+    '''
+    if values == None:
+        return set([ None ])
+    return set(values)
+
+class SignatureDispatch():
+    def __init__(self, signatures):
+        '''
+        Build the dispatch tree for the given signatures.
+
+        The tree has one level each for product, operating system and platform.
+        Each level maps the configuration value to the next level, where the
+        key None holds the signatures that are not restricted on that level.
+        The leaves map top frame substrings to signature indices, again with
+        None holding all signatures that don't restrict the top frame.
+
+        @type signatures: list
+        @param signatures: List of CrashSignature objects
+        '''
+        self.tree = {}
+
+        topFrameLiterals = [ getTopFrameLiterals(signature) for signature in signatures ]
+
+        # Count how many signatures require each substring, so we can key
+        # every signature on its least common substring.
+        gramCounts = {}
+        for literals in topFrameLiterals:
+            for gram in set().union(*[ getGrams(literal) for literal in literals ]):
+                gramCounts[gram] = gramCounts.get(gram, 0) + 1
+
+        for (idx, signature) in enumerate(signatures):
+            gram = None
+            if topFrameLiterals[idx]:
+                grams = set().union(*[ getGrams(literal) for literal in topFrameLiterals[idx] ])
+                gram = min(grams, key=lambda x: (gramCounts[x], x))
+
+            for product in getRestrictionKeys(signature.products):
+                productNode = self.tree.setdefault(product, {})
+                for os in getRestrictionKeys(signature.operatingSystems):
+                    osNode = productNode.setdefault(os, {})
+                    for platform in getRestrictionKeys(signature.platforms):
+                        leaf = osNode.setdefault(platform, {})
+                        leaf.setdefault(gram, []).append(idx)
+
+    def getCandidates(self, crashInfo):
+        '''
+        Determine all signatures that can possibly match the given crash.
+
+        @type crashInfo: CrashInfo
+        @param crashInfo: The crash information to check
+
+        @rtype: list
+        @return: Sorted list of indices of the candidate signatures
+        '''
+        configuration = crashInfo.configuration
+
+        topFrameGrams = None
+        candidates = []
+
+        for product in (configuration.product, None):
+            if not product in self.tree:
+                continue
+            productNode = self.tree[product]
+
+            for os in (configuration.os, None):
+                if not os in productNode:
+                    continue
+                osNode = productNode[os]
+
+                for platform in (configuration.platform, None):
+                    if not platform in osNode:
+                        continue
+                    leaf = osNode[platform]
+
+                    if None in leaf:
+                        candidates.extend(leaf[None])
+
+                    if len(leaf) == 1 and None in leaf:
+                        continue
+
+                    if topFrameGrams == None:
+                        topFrameGrams = set()
+                        if crashInfo.backtrace:
+                            topFrameGrams = getGrams(crashInfo.backtrace[0])
+
+                    # Iterate over the smaller of both sets
+                    if len(topFrameGrams) < len(leaf):
+                        for gram in topFrameGrams:
+                            if gram in leaf:
+                                candidates.extend(leaf[gram])
+                    else:
+                        for gram in leaf:
+                            if gram in topFrameGrams:
+                                candidates.extend(leaf[gram])
+
+        candidates.sort()
+        return candidates
@@ -0,0 +1,286 @@
+'''
+Signature Index
+
+Provides a compiled, persistent index over a set of crash signatures. The index
+holds the already parsed CrashSignature objects together with their metadata,
+so a lookup does not need to read and parse every signature file again.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+# Ensure print() compatibility with Python 3
+from __future__ import print_function
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import hashlib
+import json
+import os
+import sys
+from tempfile import mkstemp
+
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.LiteralPrefilter import LiteralPrefilter
+from FTB.Signatures.OutputMatcher import OutputMatcher
+from FTB.Signatures.SignatureDispatch import SignatureDispatch
+
+# Name of the index file that is stored inside a signature cache directory
+INDEX_FILE_NAME = ".signatures.index"
+
+# Process-wide cache of loaded indices, maps the real path of a signature
+# directory to a tuple (directory modification time, SignatureIndex).
+_loadedIndices = {}
+
+class SignatureIndex():
+    # Increase this whenever the pickled representation of the index or of
+    # any of the signature classes changes in an incompatible way.
+    FORMAT_VERSION = 5
+
+    def __init__(self, fingerprint=None):
+        '''
+        Create an empty signature index
+
+        @type fingerprint: string
+        @param fingerprint: Fingerprint of the signature directory this index was built from
+        '''
+        self.fingerprint = fingerprint
+
+        # List of (key, CrashSignature, metadata) tuples in lookup order
+        self.entries = []
+
+        # Dispatch tree, literal prefilter and output matcher over all signatures, built on first use
+        self.dispatch = None
+        self.prefilter = None
+        self.outputMatcher = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def addSignature(self, key, signature, metadata=None):
+        '''
+        Add a signature to the index
+
+        @type key: string
+        @param key: Key that is returned by L{search} if this signature matches
+        @type signature: CrashSignature
+        @param signature: The signature to add
+        @type metadata: map
+        @param metadata: Optional metadata associated with the signature
+        '''
+        self.entries.append((key, signature, metadata))
+        self.dispatch = None
+        self.prefilter = None
+        self.outputMatcher = None
+
+    def search(self, crashInfo):
+        '''
+        Search the index for the first signature matching the given crash.
+
+        @type crashInfo: CrashInfo
+        @param crashInfo: The crash information to match against
+
+        @rtype: tuple
+        @return: Tuple containing key and metadata of the matching signature, or (None, None).
+        '''
+        if self.prefilter == None:
+            signatures = [ signature for (key, signature, metadata) in self.entries ]
+            self.dispatch = SignatureDispatch(signatures)
+            self.prefilter = LiteralPrefilter(signatures)
+            self.outputMatcher = OutputMatcher(signatures)
+
+        # Only signatures that are candidates in both structures can match
+        dispatchCandidates = set(self.dispatch.getCandidates(crashInfo))
+        candidates = [ idx for idx in self.prefilter.getCandidates(crashInfo) if idx in dispatchCandidates ]
+        symptomResults = self.outputMatcher.match(crashInfo, candidates)
+
+        for idx in candidates:
+            (key, signature, metadata) = self.entries[idx]
+            if signature.matches(crashInfo, symptomResults):
+                return (key, metadata)
+
+        return (None, None)
+
+    def save(self, indexFile):
+        '''
+        Store the index in the given file. The file is replaced atomically so
+        concurrent readers either see the old or the new index.
+
+        @type indexFile: string
+        @param indexFile: File to write the index to
+        '''
+        (indexFd, tmpIndexFile) = mkstemp(prefix=".signatures.index-", dir=os.path.dirname(os.path.abspath(indexFile)))
+        try:
+            with os.fdopen(indexFd, 'wb') as f:
+                pickle.dump((SignatureIndex.FORMAT_VERSION, self.fingerprint, self.entries), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpIndexFile, indexFile)
+        except:
+            os.remove(tmpIndexFile)
+            raise
+
+    @staticmethod
+    def load(indexFile):
+        '''
+        Load an index previously stored with L{save}.
+
+        @type indexFile: string
+        @param indexFile: File to read the index from
+
+        @rtype: SignatureIndex
+        @return: The loaded index or None if the file is missing, unreadable or has an old format
+        '''
+        try:
+            with open(indexFile, 'rb') as f:
+                (formatVersion, fingerprint, entries) = pickle.load(f)
+        except Exception:
+            return None
+
+        if formatVersion != SignatureIndex.FORMAT_VERSION:
+            return None
+
+        index = SignatureIndex(fingerprint)
+        index.entries = entries
+        return index
+
+    @staticmethod
+    def getDirectoryFingerprint(sigDir):
+        '''
+        Calculate a fingerprint of all signature and metadata files in the given
+        directory. This only requires a directory listing and a stat call per file,
+        the files themselves are not read.
+
+        @type sigDir: string
+        @param sigDir: Signature directory
+
+        @rtype: string
+        @return: Fingerprint of the directory contents
+        '''
+        h = hashlib.new('sha1')
+        for sigFile in sorted(os.listdir(sigDir)):
+            if not sigFile.endswith(".signature") and not sigFile.endswith(".metadata"):
+                continue
+
+            st = os.stat(os.path.join(sigDir, sigFile))
+            h.update("%s:%s:%s\n" % (sigFile, st.st_size, st.st_mtime))
+
+        return h.hexdigest()
+
+    @staticmethod
+    def fromDirectory(sigDir):
+        '''
+        Build a new index by parsing all signature files in the given directory.
+        Metadata files with the same base name are attached to the signatures.
+        The signature file names (without directory) are used as keys.
+
+        @type sigDir: string
+        @param sigDir: Signature directory
+
+        @rtype: SignatureIndex
+        @return: Index over all signatures in the directory
+        '''
+        index = SignatureIndex(SignatureIndex.getDirectoryFingerprint(sigDir))
+
+        # Hashes of the canonical signatures added so far. Equivalent signatures
+        # always match the same crashes, so only the first one is indexed.
+        signatureHashes = set()
+
+        for sigName in sorted(os.listdir(sigDir)):
+            if not sigName.endswith('.signature'):
+                continue
+
+            sigFile = os.path.join(sigDir, sigName)
+            if os.path.isdir(sigFile):
+                continue
+
+            with open(sigFile) as f:
+                rawSignature = f.read()
+
+            try:
+                signatureHash = CrashSignature.getSignatureHash(rawSignature)
+                if signatureHash in signatureHashes:
+                    continue
+                crashSig = CrashSignature(rawSignature)
+            except RuntimeError, e:
+                print("Warning: Skipping invalid signature file %s: %s" % (sigFile, e), file=sys.stderr)
+                continue
+
+            signatureHashes.add(signatureHash)
+
+            metadataFile = sigFile.replace('.signature', '.metadata')
+            metadata = None
+            if os.path.exists(metadataFile):
+                with open(metadataFile) as m:
+                    metadata = json.loads(m.read())
+
+            index.addSignature(sigName, crashSig, metadata)
+
+        return index
+
+    @staticmethod
+    def rebuild(sigDir):
+        '''
+        Build a new index for the given directory and store it there.
+
+        @type sigDir: string
+        @param sigDir: Signature directory
+
+        @rtype: SignatureIndex
+        @return: The newly built index
+        '''
+        index = SignatureIndex.fromDirectory(sigDir)
+
+        try:
+            index.save(os.path.join(sigDir, INDEX_FILE_NAME))
+        except (IOError, OSError), e:
+            # We can still use the index for this process, it just won't persist
+            print("Warning: Failed to store signature index in %s: %s" % (sigDir, e), file=sys.stderr)
+
+        _loadedIndices[os.path.realpath(sigDir)] = (os.stat(sigDir).st_mtime, index)
+        return index
+
+    @staticmethod
+    def forDirectory(sigDir):
+        '''
+        Get the index for the given signature directory. The index is loaded
+        only once per process and afterwards served from memory as long as the
+        directory does not change. If the stored index is missing or outdated,
+        it is rebuilt.
+
+        @type sigDir: string
+        @param sigDir: Signature directory
+
+        @rtype: SignatureIndex
+        @return: Index over all signatures in the directory
+        '''
+        realSigDir = os.path.realpath(sigDir)
+        dirMtime = os.stat(realSigDir).st_mtime
+
+        if realSigDir in _loadedIndices:
+            (loadedMtime, index) = _loadedIndices[realSigDir]
+            if loadedMtime == dirMtime:
+                return index
+        else:
+            # The directory might be a new generation of a signature cache directory
+            # replaced by a refresh, forget about indices of removed generations.
+            for loadedSigDir in _loadedIndices.keys():
+                if not os.path.isdir(loadedSigDir):
+                    del _loadedIndices[loadedSigDir]
+
+        # Either we haven't loaded the index yet or the directory changed.
+        # Check the stored index against the current directory contents.
+        index = SignatureIndex.load(os.path.join(realSigDir, INDEX_FILE_NAME))
+        if index == None or index.fingerprint != SignatureIndex.getDirectoryFingerprint(realSigDir):
+            return SignatureIndex.rebuild(realSigDir)
+
+        _loadedIndices[realSigDir] = (dirMtime, index)
+        return index
@@ -0,0 +1,155 @@
+'''
+Signature Profiler
+
+Records how expensive it is to evaluate crash signatures. Profiling is opt-in
+per signature (see L{CrashSignature.enableProfiling}). For each signature, the
+profiler records the number of matches, the time spent and how many crashes
+matched, and the same figures broken down by symptom type, so expensive
+signatures (e.g. pathological regular expressions) can be identified.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+import threading
+
+class SignatureProfiler():
+    def __init__(self):
+        '''
+        Create an empty profiler
+        '''
+        # Maps signature key -> [ evaluations, seconds, matches ]
+        self.signatures = {}
+
+        # Maps signature key -> symptom type -> [ evaluations, seconds, rejections ]
+        self.symptoms = {}
+
+        self.lock = threading.Lock()
+
+    def recordSignature(self, key, seconds, evaluations=1, matches=0):
+        '''
+        Record the evaluation of a signature
+
+        @type key: string
+        @param key: Key identifying the signature
+        @type seconds: float
+        @param seconds: Time spent evaluating the signature
+        @type evaluations: int
+        @param evaluations: Number of crashes the signature was evaluated for
+        @type matches: int
+        @param matches: Number of crashes that matched
+        '''
+        with self.lock:
+            stats = self.signatures.setdefault(key, [ 0, 0.0, 0 ])
+            stats[0] += evaluations
+            stats[1] += seconds
+            stats[2] += matches
+
+    def recordSymptom(self, key, symptom, seconds, evaluations=1, rejections=0):
+        '''
+        Record the evaluation of a symptom of a signature
+
+        @type key: string
+        @param key: Key identifying the signature
+        @type symptom: Symptom
+        @param symptom: The symptom that was evaluated
+        @type seconds: float
+        @param seconds: Time spent evaluating the symptom
+        @type evaluations: int
+        @param evaluations: Number of crashes the symptom was evaluated for
+        @type rejections: int
+        @param rejections: Number of crashes the symptom rejected
+        '''
+        with self.lock:
+            stats = self.symptoms.setdefault(key, {}).setdefault(symptom.jsonobj["type"], [ 0, 0.0, 0 ])
+            stats[0] += evaluations
+            stats[1] += seconds
+            stats[2] += rejections
+
+    def clear(self):
+        '''
+        Remove all recorded data
+        '''
+        with self.lock:
+            self.signatures.clear()
+            self.symptoms.clear()
+
+    def getReport(self, limit=None):
+        '''
+        Get the recorded data, most expensive signatures first.
+
+        @type limit: int
+        @param limit: Maximum number of signatures to report, all if None
+
+        @rtype: list
+        @return: List of dictionaries, one per signature, with the keys "key",
+                 "evaluations", "time", "matches" and "symptoms". The latter
+                 maps each symptom type to a dictionary with the keys
+                 "evaluations", "time", "rejections" and "rejectionRate".
+        '''
+        report = []
+
+        with self.lock:
+            for (key, (evaluations, seconds, matches)) in self.signatures.items():
+                symptoms = {}
+                for (symptomType, (symptomEvaluations, symptomSeconds, rejections)) in self.symptoms.get(key, {}).items():
+                    rejectionRate = 0.0
+                    if symptomEvaluations:
+                        rejectionRate = float(rejections) / symptomEvaluations
+
+                    symptoms[symptomType] = {
+                                             "evaluations" : symptomEvaluations,
+                                             "time" : symptomSeconds,
+                                             "rejections" : rejections,
+                                             "rejectionRate" : rejectionRate
+                                             }
+
+                report.append({
+                               "key" : key,
+                               "evaluations" : evaluations,
+                               "time" : seconds,
+                               "matches" : matches,
+                               "symptoms" : symptoms
+                               })
+
+        report.sort(key=lambda entry: entry["time"], reverse=True)
+
+        if limit != None:
+            report = report[:limit]
+
+        return report
+
+    def formatReport(self, limit=None, descriptions=None):
+        '''
+        Format the report returned by L{getReport} as text.
+
+        @type limit: int
+        @param limit: Maximum number of signatures to report, all if None
+        @type descriptions: dict
+        @param descriptions: Optional descriptions to show for each signature key
+
+        @rtype: string
+        @return: The formatted report
+        '''
+        buf = []
+        buf.append("%-20s %12s %12s %10s" % ("Signature", "Evaluations", "Time (ms)", "Matches"))
+
+        for entry in self.getReport(limit):
+            buf.append("%-20s %12d %12.3f %10d" % (entry["key"], entry["evaluations"], entry["time"] * 1000, entry["matches"]))
+
+            if descriptions != None and descriptions.get(entry["key"]):
+                buf.append("    %s" % descriptions[entry["key"]])
+
+            symptoms = sorted(entry["symptoms"].items(), key=lambda item: item[1]["time"], reverse=True)
+            for (symptomType, stats) in symptoms:
+                buf.append("    %-16s %12d %12.3f %9.1f%% rejected" % (symptomType, stats["evaluations"],
+                                                                    stats["time"] * 1000, stats["rejectionRate"] * 100))
+
+        return "\n".join(buf)
@@ -0,0 +1,158 @@
+'''
+Symbol Table
+
+Provides a process-wide table of interned function names and a compact
+backtrace representation that stores symbol ids instead of strings. Crashes
+loaded for triage share most of their frames, so every distinct function name
+is only kept once. The table is bounded: once it is full, new backtraces use a
+fresh table and the old one is freed together with the last backtrace using it.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+from array import array
+import threading
+
+# Maximum number of function names in a symbol table before a new one is started
+MAX_SYMBOL_TABLE_SIZE = 100000
+
+class SymbolTable(object):
+    __slots__ = ("ids", "names", "lock")
+
+    def __init__(self):
+        # Maps function name -> symbol id and symbol id -> function name
+        self.ids = {}
+        self.names = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        '''
+        Get the symbol id for the given function name, adding it to the table
+        if it isn't known yet.
+
+        @type name: string
+        @param name: The function name
+
+        @rtype: int
+        @return: The symbol id
+        '''
+        symbolId = self.ids.get(name)
+        if symbolId != None:
+            return symbolId
+
+        with self.lock:
+            # Another thread might have added the name in the meantime
+            symbolId = self.ids.get(name)
+            if symbolId == None:
+                symbolId = len(self.names)
+                self.names.append(name)
+                self.ids[name] = symbolId
+
+        return symbolId
+
+    def getName(self, symbolId):
+        '''
+        @type symbolId: int
+        @param symbolId: A symbol id returned by L{intern}
+
+        @rtype: string
+        @return: The function name for the given symbol id
+        '''
+        return self.names[symbolId]
+
+# Process-wide symbol table used for new backtraces, see L{getSymbolTable}
+symbolTable = SymbolTable()
+symbolTableLock = threading.Lock()
+
+def getSymbolTable():
+    '''
+    Get the symbol table to use for a new backtrace. In long running processes
+    (like the Collector daemon or the server), the table would otherwise keep
+    every function name ever seen, so it is replaced once it is full.
+
+    @rtype: SymbolTable
+    @return: The current process-wide symbol table
+    '''
+    global symbolTable
+
+    if len(symbolTable) >= MAX_SYMBOL_TABLE_SIZE:
+        with symbolTableLock:
+            if len(symbolTable) >= MAX_SYMBOL_TABLE_SIZE:
+                symbolTable = SymbolTable()
+
+    return symbolTable
+
+class Backtrace(object):
+    '''
+    A list of function names stored as an array of symbol ids. Besides being
+    compact, this allows matchers to remember results by symbol id (see
+    L{FTB.Signatures.Matchers.StringMatchCache}). It behaves like a read-only
+    list of strings, except for L{append} and L{pop} which are used while
+    parsing. Symbol ids are only meaningful in the symbol table of the backtrace.
+    '''
+    __slots__ = ("symbolIds", "symbolTable")
+
+    def __init__(self, functionNames=None):
+        self.symbolIds = array('I')
+        self.symbolTable = getSymbolTable()
+
+        if functionNames != None:
+            for functionName in functionNames:
+                self.append(functionName)
+
+    def append(self, functionName):
+        self.symbolIds.append(self.symbolTable.intern(functionName))
+
+    def pop(self, idx=-1):
+        return self.symbolTable.getName(self.symbolIds.pop(idx))
+
+    def getSymbolId(self, idx):
+        return self.symbolIds[idx]
+
+    def getKey(self):
+        '''
+        @rtype: string
+        @return: A hashable value that is equal for equal backtraces
+                 with the same symbol table
+        '''
+        return (id(self.symbolTable), self.symbolIds.tostring())
+
+    def __len__(self):
+        return len(self.symbolIds)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            names = self.symbolTable.names
+            return [ names[symbolId] for symbolId in self.symbolIds[idx] ]
+        return self.symbolTable.names[self.symbolIds[idx]]
+
+    def __iter__(self):
+        names = self.symbolTable.names
+        for symbolId in self.symbolIds:
+            yield names[symbolId]
+
+    def __eq__(self, other):
+        if isinstance(other, Backtrace) and self.symbolTable is other.symbolTable:
+            return self.symbolIds == other.symbolIds
+        if isinstance(other, Backtrace):
+            return list(self) == list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
@@ -18,9 +18,11 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import print_function
 
 from abc import ABCMeta, abstractmethod
+import itertools
 import json
+import numpy
 from FTB.Signatures import JSONHelper
-from FTB.Signatures.Matchers import StringMatch, NumberMatch
+from FTB.Signatures.Matchers import StringMatch, StringMatchCache, NumberMatch
 
 class Symptom():
     '''
@@ -29,6 +31,10 @@ class Symptom():
     '''
     __metaclass__ = ABCMeta
     
+    # Estimated relative cost of matching this symptom. Signatures use this
+    # to check cheap symptoms first, so they can reject crashes early.
+    MATCH_COST = 1
+    
     def __init__(self, jsonObj):
         # Store the original source so we can return it if someone wants to stringify us
         self.jsonsrc = json.dumps(jsonObj, indent=2)
@@ -83,8 +89,36 @@ class Symptom():
         '''
         return
     
+    def matchesMany(self, crashInfos):
+        '''
+        Check if the symptom matches each of the given crash information objects.
+        Subclasses override this to share work between the crashes.
+        
+        @type crashInfos: list
+        @param crashInfos: List of CrashInfo objects to check against
+        
+        @rtype: numpy.ndarray
+        @return: Boolean array with the result of L{matches} for each crash
+        '''
+        return numpy.array([ self.matches(crashInfo) for crashInfo in crashInfos ], dtype=bool)
+    
+    def getRequiredLiterals(self):
+        '''
+        Get strings that must be present in the crash information for this
+        symptom to match. This is used to prefilter signatures before the
+        actual (more expensive) matching.
+        
+        @rtype: list
+        @return: List of tuples (source, literal) where source is one of
+                 "frames", "stdout", "stderr", "output" or "instruction"
+        '''
+        return []
+    
     
 class OutputSymptom(Symptom):
+    # Scans all output lines
+    MATCH_COST = 8
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -108,11 +142,9 @@ class OutputSymptom(Symptom):
         @rtype: bool
         @return: True if the symptom matches, False otherwise
         '''
-        checkedOutput = []
-        
         if self.src == None:
-            checkedOutput.extend(crashInfo.rawStdout)
-            checkedOutput.extend(crashInfo.rawStderr)
+            # Output can be mapped from large files, don't copy it into one list
+            checkedOutput = itertools.chain(crashInfo.rawStdout, crashInfo.rawStderr)
         elif (self.src == "stdout"):
             checkedOutput = crashInfo.rawStdout
         else:
@@ -124,7 +156,38 @@ class OutputSymptom(Symptom):
             
         return False
     
+    def matchesMany(self, crashInfos):
+        # Output lines (e.g. assertion messages) are shared between many crashes
+        outputMatch = StringMatchCache(self.output)
+        results = numpy.zeros(len(crashInfos), dtype=bool)
+        
+        for (idx, crashInfo) in enumerate(crashInfos):
+            checkedOutputs = []
+            if self.src == None or self.src == "stdout":
+                checkedOutputs.append(crashInfo.rawStdout)
+            if self.src == None or self.src == "stderr":
+                checkedOutputs.append(crashInfo.rawStderr)
+            
+            for checkedOutput in checkedOutputs:
+                for line in checkedOutput:
+                    if outputMatch.matches(line):
+                        results[idx] = True
+                        break
+                if results[idx]:
+                    break
+        
+        return results
+    
+    def getRequiredLiterals(self):
+        src = self.src
+        if src == None:
+            src = "output"
+        return [ (src, literal) for literal in self.output.getRequiredLiterals() ]
+    
 class StackFrameSymptom(Symptom):
+    # Scans the stack frames
+    MATCH_COST = 4
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -157,8 +220,36 @@ class StackFrameSymptom(Symptom):
                     return True
         
         return False
+    
+    def matchesMany(self, crashInfos):
+        results = numpy.zeros(len(crashInfos), dtype=bool)
+        if not crashInfos:
+            return results
+        
+        # Determine the frame numbers to check once for all crashes
+        maxStackSize = max([ len(crashInfo.backtrace) for crashInfo in crashInfos ])
+        frameIndices = numpy.flatnonzero(self.frameNumber.matchesMany(numpy.arange(maxStackSize)))
+        
+        functionNameMatch = StringMatchCache(self.functionName)
+        
+        for (idx, crashInfo) in enumerate(crashInfos):
+            symbolTable = crashInfo.backtrace.symbolTable
+            symbolIds = crashInfo.backtrace.symbolIds
+            for frameIdx in frameIndices:
+                if frameIdx >= len(symbolIds):
+                    break
+                if functionNameMatch.matchesSymbol(symbolTable, symbolIds[frameIdx]):
+                    results[idx] = True
+                    break
+        
+        return results
+    
+    def getRequiredLiterals(self):
+        return [ ("frames", literal) for literal in self.functionName.getRequiredLiterals() ]
 
 class StackSizeSymptom(Symptom):
+    MATCH_COST = 1
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -178,7 +269,13 @@ class StackSizeSymptom(Symptom):
         '''
         return self.stackSize.matches(len(crashInfo.backtrace))
     
+    def matchesMany(self, crashInfos):
+        stackSizes = numpy.array([ len(crashInfo.backtrace) for crashInfo in crashInfos ], dtype=numpy.int64)
+        return self.stackSize.matchesMany(stackSizes)
+    
 class CrashAddressSymptom(Symptom):
+    MATCH_COST = 1
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -200,7 +297,20 @@ class CrashAddressSymptom(Symptom):
         # the NumberMatch class will return false to not match.
         return self.address.matches(crashInfo.crashAddress)
     
+    def matchesMany(self, crashInfos):
+        results = numpy.zeros(len(crashInfos), dtype=bool)
+        
+        # Addresses can exceed the range of any fixed size integer type
+        # (e.g. negative and unsigned 64 bit values), so use an object array.
+        crashAddresses = numpy.array([ crashInfo.crashAddress for crashInfo in crashInfos ], dtype=object)
+        haveAddress = numpy.array([ crashAddress != None for crashAddress in crashAddresses ], dtype=bool)
+        
+        results[haveAddress] = self.address.matchesMany(crashAddresses[haveAddress])
+        return results
+    
 class InstructionSymptom(Symptom):
+    MATCH_COST = 2
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -238,14 +348,29 @@ class InstructionSymptom(Symptom):
                 return False
         
         return True
+    
+    def getRequiredLiterals(self):
+        literals = []
+        
+        if self.registerNames != None:
+            literals.extend([ ("instruction", register) for register in self.registerNames if register ])
+        
+        if self.instructionName != None:
+            literals.extend([ ("instruction", literal) for literal in self.instructionName.getRequiredLiterals() ])
+        
+        return literals
 
 class TestcaseSymptom(Symptom):
+    # Requires the testcase to be loaded
+    MATCH_COST = 16
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
         '''
         Symptom.__init__(self, obj)
         self.output = StringMatch(JSONHelper.getObjectOrStringChecked(obj, "value", True))
+        self.requiredLiterals = self.output.getRequiredLiterals()
         
     def matches(self, crashInfo):
         '''
@@ -257,20 +382,31 @@ class TestcaseSymptom(Symptom):
         @rtype: bool
         @return: True if the symptom matches, False otherwise
         '''
+        testLines = crashInfo.getTestcaseLines()
         
         # No testcase means to fail matching
-        if crashInfo.testcase == None:
+        if testLines == None:
             return False
         
-        testLines = crashInfo.testcase.splitlines()
-            
+        # Search the whole testcase for the required literals first, so
+        # testcases that can't match are rejected without splitting lines.
+        for literal in self.requiredLiterals:
+            if testLines.find(literal) < 0:
+                return False
+        
         for line in testLines:
             if self.output.matches(line):
                 return True
             
         return False
     
+class FunctionNameType:
+    MATCH, SINGLE_WILDCARD, MULTI_WILDCARD = range(3)
+
 class StackFramesSymptom(Symptom):
+    # Scans the stack frames
+    MATCH_COST = 4
+    
     def __init__(self, obj):
         '''
         Private constructor, called by L{Symptom.fromJSONObject}. Do not use directly.
@@ -283,6 +419,8 @@ class StackFramesSymptom(Symptom):
         for fn in rawFunctionNames:
             self.functionNames.append(StringMatch(fn))
         
+        self.functionNameTypes = StackFramesSymptom._getFunctionNameTypes(self.functionNames)
+        
     def matches(self, crashInfo):
         '''
         Check if the symptom matches the given crash information
@@ -294,116 +432,255 @@ class StackFramesSymptom(Symptom):
         @return: True if the symptom matches, False otherwise
         '''
             
-        return StackFramesSymptom._match(crashInfo.backtrace, self.functionNames)
+        return StackFramesSymptom._match(crashInfo.backtrace, self.functionNames, self.functionNameTypes)
+    
+    def matchesMany(self, crashInfos):
+        # Crashes in the same bucket often have identical stacks
+        stackResults = {}
+        results = numpy.zeros(len(crashInfos), dtype=bool)
+        
+        for (idx, crashInfo) in enumerate(crashInfos):
+            stack = crashInfo.backtrace.getKey()
+            if not stack in stackResults:
+                stackResults[stack] = StackFramesSymptom._match(crashInfo.backtrace, self.functionNames, self.functionNameTypes)
+            results[idx] = stackResults[stack]
+        
+        return results
+    
+    def getRequiredLiterals(self):
+        # Every function name that is not a wildcard has to match one frame
+        literals = []
+        for functionName in self.functionNames:
+            if str(functionName) != '?' and str(functionName) != '???':
+                literals.extend([ ("frames", literal) for literal in functionName.getRequiredLiterals() ])
+        return literals
     
     def diff(self, crashInfo):
         if self.matches(crashInfo):
             return (0, None)
         
-        for depth in range(1,4):
-            (bestDepth, bestGuess) = StackFramesSymptom._diff(crashInfo.backtrace, self.functionNames, 0, 1, depth)
-            if bestDepth != None:
-                guessedFunctionNames = [repr(x) for x in bestGuess]
-                
-                # Remove trailing wildcards as they are of no use
-                while guessedFunctionNames and (guessedFunctionNames[-1] == '?' or guessedFunctionNames[-1] == '???'):
-                    guessedFunctionNames.pop()
-                    
-                if not guessedFunctionNames:
-                    # Do not return empty matches. This happens if there's nothing left except wildcards.
-                    return (None, None)
-                        
-                return (bestDepth, StackFramesSymptom({ "type": "stackFrames", 'functionNames' : guessedFunctionNames }))
+        (distance, guess) = StackFramesSymptom._diff(crashInfo.backtrace, self.functionNames, self.functionNameTypes)
+        guessedFunctionNames = [repr(x) for x in guess]
         
-        return (None, None)
+        # Remove trailing wildcards as they are of no use
+        while guessedFunctionNames and (guessedFunctionNames[-1] == '?' or guessedFunctionNames[-1] == '???'):
+            guessedFunctionNames.pop()
+            
+        if not guessedFunctionNames:
+            # Do not return empty matches. This happens if there's nothing left except wildcards.
+            return (None, None)
+                
+        return (distance, StackFramesSymptom({ "type": "stackFrames", 'functionNames' : guessedFunctionNames }))
     
     @staticmethod
-    def _diff(stack, signatureGuess, startIdx, depth, maxDepth):     
+    def _diff(stack, functionNames, functionNameTypes=None):
+        '''
+        Determine the minimal number of edits required to make the given function
+        names match the stack. An edit is either inserting a '?' or replacing a
+        function name by a '?'.
+        
+        This is an alignment of the function names with the stack, computed by
+        dynamic programming over all pairs of stack and function name positions.
+        
+        @type stack: list
+        @param stack: List of stack frames (strings)
+        @type functionNames: list
+        @param functionNames: List of StringMatch objects
+        @type functionNameTypes: list
+        @param functionNameTypes: Optional precomputed result of L{_getFunctionNameTypes}
+        
+        @rtype: tuple
+        @return: Tuple containing the number of edits and the edited list of function names
+        '''
+        if functionNameTypes == None:
+            functionNameTypes = StackFramesSymptom._getFunctionNameTypes(functionNames)
+        
         singleWildcardMatch = StringMatch("?")
         
-        newSignatureGuess = []
-        newSignatureGuess.extend(signatureGuess)
+        frameCount = len(stack)
+        functionNameCount = len(functionNames)
         
-        bestDepth = None
-        bestGuess = None
+        # cost[frameIdx][nameIdx] is the minimal number of edits required to
+        # match functionNames[nameIdx:] against stack[frameIdx:]. All function
+        # names consumed means we have a match, no matter how much stack is left.
+        cost = [ [ None ] * (functionNameCount + 1) for _ in xrange(frameCount + 1) ]
         
-        for idx in range(startIdx,len(newSignatureGuess)):
-            newSignatureGuess.insert(idx, singleWildcardMatch)
-            
-            # Check if we have a match with our modification
-            if StackFramesSymptom._match(stack, newSignatureGuess):
-                return (depth, newSignatureGuess)
+        # Caches the results of matching each frame against each function name
+        frameMatches = [ [ False ] * functionNameCount for _ in xrange(frameCount) ]
+        
+        for frameIdx in xrange(frameCount, -1, -1):
+            cost[frameIdx][functionNameCount] = 0
+            haveFrame = frameIdx < frameCount
             
-            # If we don't have a match but we're not at our current depth limit,
-            # add one more level of depth for our search.
-            if depth < maxDepth:
-                (newBestDepth, newBestGuess) = StackFramesSymptom._diff(stack, newSignatureGuess, idx, depth+1, maxDepth)
+            for nameIdx in xrange(functionNameCount - 1, -1, -1):
+                functionNameType = functionNameTypes[nameIdx]
                 
-                if newBestDepth != None and (bestDepth == None or newBestDepth < bestDepth):
-                    bestDepth = newBestDepth
-                    bestGuess = newBestGuess
-                    
-            newSignatureGuess.pop(idx)
-            
-            # Now repeat the same with replacing instead of adding
-            # unless the match at idx is a wildcard itself
-            
-            if str(newSignatureGuess[idx]) == '?' or str(newSignatureGuess[idx]) == '???':
-                continue
-            
-            origMatch = newSignatureGuess[idx]
-            newSignatureGuess[idx] = singleWildcardMatch
-            
-            # Check if we have a match with our modification
-            if StackFramesSymptom._match(stack, newSignatureGuess):
-                return (depth, newSignatureGuess)
+                # Skip the function name without consuming a frame. This is free
+                # for wildcards and requires replacing anything else by '?'.
+                best = cost[frameIdx][nameIdx + 1]
+                if functionNameType == FunctionNameType.MATCH:
+                    best += 1
+                
+                if haveFrame:
+                    if functionNameType == FunctionNameType.MULTI_WILDCARD:
+                        # Consume a frame and keep the triple question mark
+                        best = min(best, cost[frameIdx + 1][nameIdx])
+                    else:
+                        if functionNameType == FunctionNameType.MATCH:
+                            frameMatches[frameIdx][nameIdx] = functionNames[nameIdx].matches(stack[frameIdx])
+                        
+                        # Consume a frame with the function name, requires replacing it by '?' on mismatch
+                        if functionNameType == FunctionNameType.SINGLE_WILDCARD or frameMatches[frameIdx][nameIdx]:
+                            best = min(best, cost[frameIdx + 1][nameIdx + 1])
+                        else:
+                            best = min(best, cost[frameIdx + 1][nameIdx + 1] + 1)
+                        
+                        # Consume a frame with a '?' inserted in front of the function name
+                        best = min(best, cost[frameIdx + 1][nameIdx] + 1)
+                
+                cost[frameIdx][nameIdx] = best
+        
+        # Walk along an optimal alignment to construct the edited function names.
+        # Among equally good edits, prefer matches over insertions over replacements.
+        guess = []
+        frameIdx = 0
+        nameIdx = 0
+        
+        while nameIdx < functionNameCount:
+            functionNameType = functionNameTypes[nameIdx]
+            remainingCost = cost[frameIdx][nameIdx]
+            haveFrame = frameIdx < frameCount
             
-            # If we don't have a match but we're not at our current depth limit,
-            # add one more level of depth for our search.
-            if depth < maxDepth:
-                (newBestDepth, newBestGuess) = StackFramesSymptom._diff(stack, newSignatureGuess, idx, depth+1, maxDepth)
+            if functionNameType != FunctionNameType.MATCH:
+                if haveFrame and functionNameType == FunctionNameType.MULTI_WILDCARD and cost[frameIdx + 1][nameIdx] == remainingCost:
+                    frameIdx += 1
+                    continue
                 
-                if newBestDepth != None and (bestDepth == None or newBestDepth < bestDepth):
-                    bestDepth = newBestDepth
-                    bestGuess = newBestGuess
+                if haveFrame and functionNameType == FunctionNameType.SINGLE_WILDCARD and cost[frameIdx + 1][nameIdx + 1] == remainingCost:
+                    frameIdx += 1
+                    nameIdx += 1
+                    guess.append(functionNames[nameIdx - 1])
+                    continue
+                
+                if cost[frameIdx][nameIdx + 1] == remainingCost:
+                    nameIdx += 1
+                    guess.append(functionNames[nameIdx - 1])
+                    continue
+            elif haveFrame and frameMatches[frameIdx][nameIdx] and cost[frameIdx + 1][nameIdx + 1] == remainingCost:
+                frameIdx += 1
+                nameIdx += 1
+                guess.append(functionNames[nameIdx - 1])
+                continue
             
-            newSignatureGuess[idx] = origMatch
-         
-        return (bestDepth, bestGuess)
+            if haveFrame and cost[frameIdx + 1][nameIdx] + 1 == remainingCost:
+                frameIdx += 1
+                guess.append(singleWildcardMatch)
+            elif haveFrame and cost[frameIdx + 1][nameIdx + 1] + 1 == remainingCost:
+                frameIdx += 1
+                nameIdx += 1
+                guess.append(singleWildcardMatch)
+            else:
+                nameIdx += 1
+                guess.append(singleWildcardMatch)
+        
+        return (cost[0][0], guess)
     
     @staticmethod
-    def _match(partialStack, partialFunctionNames):    
-        # Process as many non-wildcard chars as we can find iteratively for performance reasons
-        while partialFunctionNames and partialStack and str(partialFunctionNames[0]) != '?' and str(partialFunctionNames[0]) != '???':
-            if not partialFunctionNames[0].matches(partialStack[0]):
+    def _getFunctionNameTypes(functionNames):
+        '''
+        Determine the type of each function name, so the matcher doesn't need
+        to inspect the StringMatch objects for wildcards over and over again.
+        
+        @type functionNames: list
+        @param functionNames: List of StringMatch objects
+        
+        @rtype: list
+        @return: List of FunctionNameType values, one for each function name
+        '''
+        functionNameTypes = []
+        for functionName in functionNames:
+            if functionName.value == '?':
+                functionNameTypes.append(FunctionNameType.SINGLE_WILDCARD)
+            elif functionName.value == '???':
+                functionNameTypes.append(FunctionNameType.MULTI_WILDCARD)
+            else:
+                functionNameTypes.append(FunctionNameType.MATCH)
+        return functionNameTypes
+    
+    @staticmethod
+    def _match(stack, functionNames, functionNameTypes=None):
+        '''
+        Check if the given function names match the beginning of the stack.
+        
+        A '?' matches zero or one frame, a '???' matches any number of frames.
+        The function names are simulated as a non-deterministic automaton over
+        indices: We track the set of positions in functionNames that can be
+        reached after consuming each stack frame, so every frame is matched
+        against every function name at most once and no copies are made.
+        
+        @type stack: list
+        @param stack: List of stack frames (strings)
+        @type functionNames: list
+        @param functionNames: List of StringMatch objects
+        @type functionNameTypes: list
+        @param functionNameTypes: Optional precomputed result of L{_getFunctionNameTypes}
+        
+        @rtype: bool
+        @return: True if the function names match the stack, False otherwise
+        '''
+        if functionNameTypes == None:
+            functionNameTypes = StackFramesSymptom._getFunctionNameTypes(functionNames)
+        
+        functionNameCount = len(functionNames)
+        
+        # Sorted list of reachable positions, before wildcards are skipped
+        positions = [0]
+        
+        for frameIdx in xrange(len(stack) + 1):
+            # Wildcards can match zero frames, so every position on a wildcard
+            # also allows to continue at the next position. Positions are sorted
+            # and skipping only moves forward, so the result is sorted as well.
+            reachable = []
+            for pos in positions:
+                if reachable and pos <= reachable[-1]:
+                    continue
+                
+                while True:
+                    reachable.append(pos)
+                    
+                    if pos == functionNameCount:
+                        # End of function names to match, accept
+                        return True
+                    
+                    if functionNameTypes[pos] == FunctionNameType.MATCH:
+                        break
+                    
+                    pos += 1
+            
+            if frameIdx == len(stack):
+                # Out of stack to match, reject
                 return False
             
-            # Change the view on partialStack and partialFunctionNames without actually
-            # modifying the underlying arrays. They have to be preserved for the caller.
-            partialStack = partialStack[1:]
-            partialFunctionNames = partialFunctionNames[1:]
+            frame = stack[frameIdx]
+            positions = []
             
-        if not partialFunctionNames:
-            # End of function names to match, accept
-            return True    
-
-        if str(partialFunctionNames[0]) == '?' or str(partialFunctionNames[0]) == '???':
-            if StackFramesSymptom._match(partialStack, partialFunctionNames[1:]):
-                # We recursively consumed 0 to N stack frames and can now
-                # get a match for the remaining stack without the current
-                # wildcard element, so we're done and accept the stack.
-                return True
-            else:
-                if not partialStack:
-                    # Out of stack to match, reject
-                    return False
+            for pos in reachable:
+                functionNameType = functionNameTypes[pos]
                 
-                if str(partialFunctionNames[0]) == '?':
-                    # Recurse, consume one stack frame and the question mark
-                    return StackFramesSymptom._match(partialStack[1:], partialFunctionNames[1:])
+                if functionNameType == FunctionNameType.MATCH:
+                    if not functionNames[pos].matches(frame):
+                        continue
+                    nextPos = pos + 1
+                elif functionNameType == FunctionNameType.SINGLE_WILDCARD:
+                    # Consume one stack frame and the question mark
+                    nextPos = pos + 1
                 else:
-                    # Recurse, consume one stack frame and keep triple question mark
-                    return StackFramesSymptom._match(partialStack[1:], partialFunctionNames)
-        elif not partialStack:
-            # Out of stack to match, reject
-            return False
\ No newline at end of file
+                    # Consume one stack frame and keep triple question mark
+                    nextPos = pos
+                
+                if not positions or positions[-1] != nextPos:
+                    positions.append(nextPos)
+            
+            if not positions:
+                # No way to continue matching, reject
+                return False
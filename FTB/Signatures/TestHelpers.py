@@ -0,0 +1,308 @@
+'''
+Test Helpers
+
+Previous implementations of signature matching, trace parsing and assertion
+detection code, kept as reference for the tests (which check that the current implementations agree
+with them) and for the benchmarks in FTB.Benchmarks, as well as synthetic
+traces to compare them on.
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+
+import re
+
+from numpy import uint32, uint64
+
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures import RegisterHelper
+from FTB.Signatures.CrashInfo import GDBCrashInfo
+from FTB.Signatures.Matchers import StringMatch
+
+def legacyMatch(partialStack, partialFunctionNames):
+    '''
+    The recursive matcher StackFramesSymptom used to have. It copies the stack
+    and function names on every step and recurses for every wildcard.
+    '''
+    # Process as many non-wildcard chars as we can find iteratively for performance reasons
+    while partialFunctionNames and partialStack and str(partialFunctionNames[0]) != '?' and str(partialFunctionNames[0]) != '???':
+        if not partialFunctionNames[0].matches(partialStack[0]):
+            return False
+
+        # Change the view on partialStack and partialFunctionNames without actually
+        # modifying the underlying arrays. They have to be preserved for the caller.
+        partialStack = partialStack[1:]
+        partialFunctionNames = partialFunctionNames[1:]
+
+    if not partialFunctionNames:
+        # End of function names to match, accept
+        return True
+
+    if str(partialFunctionNames[0]) == '?' or str(partialFunctionNames[0]) == '???':
+        if legacyMatch(partialStack, partialFunctionNames[1:]):
+            # We recursively consumed 0 to N stack frames and can now
+            # get a match for the remaining stack without the current
+            # wildcard element, so we're done and accept the stack.
+            return True
+        else:
+            if not partialStack:
+                # Out of stack to match, reject
+                return False
+
+            if str(partialFunctionNames[0]) == '?':
+                # Recurse, consume one stack frame and the question mark
+                return legacyMatch(partialStack[1:], partialFunctionNames[1:])
+            else:
+                # Recurse, consume one stack frame and keep triple question mark
+                return legacyMatch(partialStack[1:], partialFunctionNames)
+    elif not partialStack:
+        # Out of stack to match, reject
+        return False
+
+def legacyDiff(stack, signatureGuess, startIdx, depth, maxDepth):
+    '''
+    The brute-force search StackFramesSymptom.diff used to run with maxDepth 1 to 3.
+    It tries inserting or replacing a '?' at every position and recurses.
+    '''
+    singleWildcardMatch = StringMatch("?")
+
+    newSignatureGuess = []
+    newSignatureGuess.extend(signatureGuess)
+
+    bestDepth = None
+    bestGuess = None
+
+    for idx in range(startIdx,len(newSignatureGuess)):
+        newSignatureGuess.insert(idx, singleWildcardMatch)
+
+        # Check if we have a match with our modification
+        if legacyMatch(stack, newSignatureGuess):
+            return (depth, newSignatureGuess)
+
+        # If we don't have a match but we're not at our current depth limit,
+        # add one more level of depth for our search.
+        if depth < maxDepth:
+            (newBestDepth, newBestGuess) = legacyDiff(stack, newSignatureGuess, idx, depth+1, maxDepth)
+
+            if newBestDepth != None and (bestDepth == None or newBestDepth < bestDepth):
+                bestDepth = newBestDepth
+                bestGuess = newBestGuess
+
+        newSignatureGuess.pop(idx)
+
+        # Now repeat the same with replacing instead of adding
+        # unless the match at idx is a wildcard itself
+
+        if str(newSignatureGuess[idx]) == '?' or str(newSignatureGuess[idx]) == '???':
+            continue
+
+        origMatch = newSignatureGuess[idx]
+        newSignatureGuess[idx] = singleWildcardMatch
+
+        # Check if we have a match with our modification
+        if legacyMatch(stack, newSignatureGuess):
+            return (depth, newSignatureGuess)
+
+        # If we don't have a match but we're not at our current depth limit,
+        # add one more level of depth for our search.
+        if depth < maxDepth:
+            (newBestDepth, newBestGuess) = legacyDiff(stack, newSignatureGuess, idx, depth+1, maxDepth)
+
+            if newBestDepth != None and (bestDepth == None or newBestDepth < bestDepth):
+                bestDepth = newBestDepth
+                bestGuess = newBestGuess
+
+        newSignatureGuess[idx] = origMatch
+
+    return (bestDepth, bestGuess)
+
+def legacyDiffDistance(stack, functionNames):
+    '''
+    Run L{legacyDiff} with increasing depth like StackFramesSymptom.diff did.
+
+    @rtype: int
+    @return: The number of edits or None if more than 3 edits are required
+    '''
+    if legacyMatch(stack, functionNames):
+        return 0
+
+    for depth in range(1,4):
+        (bestDepth, bestGuess) = legacyDiff(stack, functionNames, 0, 1, depth)
+        if bestDepth != None:
+            return bestDepth
+
+    return None
+
+def legacyParse(gdbOutput):
+    '''
+    The parser GDBCrashInfo used to have. It searches uncompiled patterns on
+    every line and re-searches the whole buffer for every part of a wrapped frame.
+
+    @rtype: tuple
+    @return: Tuple of backtrace, registers, crash address and crash instruction
+    '''
+    backtrace = []
+    registers = {}
+    crashAddress = None
+    crashInstruction = None
+
+    gdbFramePatterns = [
+                        "\\s*#(\\d+)\\s+(0x[0-9a-f]+) in (.+?) \\(.*?\\)( at .+)?",
+                        "\\s*#(\\d+)\\s+()(.+?) \\(.*?\\)( at .+)?"
+                        ]
+
+    gdbRegisterPattern = RegisterHelper.getRegisterPattern() + "\\s+0x([0-9a-f]+)"
+    gdbCrashAddressPattern = "Crash Address:\\s+0x([0-9a-f]+)"
+    gdbCrashInstructionPattern = "=> 0x[0-9a-f]+(?: <.+>)?:\\s+(.+)"
+
+    lastLineBuf = ""
+
+    pastFrames = False
+
+    for traceLine in gdbOutput:
+        if not pastFrames and re.match("\\s*#\\d+.+", lastLineBuf) != None and re.match("\\s*#\\d+.+", traceLine) != None:
+            raise RuntimeError("Fatal error parsing GDB trace")
+
+        if not len(lastLineBuf):
+            match = re.search(gdbRegisterPattern, traceLine)
+            if match != None:
+                pastFrames = True;
+                register = match.group(1)
+                value = long(match.group(2), 16)
+                registers[register] = value
+            else:
+                match = re.search(gdbCrashAddressPattern, traceLine)
+                if match != None:
+                    crashAddress = long(match.group(1), 16)
+                else:
+                    match = re.search(gdbCrashInstructionPattern, traceLine)
+                    if match != None:
+                        crashInstruction = match.group(1)
+
+        if not pastFrames:
+            if not len(lastLineBuf) and re.match("\\s*#\\d+.+", traceLine) == None:
+                continue
+
+            lastLineBuf += traceLine
+
+            functionName = None
+            frameIndex = None
+
+            for gdbPattern in gdbFramePatterns:
+                match = re.search(gdbPattern, lastLineBuf)
+                if match != None:
+                    frameIndex = int(match.group(1))
+                    functionName = match.group(3)
+                    break
+
+            if frameIndex == None:
+                continue
+            else:
+                lastLineBuf = ""
+
+            if len(backtrace) != frameIndex and frameIndex == 0:
+                backtrace.pop(0)
+            elif len(backtrace) != frameIndex:
+                raise RuntimeError("Fatal error parsing GDB trace")
+
+            gdbErrorIdx = functionName.find(" (/build/buildd/gdb")
+            if gdbErrorIdx > 0:
+                functionName = functionName[:gdbErrorIdx]
+
+            backtrace.append(functionName)
+
+    if crashAddress == None and crashInstruction != None:
+        crashAddress = GDBCrashInfo.calculateCrashAddress(crashInstruction, registers)
+
+        if isinstance(crashAddress, basestring):
+            crashAddress = None
+        elif crashAddress != None and crashAddress < 0:
+            if RegisterHelper.getBitWidth(registers) == 32:
+                crashAddress = uint32(crashAddress)
+            else:
+                crashAddress = uint64(crashAddress)
+
+    return (backtrace, registers, crashAddress, crashInstruction)
+
+def parse(gdbOutput):
+    '''
+    Parse the given trace with GDBCrashInfo, for comparison with L{legacyParse}.
+
+    @rtype: tuple
+    @return: Tuple of backtrace, registers, crash address and crash instruction
+    '''
+    crashInfo = GDBCrashInfo([], gdbOutput, ProgramConfiguration("test", "x86-64", "linux"))
+    return (list(crashInfo.backtrace), crashInfo.registers, crashInfo.crashAddress, crashInfo.crashInstruction)
+
+def legacyGetAssertion(output, onlyProgramAssertions=False):
+    '''
+    The chain of checks getAssertion used to have. It walks the output forward
+    and runs all checks on every line.
+    '''
+    lastLine = None
+    addNext = False
+
+    haveTrueAssertion = False
+
+    for line in output:
+        line = re.sub("^\\[\\d+\\]\\s+", "", line, count=1)
+
+        if addNext:
+            lastLine += " "
+            lastLine += line
+        elif line.startswith("Assertion failure"):
+            lastLine = line
+            haveTrueAssertion = True
+        elif line.startswith("###!!! ASSERTION:"):
+            lastLine = line
+            haveTrueAssertion = True
+        elif line.startswith("# Fatal error in"):
+            lastLine = line
+            haveTrueAssertion = True
+            addNext = True
+        elif not onlyProgramAssertions and not haveTrueAssertion and "ERROR: AddressSanitizer" in line:
+            lastLine = line
+        elif "Assertion" in line and "failed" in line:
+            lastLine = line
+        elif not onlyProgramAssertions and "glibc detected" in line:
+            lastLine = line
+        elif "MOZ_CRASH" in line and re.search("MOZ_CRASH\(.+\)", line):
+            lastLine = line
+
+    return lastLine
+
+def getTrace(frameCount, noiseLines):
+    '''
+    Create a synthetic GDB trace.
+
+    @type frameCount: int
+    @param frameCount: Number of frames in the trace, every fourth one is wrapped over three lines
+    @type noiseLines: int
+    @param noiseLines: Number of program output lines before the trace
+
+    @rtype: list
+    @return: Lines of the trace
+    '''
+    lines = [ "[%s] Running test %s, nothing to see here" % (idx, idx) for idx in range(noiseLines) ]
+
+    lines.append("Program received signal SIGSEGV, Segmentation fault.")
+    for idx in range(frameCount):
+        if idx % 4 == 3:
+            lines.append("#%s  0x%016x in js::jit::Frame%s::call (cx=0x7ffff6a16000, " % (idx, 0x400000 + idx, idx))
+            lines.append("    args=..., callee=..., thisv=..., ")
+            lines.append("    rval=...) at /srv/repos/mozilla-central/js/src/jit/Frame.cpp:%s" % idx)
+        else:
+            lines.append("#%s  0x%016x in js::jit::Frame%s::call (cx=0x7ffff6a16000) at /srv/repos/mozilla-central/js/src/jit/Frame.cpp:%s" % (idx, 0x400000 + idx, idx, idx))
+
+    for (idx, register) in enumerate([ "rax", "rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp", "rip" ]):
+        lines.append("%s            0x%x      %s" % (register, idx * 0x1000, idx * 0x1000))
+    lines.append("=> 0x4a2c3b <js::jit::Frame0::call()+27>:	mov    (%rax),%rcx")
+
+    return lines
@@ -3,13 +3,21 @@ Created on Oct 9, 2014
 
 @author: decoder
 '''
+import mmap
+import os
+import random
+import tempfile
 import unittest
 from FTB.Signatures.CrashInfo import CrashInfo
 import json
 from FTB.ProgramConfiguration import ProgramConfiguration
-from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.CrashSignature import CrashSignature, ADAPTIVE_ORDERING_INTERVAL
+from FTB.Signatures.LineBuffer import MappedLineBuffer
 from FTB.Signatures.Matchers import StringMatch
+from FTB.Signatures.SignatureCache import SignatureCache
+from FTB.Signatures.SignatureProfiler import SignatureProfiler
 from FTB.Signatures.Symptom import StackFramesSymptom
+from FTB.Signatures.TestHelpers import legacyMatch, legacyDiffDistance
 
 testTrace1 = """Program received signal SIGSEGV, Segmentation fault.
 GetObjectAllocKindForCopy (obj=0x7ffff54001b0, nursery=...) at /srv/repos/mozilla-central/js/src/gc/Nursery.cpp:369
@@ -322,6 +330,47 @@ class SignatureTestCaseMatchTest(unittest.TestCase):
         # This one does not match at all
         self.assertFalse(testSig6.matches(crashInfo))
 
+class SignatureMappedTestCaseMatchTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        
+        crashInfo = CrashInfo.fromRawCrashData([], [], config, auxCrashData=testTrace1.splitlines())
+        
+        testSig4 = CrashSignature(testSignature4)
+        testSig5 = CrashSignature(testSignature5)
+        testSig6 = CrashSignature(testSignature6)
+        
+        (fd, testFile) = tempfile.mkstemp(prefix="testcase-tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(testCase1.replace("\n", "\r\n"))
+            
+            # Map the file regardless of its size
+            with open(testFile, 'rb') as f:
+                testLines = MappedLineBuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self.assertEqual(list(testLines), testCase1.splitlines())
+            self.assertEqual(list(MappedLineBuffer.fromFile(testFile)), testCase1.splitlines())
+            
+            # The testcase is attached lazily and loaded only once
+            loads = []
+            def loadTestcase():
+                loads.append(testFile)
+                return testLines
+            
+            crashInfo.testcase = loadTestcase
+            self.assertEqual(loads, [])
+            
+            self.assertTrue(testSig4.matches(crashInfo))
+            self.assertTrue(testSig5.matches(crashInfo))
+            self.assertFalse(testSig6.matches(crashInfo))
+            self.assertEqual(loads, [testFile])
+        finally:
+            os.remove(testFile)
+        
+        # A loader without testcase never matches
+        crashInfo.testcase = lambda: None
+        self.assertFalse(testSig4.matches(crashInfo))
+
 class SignatureStackFramesTest(unittest.TestCase):
     def runTest(self):
         config = ProgramConfiguration("test", "x86", "linux")
@@ -352,13 +401,34 @@ class SignatureStackFramesAlgorithmsTest(unittest.TestCase):
                      (['a', 'b', 'x', 'a', 'b', 'c'], ['a', 'b', '???', 'a', 'b', 'x', 'c'], 1, ['a', 'b', '???', 'a', 'b', '?', 'c']),
                      (['b', 'x', 'a', 'b', 'c'], ['a', 'b', '???', 'a', 'b', 'x', 'c'], 2, ['?', 'b', '???', 'a', 'b', '?', 'c']),
                      (['b', 'x', 'a', 'd', 'x'], ['a', 'b', '???', 'a', 'b', 'x', 'c'], 3, ['?', 'b', '???', 'a', '?', 'x', '?']),
+                     (['x', 'b'], ['b'], 1, ['?', 'b']),
+                     (['a', 'x', 'y', 'b', 'z', 'c', 'd'], ['a', 'b', 'c', 'd', 'e'], 4, ['a', '?', '?', 'b', '?', 'c', 'd', '?']),
                      ]
         
         for (stack, rawSig, expectedDepth, expectedSig) in testArray:
-            for maxDepth in (expectedDepth, 3):
-                (actualDepth, actualSig) = StackFramesSymptom._diff(stack, [ StringMatch(x) for x in rawSig ], 0, 1, maxDepth)
-                self.assertEqual(expectedDepth, actualDepth)
-                self.assertEqual(expectedSig, [ str(x) for x in actualSig ])
+            (actualDepth, actualSig) = StackFramesSymptom._diff(stack, [ StringMatch(x) for x in rawSig ])
+            self.assertEqual(expectedDepth, actualDepth)
+            self.assertEqual(expectedSig, [ str(x) for x in actualSig ])
+
+class SignatureStackFramesMatchTest(unittest.TestCase):
+    def runTest(self):
+        # Compare the matcher with the previous implementation on random stacks and signatures
+        rng = random.Random(1234)
+        
+        for _ in range(2000):
+            stack = [ rng.choice(['a', 'b', 'c', 'ab']) for _ in range(rng.randint(0, 8)) ]
+            rawSig = [ rng.choice(['a', 'b', 'c', '?', '???', '/^a$/']) for _ in range(rng.randint(0, 6)) ]
+            functionNames = [ StringMatch(x) for x in rawSig ]
+            
+            self.assertEqual(StackFramesSymptom._match(stack, functionNames), legacyMatch(stack, functionNames), "%s %s" % (stack, rawSig))
+            
+            # The diff must agree with the previous one where it found a result and must always provide a match
+            (distance, guess) = StackFramesSymptom._diff(stack, functionNames)
+            self.assertTrue(StackFramesSymptom._match(stack, guess))
+            
+            legacyDistance = legacyDiffDistance(stack, functionNames)
+            if legacyDistance != None:
+                self.assertEqual(distance, legacyDistance, "%s %s" % (stack, rawSig))
 
 class SignaturePCREShortTest(unittest.TestCase):
     def runTest(self):
@@ -386,6 +456,151 @@ class SignatureStackFramesWildcardTailTest(unittest.TestCase):
         self.assertEqual(str(testSig.symptoms[0].functionNames[6]), "js::jit::CheckOverRecursedWithExtra")
         self.assertEqual(len(testSig.symptoms[0].functionNames), 7)
         
+class SignatureMatchOrderTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        crashInfo = CrashInfo.fromRawCrashData(["foo"], [], config, auxCrashData=testTrace1.splitlines())
+        
+        testSig = CrashSignature('''{ "symptoms" : [
+            { "type" : "testcase", "value" : "foo" },
+            { "type" : "output", "value" : "foo" },
+            { "type" : "stackFrames", "functionNames" : [ "GetObjectAllocKindForCopy" ] },
+            { "type" : "stackSize", "size" : "> 3" }
+        ] }''')
+        
+        # Symptoms are matched by cost, but keep their original order otherwise
+        self.assertEqual(testSig.matchOrder, [3, 2, 1, 0])
+        self.assertEqual(testSig.symptoms[0].jsonobj["type"], "testcase")
+        
+        self.assertFalse(testSig.matches(crashInfo))
+        crashInfo.testcase = "foo"
+        self.assertTrue(testSig.matches(crashInfo))
+        crashInfo.testcase = None
+        
+        # With adaptive ordering, the symptom that rejects most crashes moves to the front
+        testSig = CrashSignature('''{ "symptoms" : [
+            { "type" : "output", "value" : "foo" },
+            { "type" : "output", "value" : "bar" }
+        ] }''')
+        testSig.enableAdaptiveOrdering()
+        
+        for _ in range(ADAPTIVE_ORDERING_INTERVAL):
+            self.assertFalse(testSig.matches(crashInfo))
+        self.assertFalse(testSig.matches(crashInfo))
+        
+        self.assertEqual(testSig.matchOrder, [1, 0])
+        self.assertEqual(testSig.symptomEvaluations, [ADAPTIVE_ORDERING_INTERVAL - 1, ADAPTIVE_ORDERING_INTERVAL + 1])
+
+class SignatureMatchesManyTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        
+        crashInfos = [
+                      CrashInfo.fromRawCrashData([], [], config, auxCrashData=testTrace1.splitlines()),
+                      CrashInfo.fromRawCrashData([], [], config, auxCrashData=testTrace2.splitlines()),
+                      CrashInfo.fromRawCrashData(["foo"], ["Assertion failure: bar"], config),
+                      CrashInfo.fromRawCrashData([], [], config, auxCrashData=testTrace1.splitlines()),
+                      ]
+        crashInfos[3].testcase = "foo();"
+        
+        rawSignatures = [
+                         testSignature1, testSignature2, testSignature3, testSignature4, testSignature5, testSignature6,
+                         testSignatureStackFrames1, testSignatureStackFrames2, testSignatureStackFrames5,
+                         testSignaturePCREShort1, testSignaturePCREShort2,
+                         '{ "symptoms" : [ { "type" : "stackFrame", "frameNumber" : "> 1", "functionName" : "/^MarkValue/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stderr", "value" : "/^Assertion failure: /" } ] }',
+                         '{ "symptoms" : [ { "type" : "testcase", "value" : "foo" }, { "type" : "stackSize", "size" : "< 10" } ] }',
+                         '{ "symptoms" : [ { "type" : "crashAddress", "address" : ">= 0x10000" } ] }',
+                         ]
+        
+        for rawSignature in rawSignatures:
+            signature = CrashSignature(rawSignature)
+            expected = [ signature.matches(crashInfo) for crashInfo in crashInfos ]
+            self.assertEqual(list(signature.matchesMany(crashInfos)), expected, rawSignature)
+        
+        self.assertEqual(len(CrashSignature(testSignature1).matchesMany([])), 0)
+
+class SignatureCacheTest(unittest.TestCase):
+    def runTest(self):
+        rawSig1 = '{ "symptoms" : [ { "type" : "output", "value" : "foo" } ] }'
+        rawSig1Reformatted = '{"symptoms":[{"value":"foo","type":"output"}]}'
+        rawSig2 = '{ "symptoms" : [ { "type" : "output", "value" : "bar" } ] }'
+        rawSig3 = '{ "symptoms" : [ { "type" : "output", "value" : "baz" } ] }'
+        
+        self.assertEqual(CrashSignature.getSignatureHash(rawSig1), CrashSignature.getSignatureHash(rawSig1Reformatted))
+        self.assertNotEqual(CrashSignature.getSignatureHash(rawSig1), CrashSignature.getSignatureHash(rawSig2))
+        
+        cache = SignatureCache(maxSize=2)
+        
+        sig1 = cache.getSignature(rawSig1)
+        self.assertIs(cache.getSignature(rawSig1), sig1)
+        self.assertEqual(cache.getStatistics(), { "hits" : 1, "misses" : 1, "size" : 1 })
+        
+        # Equivalent signatures with a different text are cached separately,
+        # callers always get the text they asked for
+        self.assertEqual(cache.getSignature(rawSig1Reformatted).rawSignature, rawSig1Reformatted)
+        self.assertEqual(sig1.rawSignature, rawSig1)
+        cache.clear()
+        sig1 = cache.getSignature(rawSig1)
+        
+        # Least recently used signature is evicted
+        sig2 = cache.getSignature(rawSig2)
+        cache.getSignature(rawSig1)
+        cache.getSignature(rawSig3)
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.getSignature(rawSig1), sig1)
+        self.assertIsNot(cache.getSignature(rawSig2), sig2)
+        
+        cache.invalidate(rawSig1)
+        self.assertIsNot(cache.getSignature(rawSig1), sig1)
+        
+        # Invalid signatures are not cached
+        self.assertRaises(RuntimeError, cache.getSignature, '{ "symptoms" : [ ] }')
+        self.assertRaises(RuntimeError, cache.getSignature, '{ invalid')
+
+class SignatureProfilerTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        
+        crashInfos = [
+                      CrashInfo.fromRawCrashData(["foo"], [], config, auxCrashData=testTrace1.splitlines()),
+                      CrashInfo.fromRawCrashData(["bar"], [], config, auxCrashData=testTrace1.splitlines()),
+                      CrashInfo.fromRawCrashData(["foo"], [], config),
+                      ]
+        
+        profiler = SignatureProfiler()
+        
+        testSig = CrashSignature('{ "symptoms" : [ { "type" : "output", "value" : "foo" }, { "type" : "stackSize", "size" : "> 3" } ] }')
+        testSig.enableProfiling(profiler, "sig1")
+        
+        # Profiling must not change the results
+        self.assertEqual([ testSig.matches(crashInfo) for crashInfo in crashInfos ], [ True, False, False ])
+        self.assertEqual(list(testSig.matchesMany(crashInfos)), [ True, False, False ])
+        
+        otherSig = CrashSignature('{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ] }')
+        otherSig.enableProfiling(profiler)
+        otherSig.matches(crashInfos[0])
+        
+        report = profiler.getReport()
+        self.assertEqual(len(report), 2)
+        
+        entry = [ entry for entry in report if entry["key"] == "sig1" ][0]
+        self.assertEqual(entry["evaluations"], 6)
+        self.assertEqual(entry["matches"], 2)
+        
+        # The stack size is checked first and rejects the last crash
+        self.assertEqual(entry["symptoms"]["stackSize"]["evaluations"], 6)
+        self.assertEqual(entry["symptoms"]["stackSize"]["rejections"], 2)
+        self.assertEqual(entry["symptoms"]["output"]["evaluations"], 4)
+        self.assertEqual(entry["symptoms"]["output"]["rejectionRate"], 0.5)
+        
+        self.assertEqual(len(profiler.getReport(limit=1)), 1)
+        self.assertTrue("sig1" in profiler.formatReport(descriptions={ "sig1" : "Test signature" }))
+        
+        testSig.disableProfiling()
+        testSig.matches(crashInfos[0])
+        self.assertEqual([ entry for entry in profiler.getReport() if entry["key"] == "sig1" ][0]["evaluations"], 6)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
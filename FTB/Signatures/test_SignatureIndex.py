@@ -0,0 +1,240 @@
+'''
+Tests
+
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.LiteralPrefilter import CrashLiteralView, LiteralPrefilter, iterTokenChunks, MAX_SEARCHED_TOKENS
+from FTB.Signatures.OutputMatcher import OutputMatcher
+from FTB.Signatures.SignatureDispatch import SignatureDispatch
+from FTB.Signatures.SignatureIndex import SignatureIndex, INDEX_FILE_NAME
+from FTB.Signatures.test_CrashSignature import testTrace1
+
+testSignatureOutputFoo = '{ "symptoms" : [ { "type" : "output", "value" : "foo" } ] }'
+testSignatureOutputBar = '{ "symptoms" : [ { "type" : "output", "value" : "/^bar$/" } ] }'
+
+class SignatureIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.sigDir = tempfile.mkdtemp(prefix="sigindex-tmp-")
+
+    def tearDown(self):
+        shutil.rmtree(self.sigDir)
+
+    def writeSignature(self, name, signature, metadata=None):
+        with open(os.path.join(self.sigDir, name + ".signature"), 'w') as f:
+            f.write(signature)
+        if metadata != None:
+            with open(os.path.join(self.sigDir, name + ".metadata"), 'w') as f:
+                f.write(json.dumps(metadata))
+
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        crashInfoFoo = CrashInfo.fromRawCrashData(["foo"], [], config)
+        crashInfoBar = CrashInfo.fromRawCrashData([], ["bar"], config)
+
+        self.writeSignature("1", testSignatureOutputFoo, { "frequent" : True })
+
+        index = SignatureIndex.forDirectory(self.sigDir)
+        self.assertEqual(len(index), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.sigDir, INDEX_FILE_NAME)))
+
+        self.assertEqual(index.search(crashInfoFoo), ("1.signature", { "frequent" : True }))
+        self.assertEqual(index.search(crashInfoBar), (None, None))
+
+        # Unchanged directory must be served from memory
+        self.assertIs(SignatureIndex.forDirectory(self.sigDir), index)
+
+        # The stored index must be loadable and equivalent
+        storedIndex = SignatureIndex.load(os.path.join(self.sigDir, INDEX_FILE_NAME))
+        self.assertEqual(storedIndex.fingerprint, index.fingerprint)
+        self.assertEqual(storedIndex.search(crashInfoFoo), ("1.signature", { "frequent" : True }))
+
+        # Adding a signature must cause the index to be rebuilt
+        self.writeSignature("2", testSignatureOutputBar)
+        index = SignatureIndex.forDirectory(self.sigDir)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search(crashInfoBar), ("2.signature", None))
+
+        # Equivalent signatures are only indexed once
+        self.writeSignature("3", json.dumps(json.loads(testSignatureOutputFoo), indent=2))
+        index = SignatureIndex.forDirectory(self.sigDir)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search(crashInfoFoo), ("1.signature", { "frequent" : True }))
+
+class LiteralPrefilterTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        crashInfo = CrashInfo.fromRawCrashData([], ["Assertion failure: foo, at bar.cpp:12"], config, auxCrashData=testTrace1.splitlines())
+
+        rawSignatures = [
+                         # Token key (Nursery) in frames
+                         '{ "symptoms" : [ { "type" : "stackFrames", "functionNames" : [ "?", "js::Nursery::moveToTenured" ] } ] }',
+                         # Substring key in frames, must match partial frames as well
+                         '{ "symptoms" : [ { "type" : "stackFrame", "functionName" : "GetObjectAllocKind" } ] }',
+                         # Literal extracted from a PCRE on stderr
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stderr", "value" : "/^Assertion failure: foo, at .+:\\\\d+$/" } ] }',
+                         # Required literals missing from the crash
+                         '{ "symptoms" : [ { "type" : "stackFrame", "functionName" : "js::Unreachable::MarkNothing" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/Unexpected value: 42/" } ] }',
+                         # No literals at all, always a candidate
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/foo|bar/" } ] }',
+                         ]
+        signatures = [ CrashSignature(x) for x in rawSignatures ]
+
+        prefilter = LiteralPrefilter(signatures)
+        self.assertEqual(prefilter.getCandidates(crashInfo), [0, 1, 2, 5, 6])
+
+        # The prefilter must never exclude a matching signature
+        for (idx, signature) in enumerate(signatures):
+            if signature.matches(crashInfo):
+                self.assertIn(idx, prefilter.getCandidates(crashInfo))
+
+class OutputMatcherTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        crashInfos = [
+                      CrashInfo.fromRawCrashData(["foo bar", "baz"], ["Assertion failure: x > 0, at foo.cpp:12"], config),
+                      CrashInfo.fromRawCrashData([], ["foobar", "Hit MOZ_CRASH(oops) at bar.cpp:3"], config),
+                      CrashInfo.fromRawCrashData([], [], config),
+                      ]
+
+        crashInfos[1].testcase = "var x = 1;\nfoo(x);\n"
+
+        rawSignatures = [
+                         '{ "symptoms" : [ { "type" : "output", "value" : "foo" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stdout", "value" : "foo" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stderr", "value" : " bar" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "foo bar" }, { "type" : "output", "value" : "/^baz$/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/at \\\\w+\\\\.cpp:\\\\d+$/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stderr", "value" : "/MOZ_CRASH\\\\((?:oops|fail)\\\\)/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/(?i)ASSERTION/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/(foo)bar/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "" } ] }',
+                         '{ "symptoms" : [ { "type" : "testcase", "value" : "foo(x);" } ] }',
+                         '{ "symptoms" : [ { "type" : "testcase", "value" : "/^var/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "foo" }, { "type" : "output", "value" : "/^baz$/" } ] }',
+                         ]
+        signatures = [ CrashSignature(x) for x in rawSignatures ]
+
+        outputMatcher = OutputMatcher(signatures)
+
+        # Identical matches must be evaluated only once
+        self.assertEqual(len(outputMatcher.symptomsByKey), 11)
+
+        for crashInfo in crashInfos:
+            symptomResults = outputMatcher.match(crashInfo)
+            for signature in signatures:
+                for symptom in signature.symptoms:
+                    if symptom in symptomResults:
+                        self.assertEqual(symptomResults[symptom], symptom.matches(crashInfo))
+                self.assertEqual(signature.matches(crashInfo, symptomResults), signature.matches(crashInfo))
+
+        # Restricting the signatures must restrict the results, but identical
+        # symptoms of other signatures are still reported
+        symptomResults = outputMatcher.match(crashInfos[0], [0])
+        self.assertEqual(symptomResults, { signatures[0].symptoms[0] : True, signatures[11].symptoms[0] : True })
+
+class MappedLiteralViewTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="literalview-tmp-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, name, data):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'wb') as f:
+            f.write(data)
+        return fileName
+
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        stdout = "foo bar\r\nbaz_1\r\n"
+        stderr = "noise line %s\n" * 50 + "Assertion failure: x > 0, at foo.cpp:12\n"
+
+        mappedCrashInfo = CrashInfo.fromFiles(self.writeFile("stdout", stdout), self.writeFile("stderr", stderr), config)
+        crashInfo = CrashInfo.fromRawCrashData(stdout, stderr, config)
+
+        # Chunks never split tokens
+        chunks = list(iterTokenChunks(stderr, 16))
+        self.assertEqual("".join(chunks), stderr)
+        self.assertTrue(all([ len(chunk) <= 16 for chunk in chunks ]))
+        self.assertEqual(sum([ chunk.split() for chunk in chunks ], []), stderr.split())
+
+        view = CrashLiteralView(mappedCrashInfo)
+        self.assertNotIsInstance(view.getLines("output"), list)
+        self.assertEqual(list(view.getLines("output")), list(crashInfo.rawStdout) + list(crashInfo.rawStderr))
+
+        self.assertTrue(view.contains("output", "bar"))
+        self.assertTrue(view.contains("stderr", "x > 0, at"))
+        self.assertFalse(view.contains("stdout", "x > 0"))
+
+        # Few tokens are searched one by one, many are scanned for
+        self.assertEqual(view.findTokens("output", set([ "foo", "baz", "baz_1", "at", "line" ])), set([ "foo", "baz_1", "at", "line" ]))
+        manyTokens = set([ "token%s" % x for x in range(MAX_SEARCHED_TOKENS) ] + [ "foo", "baz", "baz_1", "at", "line" ])
+        self.assertEqual(view.findTokens("output", manyTokens), set([ "foo", "baz_1", "at", "line" ]))
+
+        rawSignatures = [
+                         '{ "symptoms" : [ { "type" : "output", "value" : "baz_1" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "baz" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stderr", "value" : "x > 0, at" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "value" : "/^baz_\\\\d$/" } ] }',
+                         '{ "symptoms" : [ { "type" : "output", "src" : "stdout", "value" : "Assertion" } ] }',
+                         ]
+        signatures = [ CrashSignature(x) for x in rawSignatures ]
+
+        self.assertEqual(LiteralPrefilter(signatures).getCandidates(mappedCrashInfo), LiteralPrefilter(signatures).getCandidates(crashInfo))
+        outputMatcher = OutputMatcher(signatures)
+        self.assertEqual(outputMatcher.match(mappedCrashInfo), outputMatcher.match(crashInfo))
+        self.assertEqual([ signature.matches(mappedCrashInfo) for signature in signatures ], [ True, True, True, True, False ])
+
+class SignatureDispatchTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+        crashInfo = CrashInfo.fromRawCrashData([], [], config, auxCrashData=testTrace1.splitlines())
+
+        rawSignatures = [
+                         # Unrestricted
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ] }',
+                         # Matching and non-matching configurations
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ], "products" : [ "test", "other" ], "platforms" : [ "x86" ] }',
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ], "products" : [ "other" ] }',
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ], "operatingSystems" : [ "windows" ] }',
+                         '{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ], "platforms" : [ ] }',
+                         # Matching and non-matching top frames
+                         '{ "symptoms" : [ { "type" : "stackFrame", "functionName" : "AllocKind" } ] }',
+                         '{ "symptoms" : [ { "type" : "stackFrames", "functionNames" : [ "GetObject", "???", "MarkValueInternal" ] } ], "operatingSystems" : [ "linux" ] }',
+                         '{ "symptoms" : [ { "type" : "stackFrames", "functionNames" : [ "/^js::Nursery/", "???", "MarkValueInternal" ] } ] }',
+                         '{ "symptoms" : [ { "type" : "stackFrame", "frameNumber" : 0, "functionName" : "moveToTenured" } ] }',
+                         # Not a top frame restriction
+                         '{ "symptoms" : [ { "type" : "stackFrame", "frameNumber" : 1, "functionName" : "moveToTenured" } ] }',
+                         '{ "symptoms" : [ { "type" : "stackFrames", "functionNames" : [ "?", "js::Nursery::moveToTenured" ] } ] }',
+                         ]
+        signatures = [ CrashSignature(x) for x in rawSignatures ]
+
+        dispatch = SignatureDispatch(signatures)
+        self.assertEqual(dispatch.getCandidates(crashInfo), [0, 1, 5, 6, 9, 10])
+
+        # Dispatch must never exclude a matching signature
+        for (idx, signature) in enumerate(signatures):
+            self.assertEqual(signature.matches(crashInfo), idx in [0, 1, 5, 6, 9, 10])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,11 +11,18 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 @contact:    choller@mozilla.com
 '''
+import StringIO
+import json
+import os
+import shutil
+import tempfile
 import unittest
 from FTB.Signatures.CrashInfo import ASanCrashInfo, GDBCrashInfo, CrashInfo,\
-    NoCrashInfo
+    NoCrashInfo, GDB_REGISTER_PATTERN, PARSER_VERSION
 from FTB.Signatures.CrashSignature import CrashSignature
-from FTB.Signatures import RegisterHelper
+from FTB.Signatures import RegisterHelper, SymbolTable
+from FTB.Signatures.Matchers import StringMatch, StringMatchCache
+from FTB.Signatures.TestHelpers import getTrace, legacyParse, parse
 
 from numpy import int64, uint64, int32, uint32
 from FTB.ProgramConfiguration import ProgramConfiguration
@@ -376,6 +383,102 @@ class GDBParserTestCrashAddressRegression3(unittest.TestCase):
         
         self.assertEqual(crashInfo3.crashAddress, 0x7fffffffffffL)
 
+class GDBParserEquivalenceTest(unittest.TestCase):
+    def runTest(self):
+        traces = [ gdbCrashAddress1, gdbCrashAddress2, gdbCrashAddress3, gdbSampleTrace1, gdbSampleTrace2,
+                   gdbSampleTrace3, gdbRegressionTrace1, gdbRegressionTrace2, gdbRegressionTrace3 ]
+        traces.append("\n".join(getTrace(32, 16)))
+
+        for trace in traces:
+            self.assertEqual(parse(trace.splitlines()), legacyParse(trace.splitlines()))
+
+            for line in trace.splitlines():
+                match = GDB_REGISTER_PATTERN.search(line)
+                if match == None:
+                    self.assertEqual(GDBCrashInfo.searchRegister(line), None)
+                else:
+                    self.assertEqual(GDBCrashInfo.searchRegister(line).span(), match.span())
+
+        for line in [ "xeax 0x1", "r10 0x1 r1 0x2", "  0xeax 0x1", "pc\t0xzz sp 0x12", "cx=0x1 lr  0x3" ]:
+            self.assertEqual(GDBCrashInfo.searchRegister(line).groups(), GDB_REGISTER_PATTERN.search(line).groups())
+
+class LazyParsingTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+
+        crashInfo = CrashInfo.fromRawCrashData([], gdbSampleTrace1.splitlines(), config)
+        self.assertFalse(crashInfo._parsed)
+
+        # Signatures rejecting on configuration or output must not trigger parsing
+        self.assertFalse(CrashSignature('{ "symptoms" : [ { "type" : "stackSize", "size" : "> 3" } ], "products" : [ "other" ] }').matches(crashInfo))
+        self.assertFalse(CrashSignature('{ "symptoms" : [ { "type" : "output", "value" : "foo" } ] }').matches(crashInfo))
+        self.assertFalse(crashInfo._parsed)
+
+        self.assertEqual(len(crashInfo.backtrace), 8)
+        self.assertTrue(crashInfo._parsed)
+
+        # Parsing errors surface on first access, and on every access after that
+        crashInfo = GDBCrashInfo([], ["#0  0x0 in foo ()", "#2  0x0 in bar ()"], config)
+        self.assertRaises(RuntimeError, lambda: crashInfo.backtrace)
+        self.assertRaises(RuntimeError, lambda: crashInfo.backtrace)
+
+        crashInfo = CrashInfo.fromRawCrashData([], ["==1==ERROR: AddressSanitizer: SEGV on unknown address 0x00000014 (pc 0x0810845f)",
+                                                    "    #0 0x810845e in foo /src/foo.cpp:1"], config)
+        self.assertRaises(RuntimeError, lambda: crashInfo.backtrace)
+        self.assertRaises(RuntimeError, lambda: crashInfo.crashAddress)
+        self.assertRaises(RuntimeError, crashInfo.createShortSignature)
+        self.assertFalse(crashInfo._parsed)
+        self.assertEqual(crashInfo._crashAddress, None)
+
+class StreamingCrashInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="crashinfo-tmp-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeFile(self, name, data):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'w') as f:
+            f.write(data)
+        return fileName
+
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+
+        # Noise before the trace must be preserved in the output, but not parsed
+        stderr = "#0 0x1 in noise\r\n" * 100 + asanTraceCrash
+        stdoutFile = self.writeFile("stdout", "foo\nbar\n")
+        stderrFile = self.writeFile("stderr", stderr)
+        emptyFile = self.writeFile("empty", "")
+
+        crashInfo = CrashInfo.fromFiles(stdoutFile, stderrFile, config)
+        rawCrashInfo = CrashInfo.fromRawCrashData(None, asanTraceCrash.splitlines(), config)
+        self.assertIsInstance(crashInfo, ASanCrashInfo)
+        self.assertEqual(crashInfo.rawStdout, ["foo", "bar"])
+        self.assertEqual(crashInfo.rawStderr, stderr.splitlines())
+        self.assertEqual(len(crashInfo.rawStderr), len(stderr.splitlines()))
+        self.assertEqual(crashInfo.rawStderr[0], "#0 0x1 in noise")
+        self.assertEqual(crashInfo.backtrace, rawCrashInfo.backtrace)
+        self.assertEqual(crashInfo.crashAddress, rawCrashInfo.crashAddress)
+
+        # Prefer crash data over stderr, also for streams that can't be mapped
+        crashInfo = CrashInfo.fromStreams(None, open(emptyFile), config, StringIO.StringIO(gdbSampleTrace1))
+        rawCrashInfo = CrashInfo.fromRawCrashData(None, [], config, gdbSampleTrace1.splitlines())
+        self.assertIsInstance(crashInfo, GDBCrashInfo)
+        self.assertEqual(crashInfo.rawStderr, [])
+        self.assertEqual(crashInfo.backtrace, rawCrashInfo.backtrace)
+        self.assertEqual(crashInfo.registers, rawCrashInfo.registers)
+
+        # Mapped output is only parsed up to the end of the ASan report
+        stderrFile = self.writeFile("stderr-trailing", asanTraceCrash + "    #5 0x1 in trailing noise\n" * 100)
+        crashInfo = CrashInfo.fromFiles(None, stderrFile, config)
+        self.assertEqual(crashInfo.backtrace, CrashInfo.fromRawCrashData(None, asanTraceCrash.splitlines(), config).backtrace)
+
+        crashInfo = CrashInfo.fromFiles(None, stdoutFile, config)
+        self.assertIsInstance(crashInfo, NoCrashInfo)
+        self.assertEqual(crashInfo.rawStderr.getText(), "foo\nbar")
+
 class CrashSignatureOutputTest(unittest.TestCase):
     def runTest(self):
         config = ProgramConfiguration("test", "x86-64", "linux")
@@ -544,6 +647,102 @@ class RegisterHelperValueTest(unittest.TestCase):
         self.assertEqual(RegisterHelper.getRegisterValue("bh", registerMap), 0x76L)
         self.assertEqual(RegisterHelper.getRegisterValue("bl", registerMap), 0x40L)
 
+class StringMatchRequiredLiteralsTest(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(StringMatch("foo::bar").getRequiredLiterals(), ["foo::bar"])
+        self.assertEqual(StringMatch("").getRequiredLiterals(), [])
+        
+        self.assertEqual(StringMatch("/^Assertion failure: .+, at .+:\\d+$/").getRequiredLiterals(), ["Assertion failure: ", ", at ", ":"])
+        self.assertEqual(StringMatch("/MOZ_CRASH\\(foo\\)/").getRequiredLiterals(), ["MOZ_CRASH(foo)"])
+        self.assertEqual(StringMatch("/abc?d/").getRequiredLiterals(), ["ab", "d"])
+        self.assertEqual(StringMatch("/ab+[cd]*e{2}f/").getRequiredLiterals(), ["ab", "f"])
+        self.assertEqual(StringMatch("/a(bc)?d/").getRequiredLiterals(), ["a", "d"])
+        
+        # Patterns we can't analyze yield nothing
+        self.assertEqual(StringMatch("/foo|bar/").getRequiredLiterals(), [])
+        self.assertEqual(StringMatch("/(?i)foo/").getRequiredLiterals(), [])
+
+class CompactCrashInfoTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86", "linux")
+
+        crashInfo1 = GDBCrashInfo(["foo", "", "bar\nbaz"], gdbSampleTrace1.splitlines(), config)
+        crashInfo2 = GDBCrashInfo([], gdbSampleTrace1.splitlines(), config)
+
+        # Raw output is kept in one buffer, but still behaves like a list of lines
+        self.assertEqual(len(crashInfo1.rawStdout), 3)
+        self.assertEqual(crashInfo1.rawStdout, ["foo", "", "bar\nbaz"])
+        self.assertEqual(crashInfo1.rawStdout[-1], "bar\nbaz")
+        self.assertEqual(crashInfo1.rawStdout[1:], ["", "bar\nbaz"])
+        self.assertEqual(crashInfo2.rawStdout, [])
+
+        # Identical function names are interned to the same symbol ids
+        self.assertEqual(crashInfo1.backtrace.symbolIds, crashInfo2.backtrace.symbolIds)
+        self.assertEqual(crashInfo1.backtrace[:2], ["internalAppend<js::ion::MDefinition*>", "append<js::ion::MDefinition*>"])
+        self.assertEqual(list(crashInfo1.backtrace), crashInfo2.backtrace)
+
+        cache = StringMatchCache(StringMatch("/^js::ion::MPhi/"))
+        symbolTable = crashInfo1.backtrace.symbolTable
+        self.assertTrue(cache.matchesSymbol(symbolTable, crashInfo1.backtrace.getSymbolId(2)))
+        self.assertFalse(cache.matchesSymbol(symbolTable, crashInfo1.backtrace.getSymbolId(0)))
+
+        self.assertFalse(hasattr(crashInfo1, "__dict__"))
+
+class SymbolTableRotationTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86-64", "linux")
+        oldMaxSize = SymbolTable.MAX_SYMBOL_TABLE_SIZE
+
+        try:
+            # Every backtrace fills the table, so the next one starts a new table
+            SymbolTable.MAX_SYMBOL_TABLE_SIZE = 1
+            crashInfo1 = GDBCrashInfo([], gdbSampleTrace1.splitlines(), config)
+            self.assertEqual(len(crashInfo1.backtrace), 8)
+            crashInfo2 = GDBCrashInfo([], gdbSampleTrace1.splitlines(), config)
+            self.assertEqual(len(crashInfo2.backtrace), 8)
+        finally:
+            SymbolTable.MAX_SYMBOL_TABLE_SIZE = oldMaxSize
+
+        self.assertFalse(crashInfo1.backtrace.symbolTable is crashInfo2.backtrace.symbolTable)
+        self.assertTrue(crashInfo2.backtrace.symbolTable is SymbolTable.getSymbolTable())
+
+        # Backtraces of the old table remain valid
+        self.assertEqual(crashInfo1.backtrace, crashInfo2.backtrace)
+        self.assertNotEqual(crashInfo1.backtrace.getKey(), crashInfo2.backtrace.getKey())
+
+        # Matching works for crashes of both tables at once
+        sig = CrashSignature('{"symptoms" : [ { "type" : "stackFrame", "frameNumber" : "< 4", "functionName" : "/^js::ion::MPhi/" } ] }')
+        self.assertEqual(list(sig.matchesMany([ crashInfo1, crashInfo2, crashInfo1 ])), [ True, True, True ])
+        sig = CrashSignature('{"symptoms" : [ { "type" : "stackFrames", "functionNames" : [ "?", "append<js::ion::MDefinition*>", "???" ] } ] }')
+        self.assertEqual(list(sig.matchesMany([ crashInfo1, crashInfo2 ])), [ True, True ])
+
+class CachedCrashInfoTest(unittest.TestCase):
+    def runTest(self):
+        config = ProgramConfiguration("test", "x86-64", "linux")
+
+        for (stderr, crashData) in ((["Assertion failure: foo, at bar.cpp:12"], gdbCrashAddress1), (asanTraceCrash, None), ("foo", None)):
+            crashInfo = CrashInfo.fromRawCrashData("out", stderr, config, crashData)
+            cacheObject = json.loads(json.dumps(crashInfo.toCacheObject()))
+            self.assertEqual(cacheObject["version"], PARSER_VERSION)
+
+            # Rebuilding from the parsed data must not parse the raw data again
+            cachedCrashInfo = CrashInfo.fromCacheObject(cacheObject, "out", stderr, config, crashData)
+            self.assertTrue(cachedCrashInfo._parsed)
+            self.assertTrue(cachedCrashInfo._assertionParsed)
+            self.assertIsInstance(cachedCrashInfo, type(crashInfo))
+            self.assertEqual(cachedCrashInfo.backtrace, crashInfo.backtrace)
+            self.assertEqual(cachedCrashInfo.registers, crashInfo.registers)
+            self.assertEqual(cachedCrashInfo.crashAddress, crashInfo.crashAddress)
+            self.assertEqual(cachedCrashInfo.crashInstruction, crashInfo.crashInstruction)
+            self.assertEqual(cachedCrashInfo.rawStdout, ["out"])
+            self.assertEqual(cachedCrashInfo.createShortSignature(), crashInfo.createShortSignature())
+            self.assertEqual(str(cachedCrashInfo.createCrashSignature()), str(crashInfo.createCrashSignature()))
+
+        self.assertEqual(cachedCrashInfo.assertion, None)
+
+        # Parsed data from other parser versions is discarded
+        cacheObject["version"] = PARSER_VERSION - 1
+        self.assertEqual(CrashInfo.fromCacheObject(cacheObject, "out", stderr, config), None)
 
 if __name__ == "__main__":
     unittest.main()
@@ -11,8 +11,11 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 @contact:    choller@mozilla.com
 '''
+import random
 import unittest
 from FTB import AssertionHelper
+from FTB.Signatures.LineBuffer import LineBuffer, MappedLineBuffer
+from FTB.Signatures.TestHelpers import legacyGetAssertion
 
 asanFFAbort = """[26289] ###!!! ASSERTION: Unexpected non-ASCII character: '!(*s2 & ~0x7F)', file ../../../dist/include/nsCharTraits.h, line 168
 Hit MOZ_CRASH() at /srv/repos/browser/mozilla-central/memory/mozalloc/mozalloc_abort.cpp:30
@@ -58,5 +61,42 @@ class AssertionHelperTestMozCrash(unittest.TestCase):
         
         self.assertEqual(sanitizedMsg, expectedMsg)
 
+class AssertionHelperTestReverseScan(unittest.TestCase):
+    def runTest(self):
+        lines = [
+                 "Assertion failure: foo, at bar.cpp:1",
+                 "[123] ###!!! ASSERTION: foo: 'x', file bar.cpp, line 1",
+                 "# Fatal error in foo",
+                 "==1==ERROR: AddressSanitizer: SEGV on unknown address 0x0",
+                 "ERROR: AddressSanitizer: Assertion failed",
+                 "Assertion `x' failed.",
+                 "*** glibc detected *** double free",
+                 "Hit MOZ_CRASH(oops) at foo.cpp:3",
+                 "Hit MOZ_CRASH() at foo.cpp:3",
+                 "[42] Running MOZ_CRASH test",
+                 "nothing to see here",
+                 "",
+                 ]
+
+        rng = random.Random(4)
+        for _ in range(2000):
+            output = [ rng.choice(lines) for _ in range(rng.randint(0, 8)) ]
+
+            for onlyProgramAssertions in (False, True):
+                expected = legacyGetAssertion(output, onlyProgramAssertions)
+                self.assertEqual(AssertionHelper.getAssertion(output, onlyProgramAssertions), expected)
+                self.assertEqual(AssertionHelper.getAssertion(LineBuffer(output), onlyProgramAssertions), expected)
+                self.assertEqual(AssertionHelper.getAssertion(MappedLineBuffer("".join([ line + "\r\n" for line in output ])), onlyProgramAssertions), expected)
+
+        # New assertion types can be registered without changing getAssertion
+        registry = AssertionHelper.AssertionDetectorRegistry()
+        for detector in AssertionHelper.assertionDetectors.detectors:
+            registry.register(detector)
+        registry.register(AssertionHelper.AssertionDetector("rust", ["panicked at"], "^thread '.+' panicked at", anchored=True, isTrueAssertion=True), 0)
+
+        output = [ "thread 'main' panicked at 'oops', src/main.rs:2", "==1==ERROR: AddressSanitizer: SEGV" ]
+        self.assertEqual(AssertionHelper.getAssertion(output, False, registry), output[0])
+        self.assertEqual(AssertionHelper.getAssertion(output, False), output[1])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,105 @@
+from crashmanager.models import CrashEntry, Bucket
+from django.core.cache import cache
+from django.db.models.aggregates import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch.dispatcher import receiver
+import hashlib
+import json
+
+# Maximum number of signatures that can be exported by one request
+MAX_EXPORT_COUNT = 100
+
+# Metadata that changes with every new crash in a bucket. It is exported, but
+# left out of the hash, so clients don't download signatures again just because
+# their buckets grew.
+VOLATILE_METADATA = ('size',)
+
+# Computing the manifest requires looking at all crash entries with testcases,
+# so it is cached for this many seconds (or until a bucket is changed).
+MANIFEST_CACHE_KEY = 'crashmanager.export.manifest'
+MANIFEST_CACHE_TIMEOUT = 60
+
+def getBucketMetadata(buckets):
+    '''
+    Compute the metadata exported along with the signatures of the given buckets.
+
+    The best entry of a bucket is the most recent of its entries with the smallest
+    testcase among those with the best testcase quality. Instead of querying the
+    best entry of every bucket separately, all entries with testcases are fetched
+    at once, ordered so the best entry of each bucket comes first.
+
+    @type buckets: QuerySet
+    @param buckets: Bucket objects to export
+
+    @rtype: list
+    @return: List of tuples (bucket, metadata dictionary)
+    '''
+    bestEntries = {}
+    entries = CrashEntry.objects.filter(bucket__in=buckets.values('pk'), testcase__isnull=False)
+    entries = entries.order_by('bucket', 'testcase__quality', 'testcase__size', '-created')
+    for (bucketPk, quality, size) in entries.values_list('bucket', 'testcase__quality', 'testcase__size').iterator():
+        if not bucketPk in bestEntries:
+            bestEntries[bucketPk] = (quality, size)
+
+    result = []
+    for bucket in buckets.select_related('bug').annotate(size=Count('crashentry')):
+        metadata = {}
+        metadata['size'] = bucket.size
+        metadata['shortDescription'] = bucket.shortDescription
+        metadata['frequent'] = bucket.frequent
+        if bucket.bug != None:
+            metadata['bug__id'] = bucket.bug.externalId
+
+        if bucket.pk in bestEntries:
+            (metadata['testcase__quality'], metadata['testcase__size']) = bestEntries[bucket.pk]
+
+        result.append((bucket, metadata))
+
+    return result
+
+def getExportedFiles(buckets):
+    '''
+    Get the contents of the signature and metadata files exported for the given
+    buckets, as well as a hash of both, which changes whenever any of the files
+    change (except for changes of L{VOLATILE_METADATA}).
+
+    @type buckets: QuerySet
+    @param buckets: Bucket objects to export
+
+    @rtype: list
+    @return: List of tuples (bucket, signature, metadata, hash)
+    '''
+    result = []
+    for (bucket, metadata) in getBucketMetadata(buckets):
+        stableMetadata = dict([(key, value) for (key, value) in metadata.items() if not key in VOLATILE_METADATA])
+        stableMetadata = json.dumps(stableMetadata, sort_keys=True)
+        exportHash = hashlib.sha1(bucket.signature.encode("utf-8") + "\0" + stableMetadata).hexdigest()
+        result.append((bucket, bucket.signature, json.dumps(metadata, indent=4, sort_keys=True), exportHash))
+
+    return result
+
+def getManifest():
+    '''
+    Get the manifest of all exported signatures, used by clients to only
+    download the signatures that changed since they last refreshed.
+
+    The manifest is cached, see L{MANIFEST_CACHE_TIMEOUT}, so clients polling
+    for changes don't cause a scan of all crash entries every time.
+
+    @rtype: tuple
+    @return: Tuple (manifest, etag). The manifest maps the bucket id (as string)
+             to the hash of its exported files, the etag identifies the manifest.
+    '''
+    result = cache.get(MANIFEST_CACHE_KEY)
+    if result == None:
+        manifest = dict([(str(bucket.pk), exportHash) for (bucket, _, _, exportHash) in getExportedFiles(Bucket.objects.all())])
+        etag = '"%s"' % hashlib.sha1(json.dumps(manifest, sort_keys=True)).hexdigest()
+        result = (manifest, etag)
+        cache.set(MANIFEST_CACHE_KEY, result, MANIFEST_CACHE_TIMEOUT)
+    return result
+
+# Changed signatures show up in the manifest right away, at least with a cache shared by all processes
+@receiver(post_save, sender=Bucket)
+@receiver(post_delete, sender=Bucket)
+def Bucket_invalidateManifest(sender, instance, **kwargs):
+    cache.delete(MANIFEST_CACHE_KEY)
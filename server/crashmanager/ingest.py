@@ -0,0 +1,179 @@
+from crashmanager.models import CrashEntry, Platform, Product, OS, Client, Tool
+from crashmanager.serializers import createOrGetModelByName, createTestCase
+from django.db import IntegrityError, transaction
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures.CrashInfo import CrashInfo
+import json
+
+# Maximum number of crashes accepted by one bulk submission
+MAX_BULK_SIZE = 1000
+
+# Fields every submitted crash must have, see CrashEntrySerializer
+REQUIRED_FIELDS = ('rawStdout', 'rawStderr', 'rawCrashData', 'platform', 'product', 'os', 'client', 'tool')
+
+# Maximum lengths of the fields stored in limited columns, see CrashEntrySerializer
+MAX_FIELD_LENGTHS = (('platform', 63), ('product', 63), ('product_version', 63), ('os', 63), ('client', 255),
+                     ('tool', 63), ('idempotency_key', 64))
+
+# Optional fields stored as given, see CrashEntrySerializer
+STRING_FIELDS = ('metadata', 'env', 'args', 'testcase', 'testcase_ext')
+
+class BulkSubmissionError(Exception):
+    def __init__(self, index, message):
+        '''
+        @type index: int
+        @param index: Index of the submission that is invalid
+        @type message: string
+        @param message: What is wrong with it
+        '''
+        Exception.__init__(self, "Submission %s: %s" % (index, message))
+        self.index = index
+
+def parseBulkSubmissions(body):
+    '''
+    Parse the body of a bulk submission, either a JSON array or
+    newline delimited JSON objects (NDJSON).
+
+    @type body: string
+    @param body: The request body
+
+    @rtype: list
+    @return: List of submissions, each a dictionary like the data
+             accepted by CrashEntrySerializer
+    '''
+    body = body.strip()
+
+    if body.startswith("["):
+        try:
+            submissions = json.loads(body)
+        except ValueError, e:
+            raise BulkSubmissionError(0, "Malformed JSON: %s" % e)
+    else:
+        submissions = []
+        for (idx, line) in enumerate([line for line in body.splitlines() if line.strip()]):
+            try:
+                submissions.append(json.loads(line))
+            except ValueError, e:
+                raise BulkSubmissionError(idx, "Malformed JSON: %s" % e)
+
+    for (idx, submission) in enumerate(submissions):
+        if not isinstance(submission, dict):
+            raise BulkSubmissionError(idx, "Not a JSON object")
+
+        for field in REQUIRED_FIELDS:
+            if not isinstance(submission.get(field), basestring):
+                raise BulkSubmissionError(idx, "Missing field %s" % field)
+
+        for (field, maxLength) in MAX_FIELD_LENGTHS:
+            value = submission.get(field)
+            if value == None:
+                continue
+            if not isinstance(value, basestring):
+                raise BulkSubmissionError(idx, "Field %s must be a string" % field)
+            if len(value) > maxLength:
+                raise BulkSubmissionError(idx, "Field %s is longer than %s characters" % (field, maxLength))
+
+        for field in STRING_FIELDS:
+            value = submission.get(field)
+            if value != None and not isinstance(value, basestring):
+                raise BulkSubmissionError(idx, "Field %s must be a string" % field)
+
+        if not isinstance(submission.get('testcase_isbinary', False), bool):
+            raise BulkSubmissionError(idx, "Field testcase_isbinary must be a boolean")
+
+    return submissions
+
+def createCrashEntries(submissions):
+    '''
+    Create crash entries for the given submissions in one transaction. Unlike
+    submitting every crash with CrashEntrySerializer, the products, platforms,
+    operating systems, clients and tools are looked up once per batch and the
+    entries are inserted with one query (per database batch). Submissions whose
+    idempotency key is already known are skipped.
+
+    @type submissions: list
+    @param submissions: Submissions as returned by L{parseBulkSubmissions}
+
+    @rtype: tuple
+    @return: Tuple (number of entries created, number of duplicates skipped)
+    '''
+    try:
+        return _createCrashEntries(submissions)
+    except IntegrityError:
+        # Some of the submissions were stored concurrently (e.g. by a retry of this
+        # request), they are skipped as duplicates now that they are visible to us.
+        return _createCrashEntries(submissions)
+
+def _createCrashEntries(submissions):
+    # Skip the submissions we already stored, as well as duplicates within this batch
+    keys = [submission['idempotency_key'] for submission in submissions if submission.get('idempotency_key')]
+    seenKeys = set(CrashEntry.objects.filter(idempotencyKey__in=keys).values_list('idempotencyKey', flat=True))
+
+    # Caches of the related objects, by their attributes
+    relatedObjects = {}
+    def getRelatedObject(model, attrs):
+        cacheKey = (model, tuple(sorted(attrs.items())))
+        if not cacheKey in relatedObjects:
+            relatedObjects[cacheKey] = createOrGetModelByName(model, attrs)
+        return relatedObjects[cacheKey]
+
+    entries = []
+    duplicates = 0
+
+    # Testcase files aren't removed when the transaction is rolled back
+    testCases = []
+
+    try:
+        with transaction.atomic():
+            for (idx, submission) in enumerate(submissions):
+                idempotencyKey = submission.get('idempotency_key') or None
+                if idempotencyKey != None:
+                    if idempotencyKey in seenKeys:
+                        duplicates += 1
+                        continue
+                    seenKeys.add(idempotencyKey)
+
+                product_version = submission.get('product_version') or None
+
+                entry = CrashEntry(rawStdout=submission['rawStdout'], rawStderr=submission['rawStderr'],
+                                   rawCrashData=submission['rawCrashData'], metadata=submission.get('metadata', ''),
+                                   env=submission.get('env', ''), args=submission.get('args', ''),
+                                   idempotencyKey=idempotencyKey)
+
+                configuration = ProgramConfiguration(submission['product'], submission['platform'], submission['os'], product_version)
+                crashInfo = CrashInfo.fromRawCrashData(submission['rawStdout'], submission['rawStderr'], configuration,
+                                                       submission['rawCrashData'])
+
+                # The crash is parsed on first access, which fails for malformed traces
+                try:
+                    if crashInfo.crashAddress != None:
+                        entry.crashAddress = hex(crashInfo.crashAddress)
+                    entry.shortSignature = crashInfo.createShortSignature()
+                    entry.cachedCrashInfo = json.dumps(crashInfo.toCacheObject(), separators=(",", ":"))
+                except RuntimeError, e:
+                    raise BulkSubmissionError(idx, str(e))
+
+                entry.product = getRelatedObject(Product, { 'name' : submission['product'], 'version' : product_version })
+                entry.platform = getRelatedObject(Platform, { 'name' : submission['platform'] })
+                entry.os = getRelatedObject(OS, { 'name' : submission['os'] })
+                entry.client = getRelatedObject(Client, { 'name' : submission['client'] })
+                entry.tool = getRelatedObject(Tool, { 'name' : submission['tool'] })
+
+                if submission.get('testcase'):
+                    try:
+                        entry.testcase = createTestCase(submission['testcase'], submission.get('testcase_ext'),
+                                                        int(submission.get('testcase_quality', 0)),
+                                                        submission.get('testcase_isbinary', False))
+                    except (RuntimeError, TypeError, ValueError), e:
+                        raise BulkSubmissionError(idx, str(e))
+                    testCases.append(entry.testcase)
+
+                entries.append(entry)
+
+            CrashEntry.objects.bulk_create(entries)
+    except Exception:
+        for testCase in testCases:
+            testCase.test.delete(save=False)
+        raise
+
+    return (len(entries), duplicates)
@@ -0,0 +1,39 @@
+from django.core.management.base import NoArgsCommand
+from crashmanager.models import CrashEntry, Bucket
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.SignatureProfiler import SignatureProfiler
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = "Matches all buckets against a sample of crash entries and prints the buckets that are slowest to evaluate."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--entries', dest='entries', type='int', default=1000,
+                    help='Number of most recent crash entries to match (default is 1000)'),
+        make_option('--limit', dest='limit', type='int', default=20,
+                    help='Number of buckets to report (default is 20)'),
+    )
+
+    def handle_noargs(self, **options):
+        entries = list(CrashEntry.objects.order_by('-created')[:options['entries']])
+        buckets = list(Bucket.objects.all())
+
+        # Use our own signature objects, so the shared ones aren't slowed down
+        profiler = SignatureProfiler()
+        signatures = []
+        for bucket in buckets:
+            signature = CrashSignature(bucket.signature)
+            signature.enableProfiling(profiler, bucket.pk)
+            signatures.append(signature)
+
+        needTest = any([signature.matchRequiresTest() for signature in signatures])
+        crashInfos = [entry.getCrashInfo(attachTestcase=needTest) for entry in entries]
+
+        # Match every crash individually, like triage does for its candidates
+        for signature in signatures:
+            for crashInfo in crashInfos:
+                signature.matches(crashInfo)
+
+        descriptions = dict([(bucket.pk, bucket.shortDescription) for bucket in buckets])
+
+        self.stdout.write("Matched %s buckets against %s crash entries." % (len(buckets), len(entries)))
+        self.stdout.write(profiler.formatReport(options['limit'], descriptions))
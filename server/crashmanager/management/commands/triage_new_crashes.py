@@ -1,19 +1,19 @@
 from django.core.management.base import NoArgsCommand
 from crashmanager.models import CrashEntry, Bucket
 from crashmanager.management.common import mgmt_lock_required
+from crashmanager.triage import assignCrashEntries
+from optparse import make_option
 
 class Command(NoArgsCommand):
     help = "Iterates over all unbucketed crash entries and tries to assign them into the existing buckets."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=None,
+                    help='Number of worker processes (default is the number of CPUs)'),
+    )
+
     @mgmt_lock_required
     def handle_noargs(self, **options):
         entries = CrashEntry.objects.filter(bucket=None)
         buckets = Bucket.objects.all()
-    
-        for bucket in buckets:
-            signature = bucket.getSignature()
-            needTest = signature.matchRequiresTest()
-            
-            for entry in entries:
-                if signature.matches(entry.getCrashInfo(attachTestcase=needTest)):
-                    entry.bucket = bucket
-                    entry.save()
\ No newline at end of file
+        
+        assignCrashEntries(entries, buckets, processes=options['processes'])
@@ -0,0 +1,12 @@
+from django.core.management.base import NoArgsCommand
+from crashmanager.models import CrashEntry
+from crashmanager.management.common import mgmt_lock_required
+from crashmanager.triage import updateCrashInfo
+
+class Command(NoArgsCommand):
+    help = ("Stores the parsed crash information of all crash entries that don't have it yet "
+            "or whose crash information was created by a different parser version.")
+
+    @mgmt_lock_required
+    def handle_noargs(self, **options):
+        updateCrashInfo(CrashEntry.objects.all())
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crashmanager', '0006_user_defaultproviderid'),
+    ]
+
+    # Existing entries get their crash information with the update_crash_info command
+    operations = [
+        migrations.AddField(
+            model_name='crashentry',
+            name='cachedCrashInfo',
+            field=models.TextField(null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from FTB.Signatures.CrashSignature import CrashSignature
+
+def computeSignatureHashes(apps, schema_editor):
+    Bucket = apps.get_model('crashmanager', 'Bucket')
+    for bucket in Bucket.objects.all():
+        try:
+            bucket.signatureHash = CrashSignature.getSignatureHash(bucket.signature)
+        except RuntimeError:
+            # Invalid signatures can't have equivalents
+            continue
+        bucket.save(update_fields=['signatureHash'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crashmanager', '0007_crashentry_cachedcrashinfo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bucket',
+            name='signatureHash',
+            field=models.CharField(db_index=True, max_length=40, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(computeSignatureHashes, lambda apps, schema_editor: None),
+    ]
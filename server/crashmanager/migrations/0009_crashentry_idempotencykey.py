@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crashmanager', '0008_bucket_signaturehash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crashentry',
+            name='idempotencyKey',
+            field=models.CharField(max_length=64, unique=True, null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -6,8 +6,10 @@ from django.db.models.signals import post_delete
 from django.dispatch.dispatcher import receiver
 from django.contrib.auth.models import User as DjangoUser
 
-from FTB.Signatures.CrashSignature import CrashSignature
 from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.LineBuffer import MappedLineBuffer
+from FTB.Signatures.SignatureCache import signatureCache
 from FTB.ProgramConfiguration import ProgramConfiguration
 
 import json
@@ -36,6 +38,9 @@ class TestCase(models.Model):
         # This variable can hold the testcase data temporarily
         self.content = None
         
+        # Lines of the stored test, see getTestLines
+        self.testLines = None
+        
         # For performance reasons we do not load the test here
         # automatically. You must call the loadTest method if you
         # want to access the test content
@@ -47,11 +52,20 @@ class TestCase(models.Model):
         self.content = self.test.read()
         self.test.close()
         
+    def getTestLines(self):
+        # Provide the lines of the stored test without reading all of it,
+        # large tests are memory mapped. The lines are kept, so matching
+        # the test against multiple signatures only opens it once.
+        if self.testLines == None:
+            self.testLines = MappedLineBuffer.fromFile(self.test.path)
+        return self.testLines
+        
     def storeTestAndSave(self):
         self.size = len(self.content)
         self.test.open(mode='w')
         self.test.write(self.content)
         self.test.close()
+        self.testLines = None
         self.save()
 
 class Client(models.Model):
@@ -80,17 +94,57 @@ class Bucket(models.Model):
     signature = models.TextField()
     shortDescription = models.CharField(max_length=1023, blank=True)
     frequent = models.BooleanField(blank=False, default=False)
+    
+    # Hash of the canonical signature (see CrashSignature.getSignatureHash),
+    # used to find buckets with equivalent signatures.
+    signatureHash = models.CharField(max_length=40, blank=True, db_index=True)
 
+    def __init__(self, *args, **kwargs):
+        super(Bucket, self).__init__(*args, **kwargs)
+        
+        # Remember the signature we were loaded with, so we can drop
+        # it from the signature cache if it is changed.
+        self.loadedSignature = self.signature
+        self.loadedSignatureHash = self.signatureHash
     
     def getSignature(self):
-        return CrashSignature(self.signature)
+        # The returned signature is shared through the cache, don't modify it
+        return signatureCache.getSignature(self.signature)
+    
+    def getDuplicate(self):
+        '''
+        Find another bucket with a signature equivalent to ours. Only new
+        buckets and buckets whose signature changed its meaning are checked,
+        so existing buckets can still be edited even if they are equivalent.
+        
+        @rtype: Bucket
+        @return: Another bucket with an equivalent signature, or None
+        '''
+        signatureHash = CrashSignature.getSignatureHash(self.signature)
+        if self.pk != None and signatureHash == self.loadedSignatureHash:
+            return None
+        
+        duplicates = Bucket.objects.filter(signatureHash=signatureHash)
+        if self.pk != None:
+            duplicates = duplicates.exclude(pk=self.pk)
+        return duplicates.first()
     
     def save(self, *args, **kwargs):
-        # Sanitize signature line endings so we end up with the same hash
-        # TODO: We might want to just parse the JSON here, and re-serialize
-        # it to a canonical string representation.
+        # Keep the signature as entered for readability, but store the hash
+        # of its canonical form so equivalent signatures can be found.
         self.signature = self.signature.replace(r"\r\n", r"\n")
+        self.signatureHash = CrashSignature.getSignatureHash(self.signature)
         super(Bucket, self).save(*args, **kwargs)
+        
+        if self.loadedSignature and self.loadedSignature != self.signature:
+            signatureCache.invalidate(self.loadedSignature)
+        self.loadedSignature = self.signature
+        self.loadedSignatureHash = self.signatureHash
+
+# Drop signatures of deleted buckets from the signature cache
+@receiver(post_delete, sender=Bucket)
+def Bucket_delete(sender, instance, **kwargs):
+    signatureCache.invalidate(instance.signature)
 
 class CrashEntry(models.Model):
     created = models.DateTimeField(default=timezone.now)
@@ -110,6 +164,13 @@ class CrashEntry(models.Model):
     crashAddress = models.CharField(max_length=255, blank=True)
     shortSignature = models.CharField(max_length=255, blank=True)
     
+    # Parsed crash information in the form of CrashInfo.toCacheObject, stored as JSON
+    cachedCrashInfo = models.TextField(blank=True, null=True)
+    
+    # Chosen by the client for every submission, so a submission that is
+    # retried after a failure doesn't create a second entry.
+    idempotencyKey = models.CharField(max_length=64, blank=True, null=True, unique=True)
+    
     def __init__(self, *args, **kwargs):
         # These variables can hold temporarily deserialized data
         self.argsList = None
@@ -122,6 +183,9 @@ class CrashEntry(models.Model):
         
         super(CrashEntry, self).__init__(*args, **kwargs)
         
+        # Remember the raw data our cached crash information belongs to,
+        # so we know when it is outdated because the raw data was changed.
+        self.cachedRawData = (self.rawStdout, self.rawStderr, self.rawCrashData)
         
     def save(self, *args, **kwargs):
         # Reserialize data, then call regular save method
@@ -136,6 +200,12 @@ class CrashEntry(models.Model):
             metadataDict = dict([x.split("=", 1) for x in self.metadataList])
             self.metadata = json.dumps(metadataDict)
         
+        # Make sure we store crash information matching our raw data. Existing
+        # entries without crash information are left to the update_crash_info
+        # command, so saving them doesn't depend on parsing their crash data.
+        if (self.pk == None and not self.cachedCrashInfo) or not self.hasCachedRawData():
+            self.getCrashInfo()
+        
         super(CrashEntry, self).save(*args, **kwargs)
     
     def deserializeFields(self):
@@ -151,15 +221,54 @@ class CrashEntry(models.Model):
             self.metadataList = ["%s=%s" % (s,metadataDict[s]) for s in metadataDict.keys()]
     
     
-    def getCrashInfo(self, attachTestcase=False):
-        # TODO: This should be cached at some level
+    def hasCachedRawData(self):
+        return self.cachedRawData == (self.rawStdout, self.rawStderr, self.rawCrashData)
+    
+    def getCrashInfo(self, attachTestcase=False, updateCache=False):
+        '''
+        Get the crash information of this entry, from the stored parsed crash
+        information if it is still valid.
+        
+        @type attachTestcase: bool
+        @param attachTestcase: Attach the testcase (loaded on first access)
+        @type updateCache: bool
+        @param updateCache: If the stored crash information is outdated (it was
+                            created by a different parser version), store the
+                            new one right away. Otherwise, it is only stored
+                            the next time the entry is saved.
+        
+        @rtype: CrashInfo
+        @return: The crash information
+        '''
         # TODO: Need to include environment and program arguments here
         configuration = ProgramConfiguration(self.product.name, self.platform.name, self.os.name, self.product.version)
-        crashInfo = CrashInfo.fromRawCrashData(self.rawStdout, self.rawStderr, configuration, self.rawCrashData)
+        
+        crashInfo = None
+        rawDataChanged = not self.hasCachedRawData()
+        
+        # Use the parsed crash information stored with the entry, unless the
+        # raw data has changed or it was created by a different parser version.
+        if self.cachedCrashInfo and not rawDataChanged:
+            crashInfo = CrashInfo.fromCacheObject(json.loads(self.cachedCrashInfo), self.rawStdout,
+                                                  self.rawStderr, configuration, self.rawCrashData)
+        
+        if crashInfo == None:
+            crashInfo = CrashInfo.fromRawCrashData(self.rawStdout, self.rawStderr, configuration, self.rawCrashData)
+            try:
+                self.cachedCrashInfo = json.dumps(crashInfo.toCacheObject(), separators=(",", ":"))
+            except RuntimeError:
+                # Crash data that fails to parse has no crash information to store,
+                # the error is raised again once the crash information is used.
+                self.cachedCrashInfo = None
+            self.cachedRawData = (self.rawStdout, self.rawStderr, self.rawCrashData)
+            
+            # Changed raw data is stored along with the new crash information once we are saved
+            if updateCache and self.pk != None and not rawDataChanged and self.cachedCrashInfo:
+                CrashEntry.objects.filter(pk=self.pk).update(cachedCrashInfo=self.cachedCrashInfo)
         
         if attachTestcase and self.testcase != None and not self.testcase.isBinary:
-            self.testcase.loadTest()
-            crashInfo.testcase = self.testcase.content
+            # The test is only read once a signature actually needs it
+            crashInfo.testcase = self.testcase.getTestLines
         
         return crashInfo
 
@@ -8,6 +8,64 @@ from FTB.ProgramConfiguration import ProgramConfiguration
 from django.core.files.base import ContentFile
 import hashlib
 import base64
+import json
+
+def createOrGetModelByName(model, attrs):
+    '''
+    Generically determine if the given model with the given attributes
+    already exists in our database. If so, return that object, otherwise
+    create it on the fly.
+    
+    @type model: Class
+    @param model: The model to use for filtering and instantiating
+    
+    @type attrs: dict
+    @param attrs: Dictionary of attributes to use for filtering/instantiating
+    
+    @rtype: model
+    @return The model instance
+    '''
+    objs = model.objects.filter(**attrs)
+          
+    if len(objs) > 1:
+        raise MultipleObjectsReturned("Multiple objects with same keyword combination in database!")
+
+    if len(objs) == 0:
+        dbobj = model(**attrs)
+        dbobj.save()
+        return dbobj
+    else:
+        return objs.first()
+
+def createTestCase(testcase, testcase_ext, testcase_quality, testcase_isbinary):
+    '''
+    Store a submitted testcase and create the TestCase object for it.
+    
+    @type testcase: string
+    @param testcase: The testcase, base64 encoded if it is binary
+    
+    @type testcase_ext: string
+    @param testcase_ext: File extension of the testcase
+    
+    @rtype: TestCase
+    @return The saved TestCase instance
+    '''
+    if testcase_ext == None:
+        raise RuntimeError("Must provide testcase extension when providing testcase")
+    
+    if testcase_isbinary:
+        testcase = base64.b64decode(testcase)
+    
+    h = hashlib.new('sha1')
+    if testcase_isbinary:
+        h.update(str(testcase))
+    else:
+        h.update(repr(testcase))
+
+    dbobj = TestCase(quality=testcase_quality, isBinary=testcase_isbinary, size=len(testcase))
+    dbobj.test.save("%s.%s" % (h.hexdigest(), testcase_ext), ContentFile(testcase))
+    dbobj.save()
+    return dbobj
 
 class CrashEntrySerializer(serializers.ModelSerializer):
     # We need to redefine several fields explicitly because we flatten our
@@ -24,6 +82,7 @@ class CrashEntrySerializer(serializers.ModelSerializer):
     testcase_ext = serializers.CharField(required=False, write_only=True)
     testcase_quality = serializers.CharField(required=False, default=0, write_only=True)
     testcase_isbinary = serializers.BooleanField(required=False, default=False, write_only=True)
+    idempotency_key = serializers.CharField(max_length=64, required=False, write_only=True)
 
     class Meta:
         model = CrashEntry
@@ -31,7 +90,7 @@ class CrashEntrySerializer(serializers.ModelSerializer):
                   'rawStdout', 'rawStderr', 'rawCrashData', 'metadata', 
                   'testcase', 'testcase_ext', 'testcase_quality', 'testcase_isbinary',
                   'platform', 'product', 'product_version', 'os', 'client', 'tool', 
-                  'env', 'args'
+                  'env', 'args', 'idempotency_key'
                   )
 
     def to_native(self, obj):
@@ -70,6 +129,11 @@ class CrashEntrySerializer(serializers.ModelSerializer):
             # Not allowed to update existing instances
             return instance
         
+        # Retried submissions are handled by CrashEntryViewSet.create
+        idempotency_key = attrs.pop('idempotency_key', None)
+        if idempotency_key:
+            attrs['idempotencyKey'] = idempotency_key
+        
         product = attrs.pop('product', None)
         product_version = attrs.pop('product_version', None)
         platform = attrs.pop('platform', None)
@@ -89,33 +153,7 @@ class CrashEntrySerializer(serializers.ModelSerializer):
         if crashInfo.crashAddress != None:
             attrs['crashAddress'] = hex(crashInfo.crashAddress)
         attrs['shortSignature'] = crashInfo.createShortSignature()
-        
-        def createOrGetModelByName(model, attrs):
-            '''
-            Generically determine if the given model with the given attributes
-            already exists in our database. If so, return that object, otherwise
-            create it on the fly.
-            
-            @type model: Class
-            @param model: The model to use for filtering and instantiating
-            
-            @type attrs: dict
-            @param attrs: Dictionary of attributes to use for filtering/instantiating
-            
-            @rtype: model
-            @return The model instance
-            '''
-            objs = model.objects.filter(**attrs)
-                  
-            if len(objs) > 1:
-                raise MultipleObjectsReturned("Multiple objects with same keyword combination in database!")
-        
-            if len(objs) == 0:
-                dbobj = model(**attrs)
-                dbobj.save()
-                return dbobj
-            else:
-                return objs.first()
+        attrs['cachedCrashInfo'] = json.dumps(crashInfo.toCacheObject(), separators=(",", ":"))
         
         # Get or instantiate objects for product, platform, os, client and tool
         attrs['product'] = createOrGetModelByName(Product, { 'name' : product, 'version' : product_version })
@@ -126,22 +164,7 @@ class CrashEntrySerializer(serializers.ModelSerializer):
 
         # If a testcase is supplied, create a testcase object and store it
         if testcase:
-            if testcase_ext == None:
-                raise RuntimeError("Must provide testcase extension when providing testcase")
-            
-            if testcase_isbinary:
-                testcase = base64.b64decode(testcase)
-            
-            h = hashlib.new('sha1')
-            if testcase_isbinary:
-                h.update(str(testcase))
-            else:
-                h.update(repr(testcase))
-
-            dbobj = TestCase(quality=testcase_quality, isBinary=testcase_isbinary, size=len(testcase))
-            dbobj.test.save("%s.%s" % (h.hexdigest(), testcase_ext), ContentFile(testcase))
-            dbobj.save()
-            attrs['testcase'] = dbobj
+            attrs['testcase'] = createTestCase(testcase, testcase_ext, testcase_quality, testcase_isbinary)
         else:
             attrs['testcase'] = None
         
@@ -153,4 +176,4 @@ class BucketSerializer(serializers.ModelSerializer):
     bug = serializers.SlugRelatedField(slug_field="externalId")
     class Meta:
         model = Bucket
-        fields = ('bug', 'signature')
+        fields = ('bug', 'signature', 'signatureHash')
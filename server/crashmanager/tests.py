@@ -1,3 +1,385 @@
-from django.test import TestCase
+'''
+Tests
 
-# Create your tests here.
+@author:     Christian Holler (:decoder)
+
+@license:
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+@contact:    choller@mozilla.com
+'''
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase as DjangoTestCase
+from rest_framework.authtoken.models import Token
+import json
+import os
+
+from crashmanager import triage
+from crashmanager.export import MAX_EXPORT_COUNT
+from crashmanager.ingest import MAX_BULK_SIZE
+from crashmanager.models import Bucket, CrashEntry, Platform, Product, OS, Client, Tool, TestCase
+from FTB.Signatures.CrashInfo import PARSER_VERSION
+from FTB.Signatures.CrashSignature import CrashSignature
+from FTB.Signatures.LineBuffer import LineBuffer
+
+asanTraceCrash = """ASAN:SIGSEGV
+=================================================================
+==5328==ERROR: AddressSanitizer: SEGV on unknown address 0x00000014 (pc 0x0810845f sp 0xffc57860 bp 0xffc57f18 T0)
+    #0 0x810845e in js::AbstractFramePtr::asRematerializedFrame() const /srv/repos/mozilla-central/js/src/shell/../jit/RematerializedFrame.h:114
+    #1 0x810845e in js::AbstractFramePtr::script() const /srv/repos/mozilla-central/js/src/shell/../vm/Stack-inl.h:572
+    #2 0x810845e in EvalFrame(JSContext*, unsigned int, JS::Value*) /srv/repos/mozilla-central/js/src/shell/js.cpp:2655
+"""
+
+testSignature1 = '''{"symptoms" : [ { "type" : "stackFrame", "functionName" : "EvalFrame", "frameNumber" : 2 } ] }'''
+testSignature1Reformatted = '''{
+  "symptoms": [
+    {
+      "frameNumber": 2,
+      "functionName": "EvalFrame",
+      "type": "stackFrame"
+    }
+  ]
+}'''
+testSignature2 = '''{"symptoms" : [ { "type" : "crashAddress", "address" : "< 0x100" } ] }'''
+
+def createCrashEntry(rawStderr="", rawCrashData="", bucket=None, **kwargs):
+    '''
+    Create a crash entry of a fixed product, platform and os for testing.
+
+    @rtype: CrashEntry
+    @return: The saved crash entry
+    '''
+    (product, _) = Product.objects.get_or_create(name="mozilla-central", version="ba0bc4f26681")
+    (platform, _) = Platform.objects.get_or_create(name="x86")
+    (os, _) = OS.objects.get_or_create(name="linux")
+    (client, _) = Client.objects.get_or_create(name="client1")
+    (tool, _) = Tool.objects.get_or_create(name="tool1")
+
+    entry = CrashEntry(product=product, platform=platform, os=os, client=client, tool=tool, bucket=bucket,
+                       rawStdout="", rawStderr=rawStderr, rawCrashData=rawCrashData, **kwargs)
+    entry.save()
+    return entry
+
+class CrashEntryCachedCrashInfoTest(DjangoTestCase):
+    def runTest(self):
+        entry = createCrashEntry(rawCrashData=asanTraceCrash)
+        self.assertEqual(json.loads(entry.cachedCrashInfo)["version"], PARSER_VERSION)
+
+        # Loaded entries use the stored crash information instead of parsing the raw data
+        entry = CrashEntry.objects.get(pk=entry.pk)
+        crashInfo = entry.getCrashInfo()
+        self.assertTrue(crashInfo._parsed)
+        self.assertEqual(crashInfo.crashAddress, 0x14)
+        self.assertEqual(crashInfo.backtrace[0], "js::AbstractFramePtr::asRematerializedFrame() const")
+
+        # Edited raw data invalidates the stored crash information, the new one is stored on save
+        entry.rawCrashData = asanTraceCrash.replace("0x00000014", "0x00000018")
+        self.assertEqual(entry.getCrashInfo().crashAddress, 0x18)
+        self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry.pk).cachedCrashInfo)["crashAddress"], 0x14)
+        entry.save()
+        self.assertEqual(CrashEntry.objects.get(pk=entry.pk).getCrashInfo().crashAddress, 0x18)
+
+        # Crash information of a different parser version is discarded
+        outdated = json.loads(entry.cachedCrashInfo)
+        outdated["version"] = PARSER_VERSION - 1
+        outdated["crashAddress"] = 0x1234
+        CrashEntry.objects.filter(pk=entry.pk).update(cachedCrashInfo=json.dumps(outdated))
+
+        entry = CrashEntry.objects.get(pk=entry.pk)
+        crashInfo = entry.getCrashInfo()
+        self.assertEqual(crashInfo.crashAddress, 0x18)
+
+        # Readers only store the new crash information if they ask for it
+        self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry.pk).cachedCrashInfo)["version"], PARSER_VERSION - 1)
+
+        entry = CrashEntry.objects.get(pk=entry.pk)
+        entry.getCrashInfo(updateCache=True)
+        cacheObject = json.loads(CrashEntry.objects.get(pk=entry.pk).cachedCrashInfo)
+        self.assertEqual(cacheObject["version"], PARSER_VERSION)
+        self.assertEqual(cacheObject["crashAddress"], 0x18)
+
+        # Saving doesn't depend on parsing the crash data, neither for entries
+        # without crash information nor for raw data that fails to parse.
+        brokenTraceCrash = asanTraceCrash.replace("    #1", "    #3")
+        CrashEntry.objects.filter(pk=entry.pk).update(cachedCrashInfo=None, rawCrashData=brokenTraceCrash)
+        entry = CrashEntry.objects.get(pk=entry.pk)
+        entry.shortSignature = "edited"
+        entry.save()
+        self.assertEqual(CrashEntry.objects.get(pk=entry.pk).shortSignature, "edited")
+
+        entry = createCrashEntry(rawCrashData=brokenTraceCrash)
+        self.assertEqual(entry.cachedCrashInfo, None)
+        self.assertRaises(RuntimeError, lambda: entry.getCrashInfo().backtrace)
+
+        entry.rawCrashData = asanTraceCrash
+        entry.save()
+        self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry.pk).cachedCrashInfo)["crashAddress"], 0x14)
+
+class UpdateCrashInfoTest(DjangoTestCase):
+    def runTest(self):
+        entry1 = createCrashEntry(rawCrashData=asanTraceCrash)
+        entry2 = createCrashEntry(rawCrashData=asanTraceCrash.replace("0x00000014", "0x00000018"))
+        entry3 = createCrashEntry(rawCrashData=asanTraceCrash.replace("    #1", "    #3"))
+
+        outdated = json.loads(entry2.cachedCrashInfo)
+        outdated["version"] = PARSER_VERSION - 1
+        CrashEntry.objects.filter(pk=entry1.pk).update(cachedCrashInfo=None)
+        CrashEntry.objects.filter(pk=entry2.pk).update(cachedCrashInfo=json.dumps(outdated))
+
+        # Only missing or outdated crash information is stored, crashes
+        # that fail to parse are skipped.
+        self.assertEqual(triage.updateCrashInfo(CrashEntry.objects.all(), chunkSize=1), 2)
+        self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry1.pk).cachedCrashInfo)["crashAddress"], 0x14)
+        cacheObject = json.loads(CrashEntry.objects.get(pk=entry2.pk).cachedCrashInfo)
+        self.assertEqual(cacheObject["version"], PARSER_VERSION)
+        self.assertEqual(cacheObject["crashAddress"], 0x18)
+        self.assertEqual(CrashEntry.objects.get(pk=entry3.pk).cachedCrashInfo, None)
+
+        self.assertEqual(triage.updateCrashInfo(CrashEntry.objects.all()), 0)
+
+        CrashEntry.objects.filter(pk=entry1.pk).update(cachedCrashInfo=None)
+        call_command("update_crash_info")
+        self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry1.pk).cachedCrashInfo)["crashAddress"], 0x14)
+
+class BucketDuplicateTest(DjangoTestCase):
+    def runTest(self):
+        bucket1 = Bucket(signature=testSignature1, shortDescription="bucket1")
+        bucket1.save()
+        self.assertEqual(bucket1.signatureHash, CrashSignature.getSignatureHash(testSignature1))
+        self.assertEqual(bucket1.signatureHash, CrashSignature.getSignatureHash(testSignature1Reformatted))
+        self.assertNotEqual(bucket1.signatureHash, CrashSignature.getSignatureHash(testSignature2))
+
+        # New buckets with equivalent signatures are duplicates
+        self.assertEqual(Bucket(signature=testSignature1Reformatted).getDuplicate(), bucket1)
+        self.assertEqual(Bucket(signature=testSignature2).getDuplicate(), None)
+
+        # Buckets that are already equivalent stay editable
+        bucket2 = Bucket(signature=testSignature1Reformatted, shortDescription="bucket2")
+        bucket2.save()
+        bucket2 = Bucket.objects.get(pk=bucket2.pk)
+        self.assertEqual(bucket2.getDuplicate(), None)
+
+        # Changing the signature of a bucket to an equivalent one is rejected
+        bucket3 = Bucket(signature=testSignature2, shortDescription="bucket3")
+        bucket3.save()
+        bucket3 = Bucket.objects.get(pk=bucket3.pk)
+        bucket3.signature = testSignature1
+        self.assertTrue(bucket3.getDuplicate() in (bucket1, bucket2))
+
+        User.objects.create_user("test", "test@example.com", "test")
+        self.client.login(username="test", password="test")
+
+        response = self.client.post(reverse("crashmanager:sigedit", kwargs={ "sigid" : bucket2.pk }),
+                                    { "signature" : bucket2.signature, "shortDescription" : "renamed", "submit_save" : "1" })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Bucket.objects.get(pk=bucket2.pk).shortDescription, "renamed")
+
+        response = self.client.post(reverse("crashmanager:sigedit", kwargs={ "sigid" : bucket3.pk }),
+                                    { "signature" : testSignature1, "shortDescription" : "bucket3", "submit_save" : "1" })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Signature already exists" in response.content)
+        self.assertEqual(Bucket.objects.get(pk=bucket3.pk).signature, testSignature2)
+
+        response = self.client.post(reverse("crashmanager:signew"),
+                                    { "signature" : testSignature1Reformatted, "shortDescription" : "new", "submit_save" : "1" })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bucket.objects.count(), 3)
+
+class TriageTest(DjangoTestCase):
+    def runTest(self):
+        # The first entry matches both buckets, the second one only the first bucket
+        entry1 = createCrashEntry(rawCrashData=asanTraceCrash)
+        entry2 = createCrashEntry(rawCrashData=asanTraceCrash.replace("0x00000014", "0x00001014"))
+        entry3 = createCrashEntry(rawCrashData=asanTraceCrash.replace("EvalFrame", "Interpret"))
+        entry4 = createCrashEntry(rawStderr="nothing to see here")
+        entries = [ entry1, entry2, entry3, entry4 ]
+
+        # Entries are matched without creating model instances
+        entryValues = list(CrashEntry.objects.filter(pk__in=[ entry.pk for entry in entries ]).order_by('pk').values(*triage.ENTRY_FIELDS))
+        for (entry, values) in zip(entries, entryValues):
+            crashInfo = triage.getCrashInfo(values)
+            self.assertEqual(crashInfo.crashAddress, entry.getCrashInfo().crashAddress)
+            self.assertEqual(list(crashInfo.backtrace), list(entry.getCrashInfo().backtrace))
+
+        matcher = triage.BucketMatcher([ testSignature1, testSignature2 ])
+        self.assertEqual(matcher.matchEntries(entryValues), [ (entry1.pk, 1), (entry2.pk, 0), (entry3.pk, 1), (entry4.pk, None) ])
+
+        # The testcase is only loaded for signatures that need it, and only once per crash
+        loads = []
+        def loadTestcase():
+            loads.append(True)
+            return LineBuffer([ "foo();", "bar();" ])
+
+        matcher = triage.BucketMatcher([ testSignature2, '{"symptoms" : [ { "type" : "testcase", "value" : "bar" } ] }',
+                                         '{"symptoms" : [ { "type" : "testcase", "value" : "baz" } ] }' ])
+        self.assertEqual(matcher.match(triage.getCrashInfo(entryValues[0]), loadTestcase), 1)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(matcher.match(triage.getCrashInfo(entryValues[3]), loadTestcase), 1)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(matcher.match(triage.getCrashInfo(entryValues[3])), None)
+
+        bucket1 = Bucket(signature=testSignature1)
+        bucket1.save()
+        bucket2 = Bucket(signature=testSignature2)
+        bucket2.save()
+
+        # The result must not depend on the number of processes or the chunks,
+        # updates are split into several queries.
+        oldUpdateBatchSize = triage.UPDATE_BATCH_SIZE
+        triage.UPDATE_BATCH_SIZE = 1
+        try:
+            for processes in (1, 2):
+                for buckets in ([ bucket1, bucket2 ], [ bucket2, bucket1 ]):
+                    CrashEntry.objects.update(bucket=None)
+                    assignedCount = triage.assignCrashEntries(CrashEntry.objects.filter(bucket=None), buckets,
+                                                              processes=processes, chunkSize=1)
+                    self.assertEqual(assignedCount, 3)
+
+                    # If several buckets match, the last one wins
+                    self.assertEqual(CrashEntry.objects.get(pk=entry1.pk).bucket, buckets[1])
+                    self.assertEqual(CrashEntry.objects.get(pk=entry2.pk).bucket, bucket1)
+                    self.assertEqual(CrashEntry.objects.get(pk=entry3.pk).bucket, bucket2)
+                    self.assertEqual(CrashEntry.objects.get(pk=entry4.pk).bucket, None)
+
+                    # Entries already in their bucket are not counted again
+                    self.assertEqual(triage.assignCrashEntries(CrashEntry.objects.all(), buckets, processes=processes), 0)
+
+                    # Missing crash information is stored while matching
+                    CrashEntry.objects.filter(pk=entry1.pk).update(cachedCrashInfo=None, bucket=None)
+                    self.assertEqual(triage.assignCrashEntries(CrashEntry.objects.filter(bucket=None), buckets,
+                                                               processes=processes), 1)
+                    self.assertEqual(json.loads(CrashEntry.objects.get(pk=entry1.pk).cachedCrashInfo)["crashAddress"], 0x14)
+        finally:
+            triage.UPDATE_BATCH_SIZE = oldUpdateBatchSize
+
+class SignatureExportTest(DjangoTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        user = User.objects.create_user("test", "test@example.com", "test")
+        auth = { "HTTP_AUTHORIZATION" : "Token %s" % Token.objects.create(user=user).key }
+        manifestUrl = "/crashmanager/rest/signatures/manifest/"
+        exportUrl = "/crashmanager/rest/signatures/export/"
+
+        bucket1 = Bucket(signature=testSignature1, shortDescription="bucket1")
+        bucket1.save()
+        bucket2 = Bucket(signature=testSignature2, shortDescription="bucket2")
+        bucket2.save()
+        createCrashEntry(rawCrashData=asanTraceCrash, bucket=bucket1)
+
+        response = self.client.get(manifestUrl, **auth)
+        self.assertEqual(response.status_code, 200)
+        manifest = json.loads(response.content)
+        etag = response["ETag"]
+        self.assertEqual(sorted(manifest.keys()), sorted([ str(bucket1.pk), str(bucket2.pk) ]))
+
+        # Clients that are up to date only get a confirmation
+        response = self.client.get(manifestUrl, HTTP_IF_NONE_MATCH=etag, **auth)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # New crashes in a bucket don't change its hash
+        createCrashEntry(rawCrashData=asanTraceCrash, bucket=bucket1)
+        cache.clear()
+        response = self.client.get(manifestUrl, HTTP_IF_NONE_MATCH=etag, **auth)
+        self.assertEqual(response.status_code, 304)
+
+        # Changed buckets do, right away
+        bucket2.shortDescription = "renamed"
+        bucket2.save()
+        response = self.client.get(manifestUrl, HTTP_IF_NONE_MATCH=etag, **auth)
+        self.assertEqual(response.status_code, 200)
+        newManifest = json.loads(response.content)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(newManifest[str(bucket1.pk)], manifest[str(bucket1.pk)])
+        self.assertNotEqual(newManifest[str(bucket2.pk)], manifest[str(bucket2.pk)])
+
+        # Buckets that don't exist are omitted from the export
+        response = self.client.get(exportUrl, { "ids" : "%s,%s,%s" % (bucket1.pk, bucket2.pk, bucket2.pk + 100) }, **auth)
+        self.assertEqual(response.status_code, 200)
+        exported = json.loads(response.content)
+        self.assertEqual(sorted(exported.keys()), sorted(newManifest.keys()))
+        self.assertEqual(exported[str(bucket1.pk)]["signature"], testSignature1)
+        self.assertEqual(exported[str(bucket1.pk)]["hash"], newManifest[str(bucket1.pk)])
+        self.assertEqual(json.loads(exported[str(bucket1.pk)]["metadata"])["size"], 2)
+        self.assertEqual(json.loads(exported[str(bucket2.pk)]["metadata"])["shortDescription"], "renamed")
+
+        self.assertEqual(self.client.get(exportUrl, { "ids" : "1,foo" }, **auth).status_code, 400)
+        self.assertEqual(self.client.get(exportUrl, { "ids" : ",".join([ str(x) for x in range(MAX_EXPORT_COUNT + 1) ]) }, **auth).status_code, 400)
+        self.assertEqual(self.client.get(manifestUrl).status_code, 401)
+
+class BulkSubmissionTest(DjangoTestCase):
+    def createSubmission(self, **kwargs):
+        submission = { "rawStdout" : "", "rawStderr" : "", "rawCrashData" : asanTraceCrash, "platform" : "x86",
+                       "product" : "mozilla-central", "product_version" : "ba0bc4f26681", "os" : "linux",
+                       "client" : "client1", "tool" : "tool1" }
+        submission.update(kwargs)
+        return submission
+
+    def runTest(self):
+        user = User.objects.create_user("test", "test@example.com", "test")
+        auth = { "HTTP_AUTHORIZATION" : "Token %s" % Token.objects.create(user=user).key }
+        url = "/crashmanager/rest/crashes/bulk/"
+
+        def post(body):
+            return self.client.post(url, body, content_type="application/json", **auth)
+
+        response = post(json.dumps([ self.createSubmission(idempotency_key="key1"), self.createSubmission(idempotency_key="key2") ]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content), { "created" : 2, "duplicates" : 0 })
+        entry = CrashEntry.objects.get(idempotencyKey="key1")
+        self.assertEqual(entry.crashAddress, hex(0x14L))
+        self.assertEqual(entry.product.version, "ba0bc4f26681")
+        self.assertEqual(entry.client.name, "client1")
+
+        # Retries and duplicates within the batch are only stored once, also as NDJSON
+        submissions = [ self.createSubmission(idempotency_key="key2"), self.createSubmission(idempotency_key="key3"),
+                        self.createSubmission(idempotency_key="key3"), self.createSubmission() ]
+        response = post("\n".join([ json.dumps(submission) for submission in submissions ]) + "\n")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content), { "created" : 2, "duplicates" : 2 })
+        self.assertEqual(CrashEntry.objects.count(), 4)
+
+        # Invalid submissions are reported with their index and nothing is stored
+        testsDir = TestCase._meta.get_field("test").storage.path("tests")
+        testFiles = set(os.listdir(testsDir)) if os.path.isdir(testsDir) else set()
+
+        brokenTrace = "==5328==ERROR: AddressSanitizer: SEGV on unknown address 0x00000014 (pc 0x0810845f)"
+        for (invalid, message) in ((self.createSubmission(tool=None), "Missing field tool"),
+                                   (self.createSubmission(client="c" * 256), "Field client is longer than 255 characters"),
+                                   (self.createSubmission(idempotency_key="k" * 65), "Field idempotency_key is longer than 64 characters"),
+                                   (self.createSubmission(rawCrashData=brokenTrace), "Failed to isolate registers"),
+                                   (self.createSubmission(metadata={ "foo" : "bar" }), "Field metadata must be a string"),
+                                   (self.createSubmission(args=[ "--foo" ]), "Field args must be a string"),
+                                   (self.createSubmission(testcase="foo", testcase_ext="js", testcase_isbinary="false"),
+                                    "Field testcase_isbinary must be a boolean"),
+                                   (self.createSubmission(testcase="foo"), "Must provide testcase extension")):
+            response = post(json.dumps([ self.createSubmission(idempotency_key="key4", testcase="bar", testcase_ext="js"),
+                                         invalid ]))
+            self.assertEqual(response.status_code, 400)
+            result = json.loads(response.content)
+            self.assertEqual(result["index"], 1)
+            self.assertIn(message, result["detail"])
+
+        self.assertEqual(CrashEntry.objects.count(), 4)
+        self.assertFalse(CrashEntry.objects.filter(idempotencyKey="key4").exists())
+        self.assertFalse(TestCase.objects.exists())
+        self.assertEqual(set(os.listdir(testsDir)) if os.path.isdir(testsDir) else set(), testFiles)
+
+        self.assertEqual(post("[ 1 ]").status_code, 400)
+        self.assertEqual(json.loads(post("{ \"foo\" : ").content)["index"], 0)
+
+        # Too many submissions are rejected as a whole
+        response = post(json.dumps([ self.createSubmission() ] * (MAX_BULK_SIZE + 1)))
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("index", json.loads(response.content))
+        self.assertEqual(CrashEntry.objects.count(), 4)
+
+        self.assertEqual(self.client.post(url, "[]", content_type="application/json").status_code, 401)
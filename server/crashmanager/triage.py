@@ -0,0 +1,285 @@
+from crashmanager.models import CrashEntry, TestCase
+from django.db import connection, transaction
+from FTB.ProgramConfiguration import ProgramConfiguration
+from FTB.Signatures.CrashInfo import CrashInfo
+from FTB.Signatures.LineBuffer import MappedLineBuffer
+from FTB.Signatures.LiteralPrefilter import LiteralPrefilter
+from FTB.Signatures.OutputMatcher import OutputMatcher
+from FTB.Signatures.SignatureCache import signatureCache
+from FTB.Signatures.SignatureDispatch import SignatureDispatch
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+import json
+
+# Number of entries sent to a worker process at once
+DEFAULT_CHUNK_SIZE = 64
+
+# Number of chunks per worker process that are fetched ahead of the results
+PENDING_CHUNKS_PER_PROCESS = 2
+
+# Maximum number of entries updated by one query, SQLite only supports
+# a limited number of variables per query.
+UPDATE_BATCH_SIZE = 500
+
+# Fields of CrashEntry (and related models) needed to match an entry
+ENTRY_FIELDS = ('pk', 'rawStdout', 'rawStderr', 'rawCrashData', 'cachedCrashInfo',
+                'product__name', 'product__version', 'platform__name', 'os__name',
+                'testcase__test', 'testcase__isBinary')
+
+class BucketMatcher():
+    '''
+    Matches crashes against a fixed list of signatures. Only the signatures
+    that apply to the configuration and top frame of a crash and whose required
+    literals appear in it are matched. If multiple signatures match a crash,
+    the last one (in the given order) wins.
+    '''
+    def __init__(self, rawSignatures):
+        '''
+        @type rawSignatures: list
+        @param rawSignatures: Signatures to match against, in order
+        '''
+        self.signatures = [signatureCache.getSignature(rawSignature) for rawSignature in rawSignatures]
+        self.needTests = [signature.matchRequiresTest() for signature in self.signatures]
+        self.dispatch = SignatureDispatch(self.signatures)
+        self.prefilter = LiteralPrefilter(self.signatures)
+        self.outputMatcher = OutputMatcher(self.signatures)
+
+    def match(self, crashInfo, loadTestcase=None):
+        '''
+        Find the signature matching the given crash.
+
+        @type crashInfo: CrashInfo
+        @param crashInfo: The crash to match
+        @type loadTestcase: function
+        @param loadTestcase: Optional function returning the testcase of the crash,
+                             only called if a symptom of a candidate signature
+                             requires it. It is called at most once per crash.
+
+        @rtype: int
+        @return: Index of the matching signature, or None
+        '''
+        dispatchCandidates = set(self.dispatch.getCandidates(crashInfo))
+        candidates = [idx for idx in self.prefilter.getCandidates(crashInfo) if idx in dispatchCandidates]
+        symptomResults = self.outputMatcher.match(crashInfo, candidates)
+        haveTest = False
+
+        # Test candidates in reverse, so the first match is the last matching signature
+        for idx in reversed(candidates):
+            if self.needTests[idx] and not haveTest:
+                if loadTestcase != None:
+                    # Attached lazily, the crash info keeps the loaded testcase
+                    crashInfo.testcase = loadTestcase
+                symptomResults = self.outputMatcher.match(crashInfo, candidates)
+                haveTest = True
+
+            if self.signatures[idx].matches(crashInfo, symptomResults):
+                return idx
+
+        return None
+
+    def matchEntries(self, entries, updates=None):
+        '''
+        Match crash entries, given as dictionaries of the values of L{ENTRY_FIELDS}.
+
+        @type entries: list
+        @param entries: Crash entries to match
+        @type updates: list
+        @param updates: Optional list to collect crash information to store, see L{getCrashInfo}
+
+        @rtype: list
+        @return: List of tuples (entry pk, matching signature index or None)
+        '''
+        results = []
+
+        for entry in entries:
+            crashInfo = getCrashInfo(entry, updates)
+
+            testcasePath = None
+            if entry['testcase__test'] and not entry['testcase__isBinary']:
+                testcasePath = TestCase._meta.get_field('test').storage.path(entry['testcase__test'])
+
+            def loadTestcase(testcasePath=testcasePath):
+                if testcasePath == None:
+                    return None
+                return MappedLineBuffer.fromFile(testcasePath)
+
+            results.append((entry['pk'], self.match(crashInfo, loadTestcase)))
+
+        return results
+
+def getCrashInfo(entry, updates=None):
+    '''
+    Get the crash information of a crash entry, given as dictionary of the
+    values of L{ENTRY_FIELDS}. This is equivalent to CrashEntry.getCrashInfo, except
+    that missing or outdated stored crash information is only collected, it
+    is stored with L{storeCrashInfo}.
+
+    @type updates: list
+    @param updates: If given, a tuple (entry pk, crash information as JSON) is
+                    appended if the stored crash information must be updated
+
+    @rtype: CrashInfo
+    @return: The crash information
+    '''
+    configuration = ProgramConfiguration(entry['product__name'], entry['platform__name'], entry['os__name'],
+                                         entry['product__version'])
+
+    crashInfo = None
+    if entry['cachedCrashInfo']:
+        crashInfo = CrashInfo.fromCacheObject(json.loads(entry['cachedCrashInfo']), entry['rawStdout'],
+                                              entry['rawStderr'], configuration, entry['rawCrashData'])
+
+    if crashInfo == None:
+        crashInfo = CrashInfo.fromRawCrashData(entry['rawStdout'], entry['rawStderr'], configuration, entry['rawCrashData'])
+
+        if updates != None:
+            try:
+                updates.append((entry['pk'], json.dumps(crashInfo.toCacheObject(), separators=(",", ":"))))
+            except RuntimeError:
+                # Crashes that fail to parse have nothing to store
+                pass
+
+    return crashInfo
+
+def storeCrashInfo(updates):
+    '''
+    Store the crash information collected by L{getCrashInfo}.
+
+    @type updates: list
+    @param updates: List of tuples (entry pk, crash information as JSON)
+    '''
+    with transaction.atomic():
+        for (entryPk, cachedCrashInfo) in updates:
+            CrashEntry.objects.filter(pk=entryPk).update(cachedCrashInfo=cachedCrashInfo)
+
+def updateCrashInfo(entries, chunkSize=DEFAULT_CHUNK_SIZE):
+    '''
+    Store the crash information of all given crash entries that don't have it
+    yet or whose crash information was created by a different parser version.
+
+    @type entries: QuerySet
+    @param entries: CrashEntry objects to update
+
+    @type chunkSize: int
+    @param chunkSize: Number of entries updated in one transaction
+
+    @rtype: int
+    @return: Number of entries that were updated
+    '''
+    updatedCount = 0
+
+    for chunk in _getChunks(entries.values(*ENTRY_FIELDS).iterator(), chunkSize):
+        updates = []
+        for entry in chunk:
+            getCrashInfo(entry, updates)
+        storeCrashInfo(updates)
+        updatedCount += len(updates)
+
+    return updatedCount
+
+# The matcher of a worker process, created once by _initWorker
+_workerMatcher = None
+
+def _initWorker(rawSignatures):
+    global _workerMatcher
+    _workerMatcher = BucketMatcher(rawSignatures)
+
+def _matchEntriesWorker(entries):
+    updates = []
+    results = _workerMatcher.matchEntries(entries, updates)
+    return (results, updates)
+
+def _getChunks(iterable, chunkSize):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunkSize))
+        if not chunk:
+            return
+        yield chunk
+
+def assignCrashEntries(entries, buckets, processes=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    '''
+    Try to assign each of the given crash entries to one of the given buckets.
+
+    Each entry is parsed only once and matched with a L{BucketMatcher}. The
+    entries are partitioned into chunks that are matched by a pool of worker
+    processes, each holding its own compiled set of signatures. The result for
+    each entry does not depend on the partitioning: If multiple buckets match
+    an entry, the last one (in the given order) wins. Entries whose bucket
+    changed are updated in bulk, with one query per bucket. Crash information
+    that had to be parsed again is stored with the entries, one transaction
+    per chunk.
+
+    @type entries: QuerySet
+    @param entries: CrashEntry objects to assign
+
+    @type buckets: list
+    @param buckets: Bucket objects to match the entries against
+
+    @type processes: int
+    @param processes: Number of worker processes, defaults to the number of CPUs.
+                      With a single process, entries are matched in this process.
+
+    @type chunkSize: int
+    @param chunkSize: Number of entries sent to a worker process at once
+
+    @rtype: int
+    @return: Number of entries that were assigned to a bucket
+    '''
+    buckets = list(buckets)
+    rawSignatures = [bucket.signature for bucket in buckets]
+
+    if processes == None:
+        processes = cpu_count()
+
+    # Fetch only the fields needed for matching, without creating model instances
+    entries = entries.values(*ENTRY_FIELDS).iterator()
+    chunks = _getChunks(entries, chunkSize)
+
+    # Entries grouped by their new bucket for the update
+    assignments = {}
+
+    def processChunkResult(chunkResult):
+        (results, updates) = chunkResult
+        storeCrashInfo(updates)
+        for (entryPk, bucketIdx) in results:
+            if bucketIdx != None:
+                assignments.setdefault(buckets[bucketIdx].pk, []).append(entryPk)
+
+    if processes > 1:
+        # Worker processes must not share our database connection,
+        # it is reopened on the next query.
+        connection.close()
+
+        pool = Pool(processes, _initWorker, (rawSignatures,))
+        try:
+            # Fetch the entries in this thread while the workers are busy, but only
+            # a few chunks ahead, so we never hold all entries in memory. The
+            # results are processed in order, so our result is deterministic.
+            asyncResults = deque()
+            for chunk in chunks:
+                asyncResults.append(pool.apply_async(_matchEntriesWorker, (chunk,)))
+                if len(asyncResults) >= processes * PENDING_CHUNKS_PER_PROCESS:
+                    processChunkResult(asyncResults.popleft().get())
+            for asyncResult in asyncResults:
+                processChunkResult(asyncResult.get())
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        matcher = BucketMatcher(rawSignatures)
+        for chunk in chunks:
+            updates = []
+            results = matcher.matchEntries(chunk, updates)
+            processChunkResult((results, updates))
+
+    assignedCount = 0
+
+    for (bucketPk, entryPks) in assignments.items():
+        for idx in range(0, len(entryPks), UPDATE_BATCH_SIZE):
+            # Entries already in the bucket are not counted (and not updated)
+            batch = CrashEntry.objects.filter(pk__in=entryPks[idx:idx + UPDATE_BATCH_SIZE]).exclude(bucket=bucketPk)
+            assignedCount += batch.update(bucket=bucketPk)
+
+    return assignedCount
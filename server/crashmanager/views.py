@@ -1,4 +1,6 @@
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
 from crashmanager.serializers import BucketSerializer, CrashEntrySerializer
 from crashmanager.models import CrashEntry, Bucket, BugProvider, Bug, Tool, User
 from django.contrib.auth import logout
@@ -11,6 +13,10 @@ from django.db.models import Q
 from django.db.models.aggregates import Count, Min
 from django.http.response import Http404
 from rest_framework.authentication import TokenAuthentication
+from crashmanager.triage import assignCrashEntries
+from crashmanager.export import getExportedFiles, getManifest, MAX_EXPORT_COUNT
+from crashmanager.ingest import BulkSubmissionError, createCrashEntries, parseBulkSubmissions, MAX_BULK_SIZE
+from FTB.Signatures.LiteralPrefilter import LiteralPrefilter
 from datetime import datetime, timedelta
 import operator
 
@@ -168,14 +174,8 @@ def autoAssignCrashEntries(request):
     entries = CrashEntry.objects.filter(bucket=None)
     buckets = Bucket.objects.all()
     
-    for bucket in buckets:
-        signature = bucket.getSignature()
-        needTest = signature.matchRequiresTest()
-        
-        for entry in entries:
-            if signature.matches(entry.getCrashInfo(attachTestcase=needTest)):
-                entry.bucket = bucket
-                entry.save()
+    # Don't fork worker processes from a request handler, triage_new_crashes does that
+    assignCrashEntries(entries, buckets, processes=1)
     
     return redirect('crashmanager:crashes')
 
@@ -261,6 +261,12 @@ def __handleSignaturePost(request, bucket):
         data = { 'bucket' : bucket, 'error_message' : 'Signature is not valid: %s' % e }
         return render(request, 'signatures/edit.html', data)
     
+    # Equivalent signatures would only compete for the same crashes
+    duplicate = bucket.getDuplicate()
+    if duplicate != None:
+        data = { 'bucket' : bucket, 'error_message' : 'Signature already exists in bucket %s' % duplicate.pk }
+        return render(request, 'signatures/edit.html', data)
+    
     # Only save if we hit "save" (not e.g. "preview")
     if 'submit_save' in request.POST:
         bucket.save()
@@ -276,10 +282,12 @@ def __handleSignaturePost(request, bucket):
         
         signature = bucket.getSignature()
         needTest = signature.matchRequiresTest()
-        entries = CrashEntry.objects.filter(Q(bucket=None) | Q(bucket=bucket))
+        entries = list(CrashEntry.objects.filter(Q(bucket=None) | Q(bucket=bucket)))
+        
+        # Match all entries at once, this is a lot faster than one by one
+        matches = signature.matchesMany([entry.getCrashInfo(attachTestcase=needTest, updateCache=True) for entry in entries])
         
-        for entry in entries:
-            match = signature.matches(entry.getCrashInfo(attachTestcase=needTest))
+        for (entry, match) in zip(entries, matches):
             if match and entry.bucket == None:
                 inCount += 1
                 if 'submit_save' in request.POST:
@@ -492,7 +500,7 @@ def trySignature(request, sigid, crashid):
     entry = get_object_or_404(CrashEntry, pk=crashid)
     
     signature = bucket.getSignature()
-    entry.crashinfo = entry.getCrashInfo(attachTestcase=signature.matchRequiresTest())
+    entry.crashinfo = entry.getCrashInfo(attachTestcase=signature.matchRequiresTest(), updateCache=True)
     
     symptoms = signature.getSymptomsDiff(entry.crashinfo)
     
@@ -502,70 +510,75 @@ def trySignature(request, sigid, crashid):
 def findSignatures(request, crashid):
     entry = get_object_or_404(CrashEntry, pk=crashid)
     
-    entry.crashinfo = entry.getCrashInfo(attachTestcase=True)
+    entry.crashinfo = entry.getCrashInfo(attachTestcase=True, updateCache=True)
     
-    buckets = Bucket.objects.all()
+    buckets = list(Bucket.objects.all())
+    signatures = [bucket.getSignature() for bucket in buckets]
     similarBuckets = []
     matchingBucket = None
     
-    for bucket in buckets:
-        signature = bucket.getSignature()
-        distance = signature.getDistance(entry.crashinfo)
-        
-        # We found a matching bucket, no need to display/calculate similar buckets
-        if distance == 0:
-            matchingBucket = bucket
+    # A bucket with distance 0 must contain all of its required literals, so we
+    # first look for a matching bucket among the candidates of the prefilter.
+    prefilter = LiteralPrefilter(signatures)
+    for idx in prefilter.getCandidates(entry.crashinfo):
+        if signatures[idx].getDistance(entry.crashinfo) == 0:
+            matchingBucket = buckets[idx]
             break
-            
-        # TODO: This could be made configurable through a GET parameter
-        if distance <= 4:
-            proposedCrashSignature = signature.fit(entry.crashinfo)
-            if proposedCrashSignature:
-                # We now try to determine how this signature will behave in other buckets
-                # If the signature matches lots of other buckets as well, it is likely too
-                # broad and we should not consider it (or later rate it worse than others).
-                matchesInOtherBuckets = 0
-                nonMatchesInOtherBuckets = 0
-                otherMatchingBucketIds = []
-                for otherBucket in buckets:
-                    if otherBucket.pk == bucket.pk:
-                        continue
+    
+    # Only if no bucket matches, we need to determine the similar buckets
+    if not matchingBucket:
+        for (bucket, signature) in zip(buckets, signatures):
+            distance = signature.getDistance(entry.crashinfo)
+        
+            # TODO: This could be made configurable through a GET parameter
+            if distance <= 4:
+                proposedCrashSignature = signature.fit(entry.crashinfo)
+                if proposedCrashSignature:
+                    # We now try to determine how this signature will behave in other buckets
+                    # If the signature matches lots of other buckets as well, it is likely too
+                    # broad and we should not consider it (or later rate it worse than others).
+                    matchesInOtherBuckets = 0
+                    nonMatchesInOtherBuckets = 0
+                    otherMatchingBucketIds = []
+                    for otherBucket in buckets:
+                        if otherBucket.pk == bucket.pk:
+                            continue
                     
-                    bucketEntries = CrashEntry.objects.filter(bucket=otherBucket)
-                    firstEntry = list(bucketEntries[:1])
-                    if firstEntry:
-                        firstEntry = firstEntry[0]
-                        # Omit testcase for performance reasons for now
-                        if proposedCrashSignature.matches(firstEntry.getCrashInfo(attachTestcase=False)):
-                            matchesInOtherBuckets += 1
-                            otherMatchingBucketIds.append(otherBucket.pk)
-                        else:
-                            nonMatchesInOtherBuckets += 1
+                        bucketEntries = CrashEntry.objects.filter(bucket=otherBucket)
+                        firstEntry = list(bucketEntries[:1])
+                        if firstEntry:
+                            firstEntry = firstEntry[0]
+                            # Omit testcase for performance reasons for now
+                            if proposedCrashSignature.matches(firstEntry.getCrashInfo(attachTestcase=False)):
+                                matchesInOtherBuckets += 1
+                                otherMatchingBucketIds.append(otherBucket.pk)
+                            else:
+                                nonMatchesInOtherBuckets += 1
                 
-                bucket.offCount = distance
+                    bucket.offCount = distance
                 
-                if matchesInOtherBuckets+nonMatchesInOtherBuckets > 0:
-                    bucket.foreignMatchPercentage = round((float(matchesInOtherBuckets) / (matchesInOtherBuckets+nonMatchesInOtherBuckets)) * 100, 2)
-                else:
-                    bucket.foreignMatchPercentage = 0
+                    if matchesInOtherBuckets+nonMatchesInOtherBuckets > 0:
+                        bucket.foreignMatchPercentage = round((float(matchesInOtherBuckets) / (matchesInOtherBuckets+nonMatchesInOtherBuckets)) * 100, 2)
+                    else:
+                        bucket.foreignMatchPercentage = 0
                     
-                bucket.foreignMatchCount = matchesInOtherBuckets
+                    bucket.foreignMatchCount = matchesInOtherBuckets
                 
-                if matchesInOtherBuckets == 0:
-                    bucket.foreignColor = "green"
-                elif matchesInOtherBuckets < 3:
-                    bucket.foreignColor = "yellow"
-                else:
-                    bucket.foreignColor = "red"    
+                    if matchesInOtherBuckets == 0:
+                        bucket.foreignColor = "green"
+                    elif matchesInOtherBuckets < 3:
+                        bucket.foreignColor = "yellow"
+                    else:
+                        bucket.foreignColor = "red"    
                 
-                # Set a limit to linking to the other matching buckets. It only makes sense to look at these
-                # if the number is rather low and we would like to keep the URL short.
-                bucket.linkToOthers = None
-                if matchesInOtherBuckets <= 10:
-                    bucket.linkToOthers = ",".join([str(x) for x in otherMatchingBucketIds])
+                    # Set a limit to linking to the other matching buckets. It only makes sense to look at these
+                    # if the number is rather low and we would like to keep the URL short.
+                    bucket.linkToOthers = None
+                    if matchesInOtherBuckets <= 10:
+                        bucket.linkToOthers = ",".join([str(x) for x in otherMatchingBucketIds])
                 
                 
-                similarBuckets.append(bucket)
+                    similarBuckets.append(bucket)
     
     if matchingBucket:
         entry.bucket = matchingBucket
@@ -756,6 +769,41 @@ class CrashEntryViewSet(viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     queryset = CrashEntry.objects.all()
     serializer_class = CrashEntrySerializer
+    
+    def create(self, request, *args, **kwargs):
+        # A submission that is retried after a failure carries the same idempotency
+        # key. If we already stored it, respond with the existing entry instead.
+        idempotencyKey = request.DATA.get('idempotency_key')
+        if idempotencyKey:
+            entry = CrashEntry.objects.filter(idempotencyKey=idempotencyKey).first()
+            if entry != None:
+                return Response(self.get_serializer(entry).data, status=status.HTTP_200_OK)
+        
+        return super(CrashEntryViewSet, self).create(request, *args, **kwargs)
+    
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Create crash entries for many submissions at once. The body is either a
+        JSON array or newline delimited JSON objects, each with the same fields
+        as a single submission. All entries are created in one transaction.
+        """
+        body = ""
+        if request.stream != None:
+            body = request.stream.read()
+        
+        try:
+            submissions = parseBulkSubmissions(body)
+            
+            if len(submissions) > MAX_BULK_SIZE:
+                return Response({ 'detail' : 'At most %s crashes can be submitted at once' % MAX_BULK_SIZE },
+                                status=status.HTTP_400_BAD_REQUEST)
+            
+            (created, duplicates) = createCrashEntries(submissions)
+        except BulkSubmissionError, e:
+            return Response({ 'detail' : str(e), 'index' : e.index }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({ 'created' : created, 'duplicates' : duplicates }, status=status.HTTP_201_CREATED)
 
 class BucketViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -764,3 +812,42 @@ class BucketViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = (TokenAuthentication,)
     queryset = Bucket.objects.all()
     serializer_class = BucketSerializer
+    
+    @list_route()
+    def manifest(self, request):
+        """
+        Hashes of all exported signatures and their metadata, by bucket id.
+        Supports conditional requests, so clients that are up to date only
+        get an empty response.
+        """
+        (manifest, etag) = getManifest()
+        
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(manifest)
+        
+        response['ETag'] = etag
+        return response
+    
+    @list_route()
+    def export(self, request):
+        """
+        Exported signatures and their metadata for the bucket ids given as
+        comma separated list in the "ids" parameter. Ids of buckets that
+        don't exist (anymore) are omitted from the result.
+        """
+        try:
+            ids = [int(x) for x in request.QUERY_PARAMS.get('ids', '').split(',') if x]
+        except ValueError:
+            return Response({ 'detail' : 'Invalid bucket id' }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(ids) > MAX_EXPORT_COUNT:
+            return Response({ 'detail' : 'At most %s signatures can be exported at once' % MAX_EXPORT_COUNT },
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        result = {}
+        for (bucket, signature, metadata, exportHash) in getExportedFiles(Bucket.objects.filter(pk__in=ids)):
+            result[str(bucket.pk)] = { 'signature' : signature, 'metadata' : metadata, 'hash' : exportHash }
+        
+        return Response(result)